@@ -5,13 +5,21 @@
 # ----------------------------------------
 
 import os
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 
+from app.config.settings import settings
+from app.core.types import ChatChunk, Message
+from app.core.streaming import coalesce_chunks
+from app.core.prompts import fit_messages
+
 # --- RAG 用 ---
-import chromadb
-from sentence_transformers import SentenceTransformer
+# chromadb / sentence_transformers(torch) は重いので裏スレッドで読み込む（画面表示を待たせない）
 
 # ========================================
 # ページ設定
@@ -28,18 +36,40 @@ if "model" not in st.session_state:
 # - PersistentClient でローカル永続
 # - e5 は日本語に強い多言語埋め込み
 # ========================================
-@st.cache_resource
-def get_vectordb():
+def load_vectordb():
+    t0 = time.perf_counter()
+    import chromadb
+    from sentence_transformers import SentenceTransformer
+
     client = chromadb.PersistentClient(path="chroma_db")
     col = client.get_or_create_collection("rag_docs", metadata={"hnsw:space": "cosine"})
     embed = SentenceTransformer("intfloat/multilingual-e5-small")
+    embed.encode(["query: warmup"], normalize_embeddings=True)  # 初回推論の初期化も済ませる
+    print(f"[STARTUP] vectordb ready in {time.perf_counter() - t0:.2f}s")
     return client, col, embed
 
-client, col, embed = get_vectordb()
+@st.cache_resource
+def start_vectordb():
+    """最初のスクリプト実行で読み込みを始め、Future を全セッションで共有"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="vectordb").submit(load_vectordb)
+
+vectordb = start_vectordb()
+
+@st.cache_resource
+def get_http_session():
+    """全セッション共有の keep-alive 接続プール（毎ターンの TCP 接続を避ける）"""
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=32)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+http = get_http_session()
 
 def retrieve_context(query: str, top_k: int = 6):
     """e5 の推奨プレフィックスを使って検索→上位k件を連結"""
     try:
+        client, col, embed = vectordb.result()  # 読み込み中ならここで待つ
         qvec = embed.encode([f"query: {query}"], normalize_embeddings=True).tolist()[0]
         res = col.query(
             query_embeddings=[qvec],
@@ -74,9 +104,9 @@ with st.sidebar:
     def list_ollama_models(url: str):
         """Ollama の /api/tags からモデル一覧を取得（失敗時は空配列）"""
         try:
-            r = requests.get(url.rstrip("/") + "/api/tags", timeout=5)
+            r = http.get(url.rstrip("/") + "/api/tags", timeout=(5, 5))
             r.raise_for_status()
-            data = r.json()
+            data = orjson.loads(r.content)
             return sorted([m["name"] for m in data.get("models", [])])
         except Exception:
             return []
@@ -93,10 +123,28 @@ with st.sidebar:
     # 選択/入力値を状態へ保存（下の推論で使用）
     st.session_state.model = model
 
+    @st.cache_resource(show_spinner=False)
+    def preload_model(url: str, name: str):
+        """空の messages で /api/chat を呼ぶとモデルだけ読み込まれる（URL × モデルごとに裏で1回）"""
+        def run():
+            t0 = time.perf_counter()
+            try:
+                http.post(url.rstrip("/") + "/api/chat", timeout=(5, 600), json={
+                    "model": name, "messages": [], "stream": False,
+                    "keep_alive": os.environ.get("OLLAMA_KEEP_ALIVE", "30m"),
+                }).raise_for_status()
+                print(f"[STARTUP] preload {name} in {time.perf_counter() - t0:.2f}s")
+            except Exception as e:
+                print(f"[WARMUP] preload failed {name}: {type(e).__name__}: {e}")
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="preload").submit(run)
+
+    if os.environ.get("OLLAMA_WARMUP", "1") == "1" and model:
+        preload_model(base_url, model)
+
     temperature = st.slider("温度 (創造性)", 0.0, 1.0, 0.2, 0.1)
     num_ctx = st.number_input(
-        "コンテキスト長 (num_ctx)", min_value=2048, max_value=32768, value=8192, step=1024,
-        help="長くすると過去の文脈をより保持（モデルの上限に注意）"
+        "コンテキスト長の上限 (num_ctx)", min_value=2048, max_value=32768, value=8192, step=1024,
+        help="実際の num_ctx はプロンプト長から上限以下のバケットで選ぶ。収まらない古い履歴は送らない（モデルの上限に注意）"
     )
 
     # 日本語アシスタントの既定 System Prompt（必要に応じて編集）
@@ -111,8 +159,6 @@ with st.sidebar:
         height=140,
     )
 
-    max_history = st.number_input("履歴上限（往復数）", 2, 50, 10, 1)
-
     col1, col2 = st.columns(2)
     with col1:
         if st.button("🧹 履歴クリア"):
@@ -127,29 +173,28 @@ with st.sidebar:
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-def truncated_history(messages, max_rounds):
-    """assistant/user の往復で上限を超えたら古いものから削る"""
-    if len(messages) <= max_rounds * 2:
-        return messages
-    return messages[-max_rounds * 2:]
-
 # ========================================
 # Ollama 呼び出し（ストリーミング & 例外処理）
 # ========================================
-def call_ollama(base_url, prompt, history, model, temperature, system_prompt, num_ctx=8192):
+def call_ollama(base_url, prompt, history, model, temperature, system_prompt, num_ctx=8192,
+                context="", keep_alive="30m"):
     url = base_url.rstrip("/") + "/api/chat"
 
-    msgs = []
-    if system_prompt:
-        msgs.append({"role": "system", "content": system_prompt})
-    # 履歴（user/assistantのみ）＋今回の user
-    msgs += [m for m in history if m["role"] in ("user", "assistant")]
-    msgs.append({"role": "user", "content": prompt})
+    # プロンプトの組み立てと num_ctx の選択は app/ 側と共通（system+履歴は毎ターン同一、資料は今回の user に付ける）
+    # 過去の user 発話は保存しておいた資料で送信時と同じ文字列に戻す → プレフィックスが毎ターン一致
+    history = [Message(role=m["role"], content=m["content"], context=m.get("context")) for m in history]
+    # 長さに応じて num_ctx を選び、収まらない古い履歴は送らない
+    msgs, num_ctx, _ = fit_messages(
+        system_prompt, prompt, history, context,
+        buckets=[int(b) for b in settings.num_ctx_buckets.split(",") if b.strip()],
+        reserve=settings.answer_reserve_tokens, max_num_ctx=int(num_ctx),
+    )
 
     payload = {
         "model": model,
-        "messages": msgs,
+        "messages": [m.to_api() for m in msgs],
         "stream": True,
+        "keep_alive": keep_alive,  # モデルを常駐させて KV キャッシュを保持
         "options": {
             "temperature": float(temperature),
             "num_ctx": int(num_ctx),
@@ -157,21 +202,21 @@ def call_ollama(base_url, prompt, history, model, temperature, system_prompt, nu
     }
 
     try:
-        with requests.post(url, json=payload, stream=True, timeout=600) as r:
+        with http.post(url, json=payload, stream=True, timeout=(5, 600)) as r:
             r.raise_for_status()
             for line in r.iter_lines():
                 if not line:
                     continue
-                data = json.loads(line.decode("utf-8"))
+                data = orjson.loads(line)
                 token = data.get("message", {}).get("content", "")
                 if token:
-                    yield token
+                    yield ChatChunk(content=token)
     except requests.exceptions.ConnectionError:
-        yield "⚠️ Ollama に接続できません。URL と起動状態(ollama serve)を確認してください。"
+        yield ChatChunk(content="⚠️ Ollama に接続できません。URL と起動状態(ollama serve)を確認してください。")
     except requests.exceptions.HTTPError as e:
-        yield f"⚠️ HTTPエラー: {e.response.status_code} {e.response.text[:200]}"
+        yield ChatChunk(content=f"⚠️ HTTPエラー: {e.response.status_code} {e.response.text[:200]}")
     except Exception as e:
-        yield f"⚠️ 予期せぬエラー: {type(e).__name__}: {e}"
+        yield ChatChunk(content=f"⚠️ 予期せぬエラー: {type(e).__name__}: {e}")
 
 # ========================================
 # 既存履歴の描画
@@ -189,33 +234,32 @@ if user_input := st.chat_input("メッセージを入力…"):
 
     # まずはユーザー発話を履歴へ
     st.session_state.messages.append({"role": "user", "content": user_input})
-    st.session_state.messages = truncated_history(st.session_state.messages, max_history)
 
     with st.chat_message("user"):
         st.markdown(user_input)
 
     # ---------- ★ RAG: 前処理・検索 ★ ----------
     context, sources = retrieve_context(user_input, top_k=4)
-    aug_system_prompt = (
-        system_prompt
-        + "\n\n# 参考資料（抜粋）\n"
-        + (context or "（該当資料なし）")
-        + "\n\n※上記の資料のみを根拠に、日本語で簡潔に回答してください。"
-        + "\n必要に応じて [番号] を使って根拠を示してください。"
-    )
+    # 資料は system ではなく今回の user 発話側に付ける（system+履歴は毎ターン同一）
     # --------------------------------------------
 
     with st.chat_message("assistant"):
         stream = call_ollama(
             base_url=base_url,
             prompt=user_input,                 # ユーザーの質問
-            history=st.session_state.messages,
+            history=st.session_state.messages[:-1],  # 今回の発話は除く（末尾に資料付きで足す）
             model=st.session_state.model,      # サイドバー選択モデル
             temperature=temperature,
-            system_prompt=aug_system_prompt,   # RAG文脈を同梱
+            system_prompt=system_prompt,          # 資料の置き方の説明は組み立て側で足す
             num_ctx=num_ctx,
+            context=context,
+            keep_alive=os.environ.get("OLLAMA_KEEP_ALIVE", "30m"),
         )
-        reply = st.write_stream(stream)
+        # 次ターン以降も同じプロンプトを再構成できるよう資料を保存
+        st.session_state.messages[-1]["context"] = context
+        # write_stream は yield ごとに全文の markdown を送り直すので、トークンをまとめてから渡す
+        frames = coalesce_chunks(stream, settings.stream_flush_ms, settings.stream_flush_chars)
+        reply = st.write_stream(f.content for f in frames if f.content)
 
     # 生成結果を会話メモリへ
     st.session_state.messages.append({"role": "assistant", "content": reply})
@@ -0,0 +1,191 @@
+# app/adapters/cache/answer_cache.py
+# ----------------------------------------
+# 回答キャッシュ（同じ資料・同じ会話文脈での言い換え質問に生成を省く）
+# - キー: モデル名 + 生成オプション + 参考資料 + 直前までの会話（system/履歴）の sha1
+# - 同じキーの中でクエリ埋め込みのコサイン類似度が閾値以上なら命中
+# - sqlite に永続化。TTL 超過と件数上限（最終利用が古い順）で追い出す
+# - ingest.py が世代を進めたら、マニフェスト上で内容ハッシュが変わった出典を使う回答を捨てる
+# ----------------------------------------
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from app.core.types import Message, CachedAnswer
+from app.adapters.rag.generation import GenerationWatcher
+from app.ingest.manifest import IngestManifest, manifest_path
+
+# 回答内容にほぼ影響しない（プロンプト長や常駐時間で変わる）オプションはキーから外す
+IGNORED_OPTIONS = ("num_ctx", "keep_alive")
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        path: str,
+        chroma_path: str = "chroma_db",
+        max_entries: int = 5000,
+        ttl: float = 86400,
+        threshold: float = 0.95,
+    ):
+        self.path = path
+        self.chroma_path = chroma_path
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self.threshold = float(threshold)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY, key TEXT, query TEXT, qvec BLOB, answer TEXT,"
+            " sources TEXT, created REAL, used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_key ON answers(key)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_used ON answers(used)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answer_sources (answer_id INTEGER, source TEXT, content_hash TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answer_sources_id ON answer_sources(answer_id)")
+        self._db.commit()
+        self.hits = self.misses = self.invalidated = self.evictions = 0
+        self.generation = GenerationWatcher(chroma_path)
+        self._source_hashes: Dict[str, str] = {}
+        # 起動前に行われたインジェストの分もここで反映する
+        self._refresh_sources()
+
+    # -------- キー --------
+    @staticmethod
+    def make_key(model: str, options: Dict[str, Any], context: str, prefix: Sequence[Message]) -> str:
+        """prefix は最新の user 発話より前のメッセージ（system + 履歴）"""
+        opts = {k: v for k, v in (options or {}).items() if k not in IGNORED_OPTIONS}
+        h = hashlib.sha1()
+        for part in (
+            model,
+            json.dumps(opts, sort_keys=True, ensure_ascii=False),
+            context or "",
+            json.dumps([m.to_api() for m in prefix], ensure_ascii=False),
+        ):
+            h.update(part.encode("utf-8", errors="ignore"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    # -------- 無効化 --------
+    def _refresh_sources(self):
+        manifest = IngestManifest(manifest_path(self.chroma_path))
+        self._source_hashes = {p: e.get("content_hash", "") for p, e in manifest.entries.items()}
+        with self._lock:
+            rows = self._db.execute("SELECT DISTINCT source, content_hash FROM answer_sources").fetchall()
+            stale = [(s, h) for s, h in rows if self._source_hashes.get(s, "") != h]
+            if not stale:
+                return
+            ids = set()
+            for s, h in stale:
+                ids.update(r[0] for r in self._db.execute(
+                    "SELECT answer_id FROM answer_sources WHERE source=? AND content_hash=?", (s, h)
+                ).fetchall())
+            self._delete_ids(ids)
+            self._db.commit()
+            self.invalidated += len(ids)
+        print(f"[ANSWER_CACHE] invalidated {len(ids)} answers ({len(stale)} sources changed)")
+
+    def _delete_ids(self, ids):
+        params = [(i,) for i in ids]
+        self._db.executemany("DELETE FROM answers WHERE id=?", params)
+        self._db.executemany("DELETE FROM answer_sources WHERE answer_id=?", params)
+
+    def _expire(self, now: float):
+        if self.ttl > 0:
+            ids = [r[0] for r in self._db.execute(
+                "SELECT id FROM answers WHERE created < ?", (now - self.ttl,)
+            ).fetchall()]
+            self._delete_ids(ids)
+            self.evictions += len(ids)
+        count = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if count > self.max_entries:
+            ids = [r[0] for r in self._db.execute(
+                "SELECT id FROM answers ORDER BY used LIMIT ?", (count - self.max_entries,)
+            ).fetchall()]
+            self._delete_ids(ids)
+            self.evictions += len(ids)
+
+    # -------- 公開API --------
+    def lookup(self, key: str, qvec) -> Optional[CachedAnswer]:
+        if self.generation.changed():
+            self._refresh_sources()
+        q = np.asarray(qvec, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, qvec, answer, sources, created FROM answers WHERE key=? AND created >= ?",
+                (key, now - self.ttl if self.ttl > 0 else 0),
+            ).fetchall()
+            best, best_sim = None, -1.0
+            for row in rows:
+                v = np.frombuffer(row[1], dtype=np.float32)
+                if v.shape != q.shape:
+                    continue
+                sim = float(v @ q)
+                if sim > best_sim:
+                    best, best_sim = row, sim
+            if best is None or best_sim < self.threshold:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE answers SET used=? WHERE id=?", (now, best[0]))
+            self._db.commit()
+            self.hits += 1
+        return CachedAnswer(answer=best[2], sources=json.loads(best[3]), similarity=best_sim, created=best[4])
+
+    def put(self, key: str, query: str, qvec, answer: str, sources: Sequence[str]):
+        q = np.asarray(qvec, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._db.execute(
+                    "INSERT INTO answers (key, query, qvec, answer, sources, created, used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, query, q.tobytes(), answer, json.dumps(list(sources), ensure_ascii=False), now, now),
+                )
+                self._db.executemany(
+                    "INSERT INTO answer_sources (answer_id, source, content_hash) VALUES (?, ?, ?)",
+                    [(cur.lastrowid, s, self._source_hashes.get(s, "")) for s in set(sources)],
+                )
+                self._expire(now)
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM answers")
+            self._db.execute("DELETE FROM answer_sources")
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidated": self.invalidated,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "threshold": self.threshold,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
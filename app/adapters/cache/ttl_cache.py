@@ -0,0 +1,55 @@
+# app/adapters/cache/ttl_cache.py
+# ----------------------------------------
+# スレッドセーフな LRU + TTL キャッシュ（ヒット率つき）
+# - Streamlit は複数セッションが同じ cache_resource を共有するためロック必須
+# ----------------------------------------
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from cachetools import TTLCache
+
+_MISSING = object()
+
+
+class StatsTTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache: TTLCache = TTLCache(maxsize=max(1, int(maxsize)), ttl=float(ttl))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            v = self._cache.get(key, _MISSING)
+            if v is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return v
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._cache[key] = value
+
+    def get_or_compute(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        v = self.get(key, _MISSING)
+        if v is _MISSING:
+            v = fn()
+            self.put(key, v)
+        return v
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        with self._lock:
+            size = len(self._cache)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": size,
+            "maxsize": int(self._cache.maxsize),
+        }
@@ -0,0 +1,83 @@
+# app/adapters/embeddings/batching.py
+# ----------------------------------------
+# トークン予算ベースの埋め込みバッチャ
+# - パッセージをトークン長でソートし、似た長さ同士でバッチを組む
+# - 1バッチのコスト = 最長トークン数 x 件数（パディング込み）を予算内に収める
+# - 結果は入力順に戻して返す
+# ----------------------------------------
+import time
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+
+class TokenBudgetBatcher:
+    def __init__(self, model, token_budget: int = 16384, max_batch: int = 256):
+        """
+        model: SentenceTransformer（tokenizer / max_seq_length / encode を使う）
+        token_budget: 1バッチあたりの (最長トークン長 x 件数) の上限
+        """
+        self.model = model
+        self.token_budget = int(token_budget)
+        self.max_batch = int(max_batch)
+        self.passages = 0
+        self.batches = 0
+        self.tokens = 0
+        self.seconds = 0.0
+
+    def token_lengths(self, texts: Sequence[str]) -> List[int]:
+        max_len = getattr(self.model, "max_seq_length", None) or 512
+        enc = self.model.tokenizer(
+            list(texts), add_special_tokens=True, truncation=True, max_length=max_len
+        )
+        return [len(ids) for ids in enc["input_ids"]]
+
+    def plan(self, lengths: Sequence[int]) -> List[List[int]]:
+        """長い順に並べ、予算を超えない範囲で詰めたインデックスのバッチ列"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+        batches: List[List[int]] = []
+        cur: List[int] = []
+        cur_max = 0
+        for i in order:
+            L = max(1, lengths[i])
+            new_max = max(cur_max, L)
+            if cur and (new_max * (len(cur) + 1) > self.token_budget or len(cur) >= self.max_batch):
+                batches.append(cur)
+                cur, new_max = [], L
+            cur.append(i)
+            cur_max = new_max
+        if cur:
+            batches.append(cur)
+        return batches
+
+    def encode(self, texts: Sequence[str], **encode_kwargs: Any) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        t0 = time.perf_counter()
+        lengths = self.token_lengths(texts)
+        out = None
+        encode_kwargs.setdefault("normalize_embeddings", True)
+        encode_kwargs.setdefault("show_progress_bar", False)
+        for idx in self.plan(lengths):
+            vecs = np.asarray(
+                self.model.encode([texts[i] for i in idx], batch_size=len(idx), **encode_kwargs),
+                dtype=np.float32,
+            )
+            if out is None:
+                out = np.empty((len(texts), vecs.shape[1]), dtype=np.float32)
+            out[idx] = vecs  # 元の順序へ戻す
+            self.batches += 1
+        self.passages += len(texts)
+        self.tokens += sum(lengths)
+        self.seconds += time.perf_counter() - t0
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "passages": self.passages,
+            "batches": self.batches,
+            "tokens": self.tokens,
+            "seconds": round(self.seconds, 3),
+            "passages_per_sec": round(self.passages / self.seconds, 1) if self.seconds else 0.0,
+        }
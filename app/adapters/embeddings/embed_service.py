@@ -0,0 +1,99 @@
+# app/adapters/embeddings/embed_service.py
+# ----------------------------------------
+# ローカル埋め込みサービス（1プロセスにモデル1つ。各 Streamlit ワーカー / ingest.py が共有する）
+# - GET  /health : {"model", "signature", "stats"}
+# - POST /embed  : {"kind": "query"|"passage"|"raw", "texts": [...]} → {"vectors": [[...]]}
+#     query   : "query: " を付けて埋め込む（サービス側のクエリキャッシュを使う。複数件は1回の encode）
+#     passage : "passage: " を付けて埋め込む（サービス側の埋め込みキャッシュを使う）
+#     raw     : prefix 付きのテキストをそのまま埋め込む（ingest.py が自前のキャッシュと組み合わせる）
+# - リクエストごとのスレッドから BatchingEmbedder に投げるので、同時に来た要求は1回の encode にまとまる
+# 起動は embed_server.py、クライアントは remote_embedder.RemoteEmbedder
+# ----------------------------------------
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import numpy as np
+import orjson
+
+KINDS = ("query", "passage", "raw")
+
+
+class EmbedServer:
+    def __init__(self, embedder, signature: str, host: str = "127.0.0.1", port: int = 8765):
+        """embedder: BatchingEmbedder（encode / embed_query / embed_texts / cache_stats）"""
+        self.embedder = embedder
+        self.signature = signature
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def embed(self, kind: str, texts) -> np.ndarray:
+        if kind == "query":
+            return np.asarray(self.embedder.embed_queries(texts), dtype=np.float32)
+        if kind == "passage":
+            return np.asarray(self.embedder.embed_texts(texts), dtype=np.float32)
+        return self.embedder.encode(texts)
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self) -> "EmbedServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="embed-service", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, obj, status=200):
+                body = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/health":
+                    self._send_json({
+                        "model": service.embedder.model_name,
+                        "signature": service.signature,
+                        "stats": service.embedder.cache_stats(),
+                    })
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/embed":
+                    self._send_json({"error": "not found"}, 404)
+                    return
+                try:
+                    req = orjson.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                    kind, texts = req.get("kind", "raw"), req.get("texts") or []
+                    if kind not in KINDS or not isinstance(texts, list):
+                        self._send_json({"error": f"bad request: kind={kind!r}"}, 400)
+                        return
+                    vecs = service.embed(kind, [str(t) for t in texts])
+                except Exception as e:
+                    print(f"[EMBED_SERVICE] {type(e).__name__}: {e}")
+                    self._send_json({"error": f"{type(e).__name__}: {e}"}, 500)
+                    return
+                self._send_json({"vectors": vecs})
+
+        return Handler
@@ -0,0 +1,241 @@
+# app/adapters/embeddings/embedding_cache.py
+# ----------------------------------------
+# 内容アドレス型の埋め込みキャッシュ
+# - キー: (埋め込みモデル名, prefix, チャンク本文の sha1)
+# - ベクトル: 固定容量の memmap(float32) / インデックス: sqlite
+# - 容量超過時は最終利用が古いものから追い出す（LRU）
+# ----------------------------------------
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+_SQL_CHUNK = 500  # IN (...) に渡すキー数の上限
+
+
+def embed_signature(embed_model: str, backend: str = "sbert") -> str:
+    """キャッシュ/マニフェスト用の識別子：バックエンドが違えばベクトルも別物として扱う"""
+    return embed_model if backend in ("", "sbert") else f"{embed_model}@{backend}"
+
+
+def _safe_name(model_name: str) -> str:
+    return re.sub(r"[^0-9A-Za-z_.-]+", "__", model_name)
+
+
+class EmbeddingCache:
+    """
+    モデルごとに <root>/<model>/ 以下へ保存する。
+      vectors.f32    : capacity x dim の memmap
+      index.sqlite3  : key -> slot, used(最終利用時刻ms)
+    """
+
+    def __init__(self, root: str, model_name: str, max_entries: int = 200_000):
+        self.model_name = model_name
+        self.capacity = int(max_entries)
+        self.dir = os.path.join(root, _safe_name(model_name))
+        os.makedirs(self.dir, exist_ok=True)
+        self._vec_path = os.path.join(self.dir, "vectors.f32")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.dir, "index.sqlite3"), check_same_thread=False, timeout=30
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER UNIQUE, used INTEGER)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries(used)")
+        self._db.commit()
+        self.dim: Optional[int] = None
+        self._vecs: Optional[np.memmap] = None
+        self.hits = self.misses = self.evictions = 0
+        self._open_existing()
+        self._db.commit()
+
+    # -------- 内部 --------
+    def _meta(self, k: str) -> Optional[str]:
+        row = self._db.execute("SELECT v FROM meta WHERE k=?", (k,)).fetchone()
+        return row[0] if row else None
+
+    def _open_existing(self) -> bool:
+        """
+        meta とファイルがそろっていれば r+ で開く（別プロセスが作った分もここで拾う）。
+        容量変更・ファイル欠損で作り直したときの削除は呼び出し側でコミットする
+        """
+        dim, cap = self._meta("dim"), self._meta("capacity")
+        if dim is None:
+            return False
+        if not os.path.exists(self._vec_path):
+            # ファイルだけ消えた → 索引が指す先が無いので空から
+            self._reset()
+            return False
+        if int(cap or 0) != self.capacity:
+            # 容量変更 → スロット配置が変わるので作り直す
+            print(f"[CACHE] capacity changed ({cap} -> {self.capacity}), reset {self.dir}")
+            self._reset()
+            return False
+        self.dim = int(dim)
+        self._vecs = np.memmap(self._vec_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        return True
+
+    def _reset(self):
+        self._db.execute("DELETE FROM entries")
+        self._db.execute("DELETE FROM meta")
+        if os.path.exists(self._vec_path):
+            os.remove(self._vec_path)
+        self.dim, self._vecs = None, None
+
+    def _create(self, dim: int):
+        """BEGIN IMMEDIATE の中で、meta もファイルも無いときだけ呼ぶ（w+ は既存ファイルを切り詰める）"""
+        self.dim = int(dim)
+        self._vecs = np.memmap(self._vec_path, dtype=np.float32, mode="w+", shape=(self.capacity, self.dim))
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(self.dim),))
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('capacity', ?)", (str(self.capacity),))
+
+    def key(self, prefix: str, text: str) -> str:
+        h = hashlib.sha1()
+        for part in (self.model_name, prefix, text):
+            h.update(part.encode("utf-8", errors="ignore"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    # -------- 公開API --------
+    def get_many(self, prefix: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+        if not texts:
+            return out
+        with self._lock:
+            if self._vecs is None and not self._open_existing():
+                self._db.commit()
+                self.misses += len(texts)
+                return out
+            keys = [self.key(prefix, t) for t in texts]
+            slots = {}
+            uniq = list(dict.fromkeys(keys))
+            for i in range(0, len(uniq), _SQL_CHUNK):
+                part = uniq[i:i + _SQL_CHUNK]
+                q = f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(part))})"
+                slots.update(self._db.execute(q, part).fetchall())
+            if slots:
+                now = int(time.time() * 1000)
+                self._db.executemany("UPDATE entries SET used=? WHERE key=?", [(now, k) for k in slots])
+                self._db.commit()
+            for i, k in enumerate(keys):
+                s = slots.get(k)
+                if s is not None:
+                    out[i] = np.array(self._vecs[s])
+            n_hit = sum(1 for v in out if v is not None)
+            self.hits += n_hit
+            self.misses += len(texts) - n_hit
+        return out
+
+    def put_many(self, prefix: str, texts: Sequence[str], vectors) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(texts):
+            return
+        with self._lock:
+            # 複数プロセスが同時に書いてもスロット割当・ファイル作成が衝突しないよう書込ロックを取る
+            self._db.execute("BEGIN IMMEDIATE")
+            created = False
+            try:
+                if self._vecs is None and not self._open_existing():
+                    # ロックの中で meta を読み直して、どのプロセスもまだ作っていないときだけ新規作成
+                    self._create(vectors.shape[1])
+                    created = True
+                if vectors.shape[1] != self.dim:
+                    raise ValueError(f"embedding dim mismatch: cache={self.dim} got={vectors.shape[1]}")
+
+                # 同一キーは最後の1件だけ・容量を超える分は先頭から捨てる
+                pending = {}
+                for t, v in zip(texts, vectors):
+                    pending[self.key(prefix, t)] = v
+                existing = set()
+                keys = list(pending)
+                for i in range(0, len(keys), _SQL_CHUNK):
+                    part = keys[i:i + _SQL_CHUNK]
+                    q = f"SELECT key FROM entries WHERE key IN ({','.join('?' * len(part))})"
+                    existing.update(r[0] for r in self._db.execute(q, part).fetchall())
+                new_keys = [k for k in keys if k not in existing][-self.capacity:]
+                if not new_keys:
+                    self._db.commit()  # 作ったばかりの meta は残す
+                    return
+
+                count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                n_free = max(0, self.capacity - count)
+                slots = list(range(count, count + min(n_free, len(new_keys))))
+                n_evict = len(new_keys) - len(slots)
+                if n_evict:
+                    victims = self._db.execute(
+                        "SELECT key, slot FROM entries ORDER BY used LIMIT ?", (n_evict,)
+                    ).fetchall()
+                    self._db.executemany("DELETE FROM entries WHERE key=?", [(k,) for k, _ in victims])
+                    slots += [s for _, s in victims]
+                    self.evictions += len(victims)
+
+                for k, s in zip(new_keys, slots):
+                    self._vecs[s] = pending[k]
+                self._vecs.flush()
+                now = int(time.time() * 1000)
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO entries (key, slot, used) VALUES (?, ?, ?)",
+                    [(k, s, now) for k, s in zip(new_keys, slots)],
+                )
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                if created:
+                    self.dim, self._vecs = None, None  # meta ごと取り消したので次回また作る
+                raise
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "capacity": self.capacity,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._vecs is not None:
+                self._vecs.flush()
+            self._db.close()
+
+
+def encode_with_cache(
+    cache: Optional[EmbeddingCache],
+    prefix: str,
+    texts: Sequence[str],
+    encode_fn: Callable[[List[str]], "np.ndarray"],
+) -> np.ndarray:
+    """
+    キャッシュを先に引き、ミスした本文だけ encode_fn(prefix付き) で埋め込む。
+    戻り値は texts と同じ順序の float32 配列。
+    """
+    if cache is None:
+        return np.asarray(encode_fn([f"{prefix}{t}" for t in texts]), dtype=np.float32)
+
+    cached = cache.get_many(prefix, texts)
+    miss_idx = [i for i, v in enumerate(cached) if v is None]
+    if miss_idx:
+        # 同じ本文が複数回出ても encode は1回
+        uniq = list(dict.fromkeys(texts[i] for i in miss_idx))
+        new = np.asarray(encode_fn([f"{prefix}{t}" for t in uniq]), dtype=np.float32)
+        cache.put_many(prefix, uniq, new)
+        by_text = dict(zip(uniq, new))
+        for i in miss_idx:
+            cached[i] = by_text[texts[i]]
+    if not cached:
+        return np.zeros((0, cache.dim or 0), dtype=np.float32)
+    return np.vstack(cached).astype(np.float32, copy=False)
@@ -0,0 +1,145 @@
+# app/adapters/embeddings/micro_batch.py
+# ----------------------------------------
+# 動的マイクロバッチ（同時に来た埋め込み要求を 1 回の encode にまとめる）
+# - 最初の要求が来てから max_wait_ms だけ待ち、その間に来た要求を max_batch 件まで束ねる
+# - 大きな要求は max_batch 件ずつに割って並べる（長い ingest の間もクエリが割り込める）
+# - encode は専用スレッド1本で実行（モデルは1つを共有）
+# - BatchingEmbedder は既存の Embedder（sbert / onnx）を包んで Embedder ポートを実装する
+# ----------------------------------------
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.core.ports.embeddings import Embedder
+from app.adapters.embeddings.embedding_cache import encode_with_cache
+from app.adapters.embeddings.query_cache import embed_queries_cached, embed_query_cached
+
+EncodeFn = Callable[[List[str]], np.ndarray]
+
+
+class MicroBatcher:
+    def __init__(self, encode_fn: EncodeFn, max_batch: int = 64, max_wait_ms: float = 5.0, name: str = "embed"):
+        """encode_fn: prefix 付きテキスト列 → 正規化済み float32 配列（入力順）"""
+        self.encode_fn = encode_fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._q: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.requests = self.texts = self.batches = 0
+        self.seconds = 0.0
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name=f"microbatch-{name}", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        futures = []
+        for i in range(0, len(texts), self.max_batch):
+            fut: Future = Future()
+            self._q.put((texts[i:i + self.max_batch], fut))
+            futures.append(fut)
+        with self._lock:
+            self.requests += 1
+        parts = [f.result() for f in futures]
+        return parts[0] if len(parts) == 1 else np.vstack(parts)
+
+    def _collect(self) -> List[Tuple[List[str], Future]]:
+        items = [self._q.get()]
+        n = len(items[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while n < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+            except queue.Empty:
+                break
+            if item[1] is None:  # close() の番兵は次のループで処理
+                self._q.put(item)
+                break
+            items.append(item)
+            n += len(item[0])
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            if items[0][1] is None:
+                return
+            texts = [t for ts, _ in items for t in ts]
+            t0 = time.perf_counter()
+            try:
+                vecs = np.asarray(self.encode_fn(texts), dtype=np.float32)
+            except BaseException as e:
+                for _, fut in items:
+                    fut.set_exception(e)
+                continue
+            with self._lock:
+                self.texts += len(texts)
+                self.batches += 1
+                self.seconds += time.perf_counter() - t0
+            off = 0
+            for ts, fut in items:
+                fut.set_result(vecs[off:off + len(ts)])
+                off += len(ts)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._q.put(([], None))
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "texts": self.texts,
+                "batches": self.batches,
+                "mean_batch": round(self.texts / self.batches, 2) if self.batches else 0.0,
+                "encode_seconds": round(self.seconds, 3),
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+class BatchingEmbedder(Embedder):
+    """inner（SbertEmbedder / OnnxEmbedder）の encode を MicroBatcher 経由にする。キャッシュは inner のものを使う"""
+
+    def __init__(self, inner, max_batch: int = 64, max_wait_ms: float = 5.0):
+        self.inner = inner
+        self.model_name = inner.model_name
+        self.cache = inner.cache
+        self.query_cache = inner.query_cache
+        # 長さでソートしてトークン予算内に詰める処理は inner の batcher に任せる
+        self.batcher = MicroBatcher(inner.batcher.encode, max_batch=max_batch, max_wait_ms=max_wait_ms)
+
+    def encode(self, texts: Sequence[str], **_: object) -> np.ndarray:
+        """prefix 付きテキストをそのまま埋め込む（埋め込みサービス / ingest 用）"""
+        return self.batcher.encode(texts)
+
+    def embed_query(self, text: str):
+        return embed_query_cached(self.query_cache, text, self._encode_query)
+
+    def _encode_query(self, text: str):
+        return self.batcher.encode([f"query: {text}"])[0].tolist()
+
+    def embed_queries(self, texts):
+        return embed_queries_cached(
+            self.query_cache, texts, lambda ts: self.batcher.encode([f"query: {t}" for t in ts]).tolist()
+        )
+
+    def embed_texts(self, texts):
+        return encode_with_cache(self.cache, "passage: ", list(texts), self.batcher.encode).tolist()
+
+    def cache_stats(self):
+        return {**self.inner.cache_stats(), "micro_batch": self.batcher.stats()}
+
+    def close(self):
+        self.batcher.close()
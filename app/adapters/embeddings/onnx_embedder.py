@@ -0,0 +1,171 @@
+# app/adapters/embeddings/onnx_embedder.py
+# ----------------------------------------
+# ONNX Runtime 版 Embedder（torch なしで推論、任意で int8 動的量子化）
+# - 初回のみ transformers + torch で ONNX へエクスポート → <onnx_dir>/<model>/
+# - e5 と同じく mean pooling + L2 正規化、"query: " / "passage: " を付与
+# - SentenceTransformer と同じ encode / tokenizer / max_seq_length を持つので
+#   TokenBudgetBatcher や ingest.py の埋め込みステージにそのまま差し込める
+# ----------------------------------------
+import os
+import re
+from typing import List, Sequence
+
+import numpy as np
+
+from app.core.ports.embeddings import Embedder
+from app.adapters.embeddings.embedding_cache import EmbeddingCache, encode_with_cache
+from app.adapters.embeddings.batching import TokenBudgetBatcher
+from app.adapters.embeddings.query_cache import embed_queries_cached, embed_query_cached, make_query_cache
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+
+
+def onnx_model_dir(onnx_dir: str, model_name: str) -> str:
+    return os.path.join(onnx_dir, re.sub(r"[^0-9A-Za-z_.-]+", "__", model_name))
+
+
+def export_onnx(model_name: str, out_dir: str, opset: int = 17) -> str:
+    """HF モデルを ONNX(fp32) に書き出し、トークナイザも同じ場所へ保存する"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tok = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tok(["query: hello", "passage: こんにちは世界"], padding=True, return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+
+    class _LastHidden(torch.nn.Module):
+        def __init__(self, m):
+            super().__init__()
+            self.m = m
+
+        def forward(self, *inputs):
+            return self.m(**dict(zip(names, inputs))).last_hidden_state
+
+    dyn = {n: {0: "batch", 1: "seq"} for n in names}
+    dyn["last_hidden_state"] = {0: "batch", 1: "seq"}
+    path = os.path.join(out_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHidden(model),
+            tuple(sample[n] for n in names),
+            path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dyn,
+            opset_version=opset,
+            dynamo=False,
+        )
+    tok.save_pretrained(out_dir)
+    print(f"[ONNX] exported {model_name} -> {path}")
+    return path
+
+
+def quantize_int8(src: str, dst: str) -> str:
+    """重みだけ int8 にする動的量子化（キャリブレーション不要）"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    print(f"[ONNX] quantized int8 -> {dst}")
+    return dst
+
+
+def ensure_onnx_model(model_name: str, onnx_dir: str, quantize: bool = False) -> str:
+    """必要ならエクスポート/量子化して .onnx のパスを返す"""
+    d = onnx_model_dir(onnx_dir, model_name)
+    fp32 = os.path.join(d, FP32_FILE)
+    if not os.path.exists(fp32):
+        export_onnx(model_name, d)
+    if not quantize:
+        return fp32
+    int8 = os.path.join(d, INT8_FILE)
+    if not os.path.exists(int8):
+        quantize_int8(fp32, int8)
+    return int8
+
+
+class OnnxEmbedder(Embedder):
+    def __init__(
+        self,
+        model_name: str = "intfloat/multilingual-e5-small",
+        onnx_dir: str = "onnx_models",
+        quantize: bool = False,
+        threads: int = 0,
+        cache: EmbeddingCache | None = None,
+        token_budget: int = 16384,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float = 3600,
+        max_seq_length: int = 512,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.backend = "onnx-int8" if quantize else "onnx"
+        path = ensure_onnx_model(model_name, onnx_dir, quantize=quantize)
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = int(threads)
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self._input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(path))
+        self.max_seq_length = max_seq_length
+        self.cache = cache
+        self.batcher = TokenBudgetBatcher(self, token_budget=token_budget)
+        self.query_cache = make_query_cache(query_cache_size, query_cache_ttl)
+
+    # -------- SentenceTransformer 互換（batcher / ingest 用） --------
+    def encode(
+        self,
+        texts: Sequence[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = True,
+        show_progress_bar: bool = False,
+        **_: object,
+    ) -> np.ndarray:
+        texts = list(texts)
+        out: List[np.ndarray] = []
+        for i in range(0, len(texts), max(1, batch_size)):
+            out.append(self._run(texts[i:i + batch_size], normalize_embeddings))
+        if not out:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack(out)
+
+    def _run(self, texts: List[str], normalize: bool) -> np.ndarray:
+        enc = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+        )
+        feed = {}
+        for name in self._input_names:
+            if name in enc:
+                feed[name] = enc[name].astype(np.int64)
+            else:  # token_type_ids を返さないトークナイザ向け
+                feed[name] = np.zeros_like(enc["input_ids"], dtype=np.int64)
+        hidden = self.session.run(None, feed)[0]
+        mask = enc["attention_mask"][..., None].astype(np.float32)
+        emb = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if normalize:
+            emb /= np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+        return emb.astype(np.float32)
+
+    # -------- Embedder ポート --------
+    def embed_query(self, text: str):
+        return embed_query_cached(self.query_cache, text, self._encode_query)
+
+    def _encode_query(self, text: str):
+        return self._run([f"query: {text}"], True)[0].tolist()
+
+    def embed_queries(self, texts):
+        return embed_queries_cached(
+            self.query_cache, texts, lambda ts: self.batcher.encode([f"query: {t}" for t in ts]).tolist()
+        )
+
+    def embed_texts(self, texts):
+        vecs = encode_with_cache(self.cache, "passage: ", list(texts), self.batcher.encode)
+        return vecs.tolist()
+
+    def cache_stats(self):
+        return self.query_cache.stats() if self.query_cache is not None else {}
@@ -0,0 +1,45 @@
+# app/adapters/embeddings/query_cache.py
+# クエリ埋め込みキャッシュの共通処理（Embedder 実装間で共有）
+import re
+import unicodedata
+from typing import Callable, List, Optional, Sequence
+
+from app.adapters.cache.ttl_cache import StatsTTLCache
+
+
+def normalize_query(text: str) -> str:
+    """全角/半角ゆれ・前後空白・連続空白を吸収したキャッシュキー"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def make_query_cache(size: int, ttl: float) -> Optional[StatsTTLCache]:
+    return StatsTTLCache(size, ttl) if size > 0 else None
+
+
+def embed_query_cached(
+    cache: Optional[StatsTTLCache], text: str, encode_fn: Callable[[str], List[float]]
+) -> List[float]:
+    if cache is None:
+        return encode_fn(text)
+    key = normalize_query(text)
+    return cache.get_or_compute(key, lambda: encode_fn(key))
+
+
+def embed_queries_cached(
+    cache: Optional[StatsTTLCache], texts: Sequence[str], encode_many: Callable[[List[str]], List[List[float]]]
+) -> List[List[float]]:
+    """複数クエリ版。キャッシュに無いものだけを1回の encode_many にまとめる（同じクエリは1回だけ）"""
+    keys = [normalize_query(t) for t in texts]
+    if cache is None:
+        return encode_many(keys) if keys else []
+    out: dict = {}
+    for k in keys:
+        v = cache.get(k)
+        if v is not None:
+            out[k] = v
+    missing = list(dict.fromkeys(k for k in keys if k not in out))
+    if missing:
+        for k, v in zip(missing, encode_many(missing)):
+            cache.put(k, v)
+            out[k] = v
+    return [out[k] for k in keys]
@@ -0,0 +1,78 @@
+# app/adapters/embeddings/remote_embedder.py
+# ----------------------------------------
+# 埋め込みサービス（embed_service.py）のクライアント。Embedder ポートを実装する
+# - モデルをこのプロセスに読み込まない（torch も import しない）
+# - 同じ質問の rerun 対策のクエリキャッシュだけは手元に持つ（往復を省く）
+# ----------------------------------------
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import orjson
+import requests
+
+from app.core.ports.embeddings import Embedder
+from app.adapters.embeddings.query_cache import embed_queries_cached, embed_query_cached, make_query_cache
+
+
+class RemoteEmbedder(Embedder):
+    def __init__(
+        self,
+        url: str = "http://127.0.0.1:8765",
+        timeout: float = 60.0,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float = 3600,
+    ):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.query_cache = make_query_cache(query_cache_size, query_cache_ttl)
+        self._info: Optional[Dict[str, Any]] = None
+
+    def info(self) -> Dict[str, Any]:
+        if self._info is None:
+            r = self.session.get(f"{self.url}/health", timeout=self.timeout)
+            r.raise_for_status()
+            self._info = r.json()
+        return self._info
+
+    @property
+    def model_name(self) -> str:
+        return self.info()["model"]
+
+    @property
+    def signature(self) -> str:
+        """マニフェスト / 埋め込みキャッシュ用（サービス側のモデル + バックエンド）"""
+        return self.info()["signature"]
+
+    def _post(self, kind: str, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        r = self.session.post(
+            f"{self.url}/embed", data=orjson.dumps({"kind": kind, "texts": texts}),
+            headers={"Content-Type": "application/json"}, timeout=self.timeout,
+        )
+        if r.status_code != 200:
+            raise RuntimeError(f"embed service {r.status_code}: {r.text[:200]}")
+        return np.asarray(orjson.loads(r.content)["vectors"], dtype=np.float32)
+
+    # -------- SentenceTransformer 互換（ingest.py 用。prefix 付きテキスト） --------
+    def encode(self, texts: Sequence[str], **_: object) -> np.ndarray:
+        return self._post("raw", texts)
+
+    # -------- Embedder ポート --------
+    def embed_query(self, text: str) -> List[float]:
+        return embed_query_cached(self.query_cache, text, self._encode_query)
+
+    def _encode_query(self, text: str) -> List[float]:
+        return self._post("query", [text])[0].tolist()
+
+    def embed_queries(self, texts):
+        return embed_queries_cached(self.query_cache, texts, lambda ts: self._post("query", ts).tolist())
+
+    def embed_texts(self, texts) -> List[List[float]]:
+        return self._post("passage", texts).tolist()
+
+    def cache_stats(self):
+        stats = self.query_cache.stats() if self.query_cache is not None else {}
+        return {**stats, "service": self.url}
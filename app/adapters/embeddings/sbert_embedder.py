@@ -1,13 +1,42 @@
-from sentence_transformers import SentenceTransformer
 from app.core.ports.embeddings import Embedder
+from app.adapters.embeddings.embedding_cache import EmbeddingCache, encode_with_cache
+from app.adapters.embeddings.batching import TokenBudgetBatcher
+from app.adapters.embeddings.query_cache import embed_queries_cached, embed_query_cached, make_query_cache
 
 class SbertEmbedder(Embedder):
-    def __init__(self, model_name: str = "intfloat/multilingual-e5-small"):
+    def __init__(
+        self,
+        model_name: str = "intfloat/multilingual-e5-small",
+        cache: EmbeddingCache | None = None,
+        token_budget: int = 16384,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float = 3600,
+    ):
+        from sentence_transformers import SentenceTransformer  # torch ごと重いので、モデルを作るときに読み込む
+
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        self.cache = cache
+        # 長さの近いパッセージ同士をトークン予算内でまとめて埋め込む
+        self.batcher = TokenBudgetBatcher(self.model, token_budget=token_budget)
+        # 同じ質問の言い直し・Streamlit の rerun で同じクエリが何度も来る
+        self.query_cache = make_query_cache(query_cache_size, query_cache_ttl)
 
     def embed_query(self, text: str):
+        return embed_query_cached(self.query_cache, text, self._encode_query)
+
+    def _encode_query(self, text: str):
         return self.model.encode([f"query: {text}"], normalize_embeddings=True).tolist()[0]
 
+    def embed_queries(self, texts):
+        return embed_queries_cached(
+            self.query_cache, texts, lambda ts: self.batcher.encode([f"query: {t}" for t in ts]).tolist()
+        )
+
     def embed_texts(self, texts):
-        prefixed = [f"passage: {t}" for t in texts]
-        return self.model.encode(prefixed, normalize_embeddings=True).tolist()
+        # キャッシュにある本文は encode しない（未設定なら従来どおり全件）
+        vecs = encode_with_cache(self.cache, "passage: ", list(texts), self.batcher.encode)
+        return vecs.tolist()
+
+    def cache_stats(self):
+        return self.query_cache.stats() if self.query_cache is not None else {}
@@ -1,48 +1,206 @@
-import json, requests
-from typing import Iterable, List, Dict, Any
+import asyncio
+import requests
+import httpx
+import orjson
+from requests.adapters import HTTPAdapter
+from typing import AsyncIterator, Iterable, List, Dict, Any, Optional
 from app.core.ports.llm import LLMClient
-from app.core.types import Message, ChatChunk
+from app.core.types import Message, ChatChunk, CancelToken
+
+CONNECT_ERROR_MSG = "⚠️ Ollama に接続できません。URL と起動状態(ollama serve)を確認してください。"
+CANCELLED_MSG = "（生成を中断しました）"
+
+def parse_usage(data: Dict[str, Any]) -> Dict[str, float]:
+    """最終レコード（done=true）のカウンタ → usage（時間は ns → ms）"""
+    usage: Dict[str, float] = {
+        "prompt_eval_count": int(data.get("prompt_eval_count") or 0),
+        "eval_count": int(data.get("eval_count") or 0),
+    }
+    for key in ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration"):
+        usage[key.replace("_duration", "_ms")] = round((data.get(key) or 0) / 1e6, 2)
+    return usage
+
+def parse_chat_line(line: bytes | str) -> Optional[ChatChunk]:
+    """/api/chat の NDJSON 1行 → ChatChunk（トークンが空なら None。最終レコードは usage 付き）"""
+    data = orjson.loads(line)
+    token = data.get("message", {}).get("content", "")
+    if data.get("done"):
+        return ChatChunk(content=token, done=True, usage=parse_usage(data))
+    return ChatChunk(content=token) if token else None
 
 class OllamaClient(LLMClient):
-    def __init__(self, base_url: str, timeout: int = 600):
+    def __init__(
+        self,
+        base_url: str,
+        timeout: int = 600,
+        connect_timeout: float = 5.0,
+        pool_size: int = 32,
+    ):
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        # keep-alive で TCP 接続を使い回す（全セッションで共有）
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._aclient: Optional[httpx.AsyncClient] = None
+        self._aclient_loop = None
 
-    def list_models(self) -> List[str]:
+    def _payload(self, messages: List[Message], model: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        options = dict(options or {})
+        # keep_alive は options ではなくリクエスト直下のパラメータ
+        keep_alive = options.pop("keep_alive", None)
+        payload = {
+            "model": model,
+            "messages": [m.to_api() for m in messages],
+            "stream": True,
+            "options": options,
+        }
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        return payload
+
+    def tags(self, timeout: float = 5) -> Optional[List[str]]:
+        """/api/tags のモデル名一覧。接続できなければ None（ヘルスチェック兼用）"""
         try:
-            r = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            r = self.session.get(f"{self.base_url}/api/tags", timeout=(self.connect_timeout, timeout))
             r.raise_for_status()
-            data = r.json()
+            data = orjson.loads(r.content)
             return sorted([m["name"] for m in data.get("models", [])])
         except Exception:
-            return []
+            return None
+
+    def list_models(self) -> List[str]:
+        return self.tags() or []
+
+    def preload(self, model: str, keep_alive: Optional[str] = None) -> bool:
+        """空の messages で /api/chat を呼ぶとモデルだけ読み込まれる（最初の質問のロード待ちを避ける）"""
+        payload: Dict[str, Any] = {"model": model, "messages": [], "stream": False}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        try:
+            r = self.session.post(
+                f"{self.base_url}/api/chat", json=payload, timeout=(self.connect_timeout, self.timeout)
+            )
+            r.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"[WARMUP] preload failed {self.base_url} {model}: {type(e).__name__}: {e}")
+            return False
 
     def chat_stream(
-        self, messages: List[Message], model: str, options: Dict[str, Any]
+        self,
+        messages: List[Message],
+        model: str,
+        options: Dict[str, Any],
+        cancel: Optional[CancelToken] = None,
     ) -> Iterable[ChatChunk]:
-        payload = {
-            "model": model,
-            "messages": [m.__dict__ for m in messages],
-            "stream": True,
-            "options": options or {},
-        }
+        payload = self._payload(messages, model, options)
         url = f"{self.base_url}/api/chat"
+        usage = None
 
         try:
-            with requests.post(url, json=payload, stream=True, timeout=self.timeout) as r:
+            with self.session.post(
+                url, json=payload, stream=True, timeout=(self.connect_timeout, self.timeout)
+            ) as r:
+                if cancel is not None:
+                    # 別スレッドからの cancel() で接続を切る → Ollama 側の生成も止まる
+                    cancel.attach(r.close)
                 r.raise_for_status()
                 for line in r.iter_lines():
+                    if cancel is not None and cancel.cancelled:
+                        break
                     if not line:
                         continue
-                    data = json.loads(line.decode("utf-8"))
-                    token = data.get("message", {}).get("content", "")
-                    if token:
-                        yield ChatChunk(content=token)
+                    chunk = parse_chat_line(line)
+                    if chunk is not None and chunk.done:
+                        # 最終レコード：usage は最後の done チャンクにまとめて付ける
+                        usage = chunk.usage
+                        chunk = ChatChunk(content=chunk.content) if chunk.content else None
+                    if chunk is not None:
+                        yield chunk
         except requests.exceptions.ConnectionError:
-            yield ChatChunk(content="⚠️ Ollama に接続できません。URL と起動状態(ollama serve)を確認してください。", done=True)
+            if cancel is None or not cancel.cancelled:
+                yield ChatChunk(content=CONNECT_ERROR_MSG, done=True, error="connect")
         except requests.exceptions.HTTPError as e:
-            yield ChatChunk(content=f"⚠️ HTTPエラー: {e.response.status_code} {e.response.text[:200]}", done=True)
+            yield ChatChunk(content=f"⚠️ HTTPエラー: {e.response.status_code} {e.response.text[:200]}", done=True, error="http")
         except Exception as e:
-            yield ChatChunk(content=f"⚠️ 予期せぬエラー: {type(e).__name__}: {e}", done=True)
-        finally:
-            yield ChatChunk(content="", done=True)
+            if cancel is None or not cancel.cancelled:
+                yield ChatChunk(content=f"⚠️ 予期せぬエラー: {type(e).__name__}: {e}", done=True, error="unexpected")
+        if cancel is not None and cancel.cancelled:
+            yield ChatChunk(content=CANCELLED_MSG, done=True, error="cancelled")
+            return
+        # finally で yield すると途中 close（キャンセル）時に RuntimeError になるため外に置く
+        yield ChatChunk(content="", done=True, usage=usage)
+
+    # -------- async（httpx） --------
+    def _async_client(self) -> httpx.AsyncClient:
+        # AsyncClient の接続はイベントループに紐づくので、ループが変わったら作り直す
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient.is_closed or self._aclient_loop is not loop:
+            self._aclient_loop = loop
+            self._aclient = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size, max_keepalive_connections=self.pool_size
+                ),
+            )
+        return self._aclient
+
+    async def chat_stream_async(
+        self,
+        messages: List[Message],
+        model: str,
+        options: Dict[str, Any],
+        cancel: Optional[CancelToken] = None,
+    ) -> AsyncIterator[ChatChunk]:
+        """chat_stream と同じ ChatChunk 列を返す非同期版（スレッドを塞がない）"""
+        payload = self._payload(messages, model, options)
+        url = f"{self.base_url}/api/chat"
+        client = self._async_client()
+        usage = None
+        try:
+            async with client.stream("POST", url, content=orjson.dumps(payload),
+                                     headers={"Content-Type": "application/json"}) as r:
+                if cancel is not None:
+                    # sync 版の r.close と同じく、cancel() で接続を切る → 読み待ちも Ollama 側の生成も止まる
+                    # （cancel() は別スレッドから呼ばれるので、ループに閉じる処理を投げる）
+                    loop = asyncio.get_running_loop()
+                    cancel.attach(lambda: loop.call_soon_threadsafe(lambda: asyncio.ensure_future(r.aclose())))
+                if r.status_code >= 400:
+                    body = (await r.aread()).decode("utf-8", errors="ignore")
+                    yield ChatChunk(content=f"⚠️ HTTPエラー: {r.status_code} {body[:200]}", done=True, error="http")
+                else:
+                    async for line in r.aiter_lines():
+                        if cancel is not None and cancel.cancelled:
+                            break
+                        if not line:
+                            continue
+                        chunk = parse_chat_line(line)
+                        if chunk is not None and chunk.done:
+                            # 最終レコード：usage は最後の done チャンクにまとめて付ける
+                            usage = chunk.usage
+                            chunk = ChatChunk(content=chunk.content) if chunk.content else None
+                        if chunk is not None:
+                            yield chunk
+        except httpx.ConnectError:
+            if cancel is None or not cancel.cancelled:
+                yield ChatChunk(content=CONNECT_ERROR_MSG, done=True, error="connect")
+        except Exception as e:
+            if cancel is None or not cancel.cancelled:
+                yield ChatChunk(content=f"⚠️ 予期せぬエラー: {type(e).__name__}: {e}", done=True, error="unexpected")
+        if cancel is not None and cancel.cancelled:
+            yield ChatChunk(content=CANCELLED_MSG, done=True, error="cancelled")
+            return
+        # finally で yield すると途中 close（キャンセル）時に RuntimeError になるため外に置く
+        yield ChatChunk(content="", done=True, usage=usage)
+
+    async def aclose(self):
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+    def close(self):
+        self.session.close()
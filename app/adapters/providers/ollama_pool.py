@@ -0,0 +1,203 @@
+# app/adapters/providers/ollama_pool.py
+# ----------------------------------------
+# 複数の Ollama エンドポイントを束ねる LLMClient
+# - バックエンドごとの同時実行上限 + 未処理数が最少のバックエンドへ振り分け
+# - 空きがなければ有界の待ち行列でタイムアウトまで待つ（超過は即時に混雑応答。待っている間のキャンセルでも抜ける）
+# - /api/tags による定期ヘルスチェック
+# - CancelToken で実行中の生成を中断（接続を切るので Ollama 側の生成も止まる）
+# ----------------------------------------
+import time
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Any
+
+from app.core.ports.llm import LLMClient
+from app.core.types import Message, ChatChunk, CancelToken
+from app.adapters.providers.ollama_client import CANCELLED_MSG, OllamaClient
+
+BUSY_MSG = "⚠️ 現在混み合っています。しばらくしてから再度お試しください。"
+
+
+@dataclass
+class _Backend:
+    client: OllamaClient
+    inflight: int = 0
+    healthy: bool = True
+    models: List[str] = field(default_factory=list)
+    served: int = 0
+
+
+class OllamaPool(LLMClient):
+    def __init__(
+        self,
+        base_urls: List[str],
+        max_inflight_per_backend: int = 4,
+        max_waiting: int = 32,
+        wait_timeout: float = 30.0,
+        health_interval: float = 15.0,
+        **client_kwargs: Any,
+    ):
+        if not base_urls:
+            raise ValueError("OllamaPool requires at least one base_url")
+        self.backends = [_Backend(OllamaClient(u, **client_kwargs)) for u in base_urls]
+        self.max_inflight = max(1, int(max_inflight_per_backend))
+        self.max_waiting = int(max_waiting)
+        self.wait_timeout = float(wait_timeout)
+        self._cond = threading.Condition()
+        self._waiting = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self._stop = threading.Event()
+        if health_interval > 0:
+            t = threading.Thread(
+                target=self._health_loop, args=(health_interval,), name="ollama-health", daemon=True
+            )
+            t.start()
+
+    @property
+    def base_url(self) -> str:
+        return ",".join(b.client.base_url for b in self.backends)
+
+    # -------- ヘルスチェック --------
+    def check_health(self):
+        for b in self.backends:
+            models = b.client.tags(timeout=3)
+            with self._cond:
+                b.healthy = models is not None
+                if models is not None:
+                    b.models = models
+                self._cond.notify_all()
+
+    def _health_loop(self, interval: float):
+        # 初回は即時（起動をブロックしないよう別スレッドで）
+        while True:
+            self.check_health()
+            if self._stop.wait(interval):
+                return
+
+    def close(self):
+        self._stop.set()
+        for b in self.backends:
+            b.client.close()
+
+    # -------- 振り分け・待ち行列 --------
+    def _wake_waiters(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _acquire(self, cancel: Optional[CancelToken] = None) -> Optional[_Backend]:
+        deadline = time.monotonic() + self.wait_timeout
+        if cancel is not None:
+            cancel.attach(self._wake_waiters)  # キャンセルされたら待っているスレッドを起こす
+        with self._cond:
+            if self._waiting >= self.max_waiting:
+                self.rejected += 1
+                return None
+            self._waiting += 1
+            try:
+                while True:
+                    if cancel is not None and cancel.cancelled:
+                        self.cancelled += 1
+                        return None
+                    pool = [b for b in self.backends if b.healthy] or self.backends  # 全滅時は全台を試す
+                    free = [b for b in pool if b.inflight < self.max_inflight]
+                    if free:
+                        b = min(free, key=lambda x: x.inflight)  # least outstanding requests
+                        b.inflight += 1
+                        b.served += 1
+                        return b
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        return None
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    @staticmethod
+    def _not_acquired(cancel: Optional[CancelToken]) -> ChatChunk:
+        if cancel is not None and cancel.cancelled:
+            return ChatChunk(content=CANCELLED_MSG, done=True, error="cancelled")
+        return ChatChunk(content=BUSY_MSG, done=True, error="busy")
+
+    def _release(self, b: _Backend, failed: bool = False):
+        with self._cond:
+            b.inflight -= 1
+            if failed:
+                b.healthy = False  # 次のヘルスチェックで復帰
+            self._cond.notify()
+
+    # -------- LLMClient ポート --------
+    def list_models(self) -> List[str]:
+        with self._cond:
+            names = {m for b in self.backends if b.healthy for m in b.models}
+        if not names:
+            self.check_health()
+            with self._cond:
+                names = {m for b in self.backends if b.healthy for m in b.models}
+        return sorted(names)
+
+    def preload(self, model: str, keep_alive: Optional[str] = None) -> Dict[str, bool]:
+        """正常なバックエンドすべてにモデルを読み込ませる（どこへ振り分けられてもロード待ちにならない）"""
+        with self._cond:
+            targets = [b for b in self.backends if b.healthy] or list(self.backends)
+        return {b.client.base_url: b.client.preload(model, keep_alive) for b in targets}
+
+    def chat_stream(
+        self,
+        messages: List[Message],
+        model: str,
+        options: Dict[str, Any],
+        cancel: Optional[CancelToken] = None,
+    ) -> Iterable[ChatChunk]:
+        b = self._acquire(cancel)
+        if b is None:
+            yield self._not_acquired(cancel)
+            return
+        failed = False
+        try:
+            for chunk in b.client.chat_stream(messages, model, options, cancel=cancel):
+                failed = failed or chunk.error == "connect"
+                yield chunk
+        finally:
+            # 途中で close されても（キャンセル・画面離脱）枠は必ず返す
+            self._release(b, failed=failed)
+
+    async def chat_stream_async(
+        self,
+        messages: List[Message],
+        model: str,
+        options: Dict[str, Any],
+        cancel: Optional[CancelToken] = None,
+    ) -> AsyncIterator[ChatChunk]:
+        b = await asyncio.to_thread(self._acquire, cancel)
+        if b is None:
+            yield self._not_acquired(cancel)
+            return
+        failed = False
+        try:
+            async for chunk in b.client.chat_stream_async(messages, model, options, cancel=cancel):
+                failed = failed or chunk.error == "connect"
+                yield chunk
+        finally:
+            self._release(b, failed=failed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "waiting": self._waiting,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "cancelled": self.cancelled,
+                "backends": [
+                    {
+                        "url": b.client.base_url,
+                        "healthy": b.healthy,
+                        "inflight": b.inflight,
+                        "served": b.served,
+                    }
+                    for b in self.backends
+                ],
+            }
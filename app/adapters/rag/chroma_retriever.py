@@ -1,31 +1,242 @@
-import chromadb
+import json
+import hashlib
+import struct
+import threading
+from contextlib import contextmanager
 from app.core.ports.retriever import Retriever
 from app.core.ports.embeddings import Embedder
+from app.core import telemetry
+from app.core.types import RetrievalHit
+from app.core.context_packer import pack_context
+from app.adapters.cache.ttl_cache import StatsTTLCache
+from app.adapters.rag.generation import GenerationWatcher
+
+def vector_key(vec) -> str:
+    return hashlib.sha1(struct.pack(f"{len(vec)}f", *vec)).hexdigest()
+
+def to_hits(res, qi: int = 0) -> list[RetrievalHit]:
+    """col.query の結果（qi 番目のクエリ分）→ RetrievalHit のリスト（cosine 距離 → 類似度）"""
+    docs = (res.get("documents") or [[]] * (qi + 1))[qi]
+    metas = (res.get("metadatas") or [[]] * (qi + 1))[qi]
+    dists = (res.get("distances") or [[]] * (qi + 1))[qi] or [None] * len(docs)
+    ids = (res.get("ids") or [[]] * (qi + 1))[qi] or [""] * len(docs)
+    hits = []
+    for i, (d, m, dist, cid) in enumerate(zip(docs, metas, dists, ids), 1):
+        m = m or {}
+        hits.append(RetrievalHit(
+            text=d or "",
+            source=str(m.get("source", f"doc{i}")),
+            score=1.0 - dist if dist is not None else -float(i),
+            chunk_index=m.get("chunk_index"),
+            page=m.get("page"),
+            metadata=m,
+            id=cid,
+            distance=dist,
+        ))
+    return hits
+
+class StoreSet:
+    """
+    開いているストア一式。世代が進んで置き換えたら retired にし、借りている検索が全て返したら閉じる
+    （Streamlit のセッション間で1つの検索器を共有するので、使用中のストアを閉じない）
+    """
+
+    def __init__(self, col, doc_col=None, client=None, system=None):
+        self.col = col
+        self.doc_col = doc_col
+        self.client = client
+        self.system = system  # Chroma: このストア一式だけが使うシステム（閉じるときに止める）
+        self.users = 0
+        self.retired = False
 
 class ChromaRetriever(Retriever):
-    def __init__(self, path="chroma_db", collection="rag_docs", embedder: Embedder | None = None):
-        self.client = chromadb.PersistentClient(path=path)
-        self.col = self.client.get_or_create_collection(collection, metadata={"hnsw:space": "cosine"})
+    def __init__(
+        self,
+        path="chroma_db",
+        collection="rag_docs",
+        embedder: Embedder | None = None,
+        result_cache_size: int = 512,
+        result_cache_ttl: float = 600,
+        context_token_budget: int = 2048,
+        overfetch: int = 2,
+        dedup_threshold: float = 0.85,
+        doc_top_n: int = 0,
+        doc_collection: str = "rag_sources",
+    ):
+        """
+        context_token_budget: 参考資料に使うトークン数の上限（0以下で無制限）
+        overfetch: top_k の何倍を候補として取り、連続チャンクの結合・重複除去の後で詰め直すか
+        doc_top_n: >0 なら文書単位の索引で上位 N 出典を選び、チャンク検索をその出典に絞る（二段検索）
+        """
+        self.path = path
+        self.collection = collection
+        self.doc_collection = doc_collection
+        self.doc_top_n = max(0, int(doc_top_n))
+        self._lock = threading.Lock()  # 世代の確認・ストアの差し替え・貸し出し数
+        self.stores = self._open()
         self.embedder = embedder
+        # 検索結果キャッシュ：ingest.py が世代を進めたら丸ごと破棄
+        self.result_cache = StatsTTLCache(result_cache_size, result_cache_ttl) if result_cache_size > 0 else None
+        self.generation = GenerationWatcher(path)
+        self.context_token_budget = context_token_budget
+        self.overfetch = max(1, int(overfetch))
+        self.dedup_threshold = dedup_threshold
+        self.last_pack_stats: dict = {}
+
+    @property
+    def col(self):
+        return self.stores.col
+
+    @property
+    def doc_col(self):
+        return self.stores.doc_col
+
+    def _open(self) -> StoreSet:
+        """
+        PersistentClient はパスごとにシステムをプロセス内で使い回すので、開き直しても古い索引のままになる。
+        開くたびに専用のシステムを作り、置き換えたら _close で止める
+        """
+        # 重いので使うときに読み込む（UI の初回表示を遅らせない）
+        from chromadb.api.client import Client
+        from chromadb.config import Settings, System
+
+        system = System(Settings(is_persistent=True, persist_directory=str(self.path)))
+        system.start()
+        try:
+            client = Client.from_system(system)
+            col = client.get_or_create_collection(self.collection, metadata={"hnsw:space": "cosine"})
+            doc_col = None
+            if self.doc_top_n:
+                doc_col = client.get_or_create_collection(self.doc_collection, metadata={"hnsw:space": "cosine"})
+        except Exception:
+            system.stop()
+            raise
+        return StoreSet(col, doc_col, client, system)
 
-    def retrieve(self, query: str, top_k: int = 6):
+    def _close(self, stores: StoreSet):
+        """置き換えた古いストア一式のシステムを止める（借りている検索が全て返してから呼ばれる）"""
+        if stores.system is None:
+            return
         try:
-            qvec = self.embedder.embed_query(query)
-            res = self.col.query(
-                query_embeddings=[qvec],
-                n_results=top_k,
-                include=["documents", "metadatas", "distances"],
-            )
-            docs = (res.get("documents") or [[]])[0]
-            metas = (res.get("metadatas") or [[]])[0]
-
-            lines, sources = [], []
-            for i, (d, m) in enumerate(zip(docs, metas), 1):
-                src = (m or {}).get("source", f"doc{i}")
-                sources.append(str(src))
-                lines.append(f"[{i}] 出典: {src}\n{d}")
-            context = "\n\n---\n\n".join(lines)
-            return context, sorted(set(sources))
+            stores.system.stop()
+        except Exception as e:
+            print(f"[WARN] chroma system stop failed: {type(e).__name__}: {e}")
+
+    def _reopen(self) -> StoreSet:
+        """
+        別プロセス（ingest.py / --watch）の書き込みはこのプロセスが読み込み済みの索引に反映されないことがあるので、
+        世代が進んだら新しいシステムで開き直す（古い方は使用中の検索が終わるまで動き続ける）
+        """
+        return self._open()
+
+    @contextmanager
+    def _borrow(self):
+        """
+        世代を確認して、この検索で使うストア一式を借りる。
+        開き直しは新しいストアを開いてから差し替え、古い方は借りている検索が全て返してから閉じる
+        """
+        with self._lock:
+            if self.generation.changed():
+                with telemetry.span("retrieve.reopen", generation=self.generation.value):
+                    old, self.stores = self.stores, self._reopen()
+                old.retired = True
+                if old.users == 0:
+                    self._close(old)
+                if self.result_cache is not None:
+                    self.result_cache.clear()
+            stores = self.stores
+            stores.users += 1
+        try:
+            yield stores
+        finally:
+            with self._lock:
+                stores.users -= 1
+                if stores.retired and stores.users == 0:
+                    self._close(stores)
+
+    def _chunk_filters(self, doc_col, qvecs, where: dict | None) -> list[dict | None]:
+        """
+        二段検索の1段目：文書単位の索引で上位 doc_top_n 出典を選び、クエリごとのチャンク検索の where にする。
+        無効・索引が空・where で出典を指定済みのときは where のまま（全チャンクを検索）
+        """
+        if doc_col is None or (where and "source" in where):
+            return [where] * len(qvecs)
+        with telemetry.span("retrieve.docs", n_results=self.doc_top_n, n_queries=len(qvecs)):
+            res = doc_col.query(query_embeddings=qvecs, n_results=self.doc_top_n, where=where, include=[])
+        filters = []
+        for ids in res.get("ids") or [[] for _ in qvecs]:
+            if not ids:
+                filters.append(where)
+                continue
+            f = {"source": {"$in": list(ids)}}
+            filters.append({"$and": [where, f]} if where else f)
+        return filters
+
+    def retrieve(self, query: str, top_k: int = 6, where: dict | None = None):
+        try:
+            with self._borrow() as stores:
+                with telemetry.span("retrieve.embed"):
+                    qvec = self.embedder.embed_query(query)
+                key = None
+                if self.result_cache is not None:
+                    key = (vector_key(qvec), top_k, json.dumps(where, sort_keys=True, ensure_ascii=False))
+                    hit = self.result_cache.get(key)
+                    if hit is not None:
+                        return hit
+                chunk_where = self._chunk_filters(stores.doc_col, [qvec], where)[0]
+                with telemetry.span("retrieve.query", n_results=top_k * self.overfetch):
+                    res = stores.col.query(
+                        query_embeddings=[qvec],
+                        n_results=top_k * self.overfetch,
+                        where=chunk_where,
+                        include=["documents", "metadatas", "distances"],
+                    )
+            hits = to_hits(res)
+            budget = self.context_token_budget if self.context_token_budget > 0 else 1 << 30
+            with telemetry.span("retrieve.pack") as sp:
+                context, passages, self.last_pack_stats = pack_context(
+                    hits, budget, max_passages=top_k, dedup_threshold=self.dedup_threshold,
+                )
+                sp.attrs["context_tokens"] = self.last_pack_stats["tokens"]
+            sources = [p.source for p in passages]
+            result = (context, sorted(set(sources)))
+            if key is not None:
+                self.result_cache.put(key, result)
+            return result
         except Exception:
             # コレクションが空などでも落とさない
             return "", []
+
+    def retrieve_many(self, queries, top_k: int = 6, where: dict | None = None) -> list[list[RetrievalHit]]:
+        """
+        複数クエリをまとめて埋め込み、1回の col.query で引く（評価・バッチ処理用）。
+        詰め込み・結果キャッシュは通さず、クエリごとの生のヒット（距離順 top_k）を返す。例外はそのまま送出する。
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        with self._borrow() as stores:
+            with telemetry.span("retrieve.embed", n_queries=len(queries)):
+                embed_many = getattr(self.embedder, "embed_queries", None)
+                qvecs = embed_many(queries) if embed_many else [self.embedder.embed_query(q) for q in queries]
+            filters = self._chunk_filters(stores.doc_col, qvecs, where)
+            include = ["documents", "metadatas", "distances"]
+            with telemetry.span("retrieve.query", n_results=top_k, n_queries=len(queries)):
+                if all(f == where for f in filters):
+                    res = stores.col.query(query_embeddings=qvecs, n_results=top_k, where=where, include=include)
+                    return [to_hits(res, i) for i in range(len(queries))]
+                # 二段検索ではクエリごとに絞り込む出典が違う
+                return [
+                    to_hits(stores.col.query(query_embeddings=[v], n_results=top_k, where=f, include=include))
+                    for v, f in zip(qvecs, filters)
+                ]
+
+    def cache_stats(self):
+        stats = {"retrieval": self.result_cache.stats() if self.result_cache is not None else {}}
+        embed_stats = getattr(self.embedder, "cache_stats", None)
+        if embed_stats is not None:
+            stats["query_embedding"] = embed_stats()
+        stats["generation"] = self.generation.value
+        if self.last_pack_stats:
+            stats["context_pack"] = self.last_pack_stats
+        return stats
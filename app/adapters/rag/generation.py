@@ -0,0 +1,57 @@
+# app/adapters/rag/generation.py
+# ----------------------------------------
+# コレクション世代カウンタ
+# - ingest.py がコレクションを変更するたびに <chroma_path>/generation を +1
+# - 検索側は値が変わったら検索結果キャッシュを捨てる（プロセスをまたいで有効）
+# ----------------------------------------
+import os
+import tempfile
+
+GENERATION_FILE = "generation"
+
+
+def generation_path(chroma_path: str) -> str:
+    return os.path.join(chroma_path, GENERATION_FILE)
+
+
+def read_generation(chroma_path: str) -> int:
+    try:
+        with open(generation_path(chroma_path), "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_generation(chroma_path: str) -> int:
+    """世代を1つ進める（一時ファイル経由で置き換えるので読み手が壊れた値を見ない）"""
+    gen = read_generation(chroma_path) + 1
+    os.makedirs(chroma_path, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".generation-", dir=chroma_path)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(str(gen))
+    os.replace(tmp, generation_path(chroma_path))
+    return gen
+
+
+class GenerationWatcher:
+    """stat だけで変更を検出し、変わったときだけ中身を読む"""
+
+    def __init__(self, chroma_path: str):
+        self.chroma_path = chroma_path
+        self._sig = None
+        self.value = read_generation(chroma_path)
+
+    def changed(self) -> bool:
+        try:
+            st = os.stat(generation_path(self.chroma_path))
+            sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            sig = None
+        if sig == self._sig:
+            return False
+        self._sig = sig
+        gen = read_generation(self.chroma_path)
+        if gen != self.value:
+            self.value = gen
+            return True
+        return False
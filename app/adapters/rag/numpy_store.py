@@ -0,0 +1,409 @@
+# app/adapters/rag/numpy_store.py
+# ----------------------------------------
+# memmap した NumPy 行列の全件内積で検索するベクトルストア（Chroma の代わり）
+# - ベクトル: 正規化済みを float16（または int8 + ベクトルごとのスケール）で追記専用ファイルに保存
+# - 本文・メタデータ: 同じディレクトリの sqlite（位置 pos → id / source / document / metadata / alive）
+# - 検索: 小さなブロックごとに float32 へ戻して行列積 → argpartition で top_k（近似なしの厳密検索）
+#   複数クエリはまとめて1回の行列積で処理する
+# - 索引の構築が要らないので起動は即時。memmap なので複数ワーカープロセスでページを共有する
+# - 更新・削除は墓標（alive=0）＋追記。墓標が多くなったら compact() で詰め直す
+# - ingest.py / ChromaWriter / --sync がそのまま使えるよう Chroma のコレクションと同じ形のメソッドを持つ
+# ----------------------------------------
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.adapters.rag.chroma_retriever import ChromaRetriever, StoreSet
+
+STORE_DIR = "numpy_store"  # <chroma_path>/numpy_store/
+DOC_STORE_DIR = "numpy_store_docs"  # 文書単位の索引（1出典 = 1ベクトル）
+DTYPES = {"float16": np.float16, "int8": np.int8}
+SUBSET_RATIO = 0.5  # where で絞った行がこの割合未満なら、その行だけを読んで内積を取る
+BLOCK_ROWS = 1024  # float32 に戻して1回の行列積に使う行数（L2 に収まる大きさが速い）
+COMPACT_RATIO = 0.3  # 墓標がこの割合を超えたら maybe_compact() で詰め直す
+
+
+def numpy_store_path(chroma_path: str, name: str = STORE_DIR) -> str:
+    return os.path.join(chroma_path, name)
+
+
+def _where_clause(where: Optional[dict]) -> Tuple[str, list]:
+    """Chroma の where（{"k": v} / {"k": {"$eq": v}} / {"k": {"$in": [...]}} / {"$and": [...]}）→ SQL"""
+    if not where:
+        return "", []
+    if "$and" in where:
+        parts = [_where_clause(w) for w in where["$and"]]
+        return " AND ".join(f"({p[0]})" for p in parts), [a for p in parts for a in p[1]]
+    clauses, args = [], []
+    for k, v in where.items():
+        col = "source" if k == "source" else f"json_extract(metadata, '$.{k}')"
+        if isinstance(v, dict) and set(v) == {"$in"}:
+            values = list(v["$in"])
+            clauses.append(f"{col} IN ({','.join('?' * len(values))})" if values else "0")
+            args.extend(values)
+            continue
+        if isinstance(v, dict):
+            if set(v) != {"$eq"}:
+                raise ValueError(f"unsupported where operator: {v}")
+            v = v["$eq"]
+        clauses.append(f"{col} = ?")
+        args.append(v)
+    return " AND ".join(clauses), args
+
+
+class NumpyVectorStore:
+    def __init__(self, path: str, dtype: str = "float16"):
+        if dtype not in DTYPES:
+            raise ValueError(f"unknown vector dtype: {dtype}")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, "chunks.sqlite3"), check_same_thread=False, timeout=30)
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (pos INTEGER, id TEXT, source TEXT, document TEXT,"
+            " metadata TEXT, alive INTEGER)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_pos ON chunks(pos)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_id ON chunks(id, alive)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source, alive)")
+        self._db.commit()
+        # 既存ストアの型を優先（途中で変えると読めなくなる）
+        self.dtype = self._meta("dtype") or dtype
+        self.dim: Optional[int] = int(self._meta("dim")) if self._meta("dim") else None
+        self._vecs: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._alive: Optional[np.ndarray] = None
+        self._mapped_rows = -1
+        self._mapped_epoch: Optional[str] = None
+
+    # -------- ファイル --------
+    def _meta(self, k: str) -> Optional[str]:
+        row = self._db.execute("SELECT v FROM meta WHERE k=?", (k,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, **kv):
+        self._db.executemany("INSERT OR REPLACE INTO meta (k, v) VALUES (?, ?)", [(k, str(v)) for k, v in kv.items()])
+
+    @property
+    def rows(self) -> int:
+        return int(self._meta("rows") or 0)
+
+    def _snapshot(self) -> Tuple[str, int]:
+        """(epoch, rows) を1回で読む（compact は両方を同じトランザクションで書き換える）"""
+        meta = dict(self._db.execute("SELECT k, v FROM meta WHERE k IN ('epoch', 'rows')"))
+        return meta.get("epoch") or "0", int(meta.get("rows") or 0)
+
+    def _files(self, epoch: Optional[str] = None) -> Tuple[str, str]:
+        epoch = epoch or self._meta("epoch") or "0"
+        return (os.path.join(self.path, f"vectors.{epoch}.bin"), os.path.join(self.path, f"scales.{epoch}.f32"))
+
+    def _map(self):
+        """
+        sqlite 上の確定行数まで memmap し直す（epoch か行数が変わったか、delete / update の後だけ）。
+        別の書き手が compact すると行数が同じでも pos が振り直されるので、epoch も見る
+        """
+        epoch, rows = self._snapshot()
+        if (epoch, rows) == (self._mapped_epoch, self._mapped_rows):
+            return
+        vec_path, scale_path = self._files(epoch)
+        if rows and self.dim:
+            self._vecs = np.memmap(vec_path, dtype=DTYPES[self.dtype], mode="r", shape=(rows, self.dim))
+            if self.dtype == "int8":
+                self._scales = np.memmap(scale_path, dtype=np.float32, mode="r", shape=(rows,))
+        else:
+            self._vecs = self._scales = None
+        alive = np.zeros(rows, dtype=bool)
+        # rows を読んだあとに別の書き手が追記した行は、まだ memmap していないので含めない
+        alive_pos = [r[0] for r in self._db.execute("SELECT pos FROM chunks WHERE alive=1 AND pos < ?", (rows,))]
+        alive[np.asarray(alive_pos, dtype=np.int64)] = True
+        self._alive = alive
+        self._mapped_epoch, self._mapped_rows = epoch, rows
+
+    def _encode(self, embs: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        embs = embs / np.clip(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12, None)
+        if self.dtype == "float16":
+            return embs.astype(np.float16), None
+        scales = np.clip(np.abs(embs).max(axis=1), 1e-12, None) / 127.0
+        return np.round(embs / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    # -------- 書き込み（Chroma のコレクション互換） --------
+    def add(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[dict], embeddings):
+        """同じ id が既にあれば置き換える（古い行は墓標にして末尾へ追記）"""
+        embs = np.asarray(embeddings, dtype=np.float32)
+        if not len(ids):
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(embs.shape[1])
+                self._set_meta(dim=self.dim, dtype=self.dtype)
+            elif embs.shape[1] != self.dim:
+                raise ValueError(f"dimension mismatch: {embs.shape[1]} != {self.dim}")
+            vecs, scales = self._encode(embs)
+            vec_path, scale_path = self._files()
+            start = self.rows
+            # ベクトルを先に書いてから行数を確定（読み手は確定済みの行までしか見ない）
+            with open(vec_path, "ab") as f:
+                f.seek(start * self.dim * vecs.itemsize)
+                f.truncate()
+                f.write(vecs.tobytes())
+            if scales is not None:
+                with open(scale_path, "ab") as f:
+                    f.seek(start * 4)
+                    f.truncate()
+                    f.write(scales.tobytes())
+            try:
+                self._db.executemany("UPDATE chunks SET alive=0 WHERE id=? AND alive=1", [(i,) for i in ids])
+                self._db.executemany(
+                    "INSERT INTO chunks (pos, id, source, document, metadata, alive) VALUES (?, ?, ?, ?, ?, 1)",
+                    [
+                        (start + n, i, str((m or {}).get("source", "")), d,
+                         json.dumps({k: v for k, v in (m or {}).items() if v is not None}, ensure_ascii=False))
+                        for n, (i, d, m) in enumerate(zip(ids, documents, metadatas))
+                    ],
+                )
+                self._set_meta(rows=start + len(ids))
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+
+    upsert = add
+
+    def update(self, ids: Sequence[str], metadatas: Sequence[dict]):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE chunks SET metadata=?, source=? WHERE id=? AND alive=1",
+                [
+                    (json.dumps({k: v for k, v in (m or {}).items() if v is not None}, ensure_ascii=False),
+                     str((m or {}).get("source", "")), i)
+                    for i, m in zip(ids, metadatas)
+                ],
+            )
+            self._db.commit()
+            self._mapped_rows = -1  # 次の検索で読み直す
+
+    def delete(self, ids: Optional[Sequence[str]] = None, where: Optional[dict] = None):
+        with self._lock:
+            if ids is not None:
+                self._db.executemany("UPDATE chunks SET alive=0 WHERE id=? AND alive=1", [(i,) for i in ids])
+            else:
+                clause, args = _where_clause(where)
+                if not clause:
+                    raise ValueError("delete needs ids or where")
+                self._db.execute(f"UPDATE chunks SET alive=0 WHERE alive=1 AND {clause}", args)
+            self._db.commit()
+            self._mapped_rows = -1  # 行数が変わらない墓標だけの変更でも _alive を作り直す
+
+    # -------- 読み出し --------
+    def count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM chunks WHERE alive=1").fetchone()[0]
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None) -> Dict[str, list]:
+        clause, args = _where_clause(where)
+        sql = "SELECT id, document, metadata, pos FROM chunks WHERE alive=1"
+        if clause:
+            sql += f" AND {clause}"
+        if ids is not None:
+            ids = list(ids)
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            args = args + ids
+        sql += " ORDER BY pos"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            args = args + [int(limit), int(offset or 0)]
+        rows = self._db.execute(sql, args).fetchall()
+        out: Dict[str, list] = {"ids": [r[0] for r in rows]}
+        if "documents" in include:
+            out["documents"] = [r[1] for r in rows]
+        if "metadatas" in include:
+            out["metadatas"] = [json.loads(r[2]) for r in rows]
+        if "embeddings" in include:
+            out["embeddings"] = self._vectors([r[3] for r in rows])
+        return out
+
+    def _vectors(self, positions) -> np.ndarray:
+        """保存形式から戻したベクトル（float32・正規化済み）"""
+        with self._lock:
+            self._map()
+            vecs, scales = self._vecs, self._scales
+        if vecs is None or not len(positions):
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        pos = np.asarray(positions, dtype=np.int64)
+        out = np.asarray(vecs[pos], dtype=np.float32)
+        if scales is not None:
+            out *= np.asarray(scales[pos])[:, None]
+        return out
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None, include=None) -> Dict[str, list]:
+        """全件との内積で top n_results（距離は Chroma の cosine と同じ 1 - 類似度）。複数クエリ可"""
+        q = np.asarray(query_embeddings, dtype=np.float32)
+        if q.ndim == 1:
+            q = q[None, :]
+        q = q / np.clip(np.linalg.norm(q, axis=1, keepdims=True), 1e-12, None)
+        with self._lock:
+            self._map()
+            vecs, scales, mask, epoch = self._vecs, self._scales, self._alive, self._mapped_epoch
+            allowed = None
+            if where:
+                clause, args = _where_clause(where)
+                allowed = np.fromiter(
+                    (r[0] for r in self._db.execute(
+                        f"SELECT pos FROM chunks WHERE alive=1 AND pos < ? AND {clause}", [self._mapped_rows, *args]
+                    )),
+                    dtype=np.int64,
+                )
+        empty = {"ids": [[] for _ in q], "documents": [[] for _ in q], "metadatas": [[] for _ in q],
+                 "distances": [[] for _ in q]}
+        if vecs is None or not mask.any() or (allowed is not None and not len(allowed)):
+            return empty
+        if q.shape[1] != vecs.shape[1]:
+            raise ValueError(f"dimension mismatch: {q.shape[1]} != {vecs.shape[1]}")
+        if allowed is not None and len(allowed) < SUBSET_RATIO * vecs.shape[0]:
+            # 絞り込みが狭い（文書 → チャンクの二段検索など）ときは該当行だけを読む：全件数に比例しない
+            allowed.sort()
+            scores = self._scores(q, vecs[allowed], scales[allowed] if scales is not None else None)
+        else:
+            scores = self._scores(q, vecs, scales)
+            if allowed is not None:
+                mask = np.zeros_like(mask)
+                mask[allowed] = True
+            scores[:, ~mask] = -np.inf
+            allowed = None
+        k = min(max(1, int(n_results)), scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        score = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-score, axis=1)
+        pos = np.take_along_axis(top, order, axis=1)
+        score = np.take_along_axis(score, order, axis=1)
+        if allowed is not None:
+            pos = allowed[pos]
+
+        wanted = sorted({int(p) for p, sc in zip(pos.ravel(), score.ravel()) if np.isfinite(sc)})
+        rows = {}
+        if wanted:
+            # 墓標になった位置は _alive が古くても返さない
+            marks = ",".join("?" * len(wanted))
+            rows = {r[0]: r[1:] for r in self._db.execute(
+                f"SELECT pos, id, document, metadata FROM chunks WHERE alive=1 AND pos IN ({marks})", wanted
+            )}
+            if self._snapshot()[0] != epoch:
+                # 検索中に別の書き手が compact した（pos が振り直された）→ 新しいファイルで引き直す
+                return self.query(query_embeddings, n_results=n_results, where=where, include=include)
+        for qi in range(q.shape[0]):
+            ids, docs, metas, dists = [], [], [], []
+            for p, sc in zip(pos[qi], score[qi]):
+                if not np.isfinite(sc) or int(p) not in rows:
+                    continue
+                i, d, m = rows[int(p)]
+                ids.append(i)
+                docs.append(d)
+                metas.append(json.loads(m))
+                dists.append(float(1.0 - sc))
+            empty["ids"][qi], empty["documents"][qi] = ids, docs
+            empty["metadatas"][qi], empty["distances"][qi] = metas, dists
+        return empty
+
+    def _scores(self, q: np.ndarray, vecs: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+        """(クエリ数, 行数) の内積。ブロックごとに float32 へ戻して行列積（BLAS は float16 を扱えない）"""
+        out = np.empty((q.shape[0], vecs.shape[0]), dtype=np.float32)
+        buf = np.empty((min(BLOCK_ROWS, vecs.shape[0]), vecs.shape[1]), dtype=np.int32)
+        if self.dtype == "float16":
+            # float16 のビットを 13 ずらして float32 の仮数・指数の位置へ置く（符号は符号拡張の余りを落とす）。
+            # 値はちょうど 2^-112 倍になるので、クエリ側を 2^112 倍しておけば astype より速く同じ結果になる
+            qs = q * np.float32(2.0 ** 112)
+            for s in range(0, vecs.shape[0], BLOCK_ROWS):
+                b = buf[:min(BLOCK_ROWS, vecs.shape[0] - s)]
+                np.left_shift(vecs[s:s + len(b)].view(np.int16), 13, out=b, dtype=np.int32)
+                np.bitwise_and(b, np.int32(-0x70000001), out=b)  # 0x8FFFFFFF
+                np.matmul(qs, b.view(np.float32).T, out=out[:, s:s + len(b)])
+        else:
+            fbuf = buf.view(np.float32)
+            for s in range(0, vecs.shape[0], BLOCK_ROWS):
+                b = fbuf[:min(BLOCK_ROWS, vecs.shape[0] - s)]
+                np.copyto(b, vecs[s:s + len(b)], casting="unsafe")
+                np.matmul(q, b.T, out=out[:, s:s + len(b)])
+            out *= scales
+        return out
+
+    # -------- 保守 --------
+    def dead_ratio(self) -> float:
+        rows = self.rows
+        return 1.0 - self.count() / rows if rows else 0.0
+
+    def compact(self) -> int:
+        """生きている行だけを新しいファイルへ詰め直す（ファイル名の世代を進めて差し替える）。戻り値は削った行数"""
+        with self._lock:
+            self._map()
+            rows = self.rows
+            alive_pos = np.flatnonzero(self._alive)
+            epoch = str(int(self._meta("epoch") or 0) + 1)
+            old_vec, old_scale = self._files()
+            new_vec = os.path.join(self.path, f"vectors.{epoch}.bin")
+            new_scale = os.path.join(self.path, f"scales.{epoch}.f32")
+            with open(new_vec, "wb") as f:
+                for s in range(0, len(alive_pos), BLOCK_ROWS):
+                    f.write(np.asarray(self._vecs[alive_pos[s:s + BLOCK_ROWS]]).tobytes())
+            if self._scales is not None:
+                with open(new_scale, "wb") as f:
+                    f.write(np.asarray(self._scales[alive_pos]).tobytes())
+            try:
+                self._db.execute("DELETE FROM chunks WHERE alive=0")
+                self._db.execute("CREATE TEMP TABLE IF NOT EXISTS remap (old INTEGER PRIMARY KEY, new INTEGER)")
+                self._db.execute("DELETE FROM remap")
+                self._db.executemany("INSERT INTO remap (old, new) VALUES (?, ?)",
+                                     [(int(p), n) for n, p in enumerate(alive_pos)])
+                self._db.execute("UPDATE chunks SET pos = (SELECT new FROM remap WHERE old = chunks.pos)")
+                self._set_meta(rows=len(alive_pos), epoch=epoch)
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                for p in (new_vec, new_scale):
+                    if os.path.exists(p):
+                        os.remove(p)
+                raise
+            self._vecs = self._scales = None
+            self._mapped_rows = -1
+            # 旧ファイルを開いている読み手は自分の memmap を使い続けられる（POSIX）
+            for p in (old_vec, old_scale):
+                if os.path.exists(p):
+                    os.remove(p)
+        removed = rows - len(alive_pos)
+        print(f"[NUMPY_STORE] compacted {rows} -> {len(alive_pos)} rows")
+        return removed
+
+    def maybe_compact(self, ratio: float = COMPACT_RATIO) -> int:
+        return self.compact() if self.rows and self.dead_ratio() > ratio else 0
+
+    def close(self):
+        with self._lock:
+            self._vecs = self._scales = None
+            self._db.close()
+
+
+class NumpyRetriever(ChromaRetriever):
+    """検索・キャッシュ・コンテキストの詰め込みは ChromaRetriever と同じで、ストアだけ NumpyVectorStore"""
+
+    def __init__(self, path: str = "chroma_db", dtype: str = "float16", **kwargs):
+        self.dtype = dtype
+        super().__init__(path=path, **kwargs)
+
+    def _open(self) -> StoreSet:
+        t0 = time.perf_counter()
+        col = NumpyVectorStore(numpy_store_path(self.path), dtype=self.dtype)
+        doc_col = None
+        if self.doc_top_n:
+            doc_col = NumpyVectorStore(numpy_store_path(self.path, DOC_STORE_DIR), dtype=self.dtype)
+        print(f"[NUMPY_STORE] opened {col.count()} vectors in {(time.perf_counter() - t0) * 1000:.1f}ms")
+        return StoreSet(col, doc_col)
+
+    def _close(self, stores: StoreSet):
+        # 借りている検索が無くなってから呼ばれる（memmap は詰め直しで消えたファイルでも最後まで読める）
+        for c in (stores.col, stores.doc_col):
+            if c is not None:
+                c.close()
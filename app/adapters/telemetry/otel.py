@@ -0,0 +1,58 @@
+# app/adapters/telemetry/otel.py
+# ----------------------------------------
+# app.core.telemetry の span を OpenTelemetry へ送るシンク
+# - endpoint を指定すると OTLP(gRPC) で送信、console=True なら標準出力へ
+# - 記録済みの開始/終了時刻をそのまま使うので、親子関係も含めて後からまとめて作る
+# ----------------------------------------
+from typing import Dict, List
+
+from app.core import telemetry
+from app.core.telemetry import SpanRecord
+
+_installed = False
+
+
+def _attr_value(v):
+    # OTel の属性は str/bool/int/float（とその配列）のみ
+    return v if isinstance(v, (str, bool, int, float)) else str(v)
+
+
+def install_otel(endpoint: str = "", service_name: str = "rag-chat", console: bool = False) -> bool:
+    """OTel のシンクを登録（プロセスで1回だけ）。SDK が無ければ False"""
+    global _installed
+    if _installed:
+        return True
+    try:
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    except ImportError:
+        print("[TELEMETRY] opentelemetry-sdk が見つからないため OTel 送信は無効です")
+        return False
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    if endpoint:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    if console:
+        provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+    tracer = provider.get_tracer("app.telemetry")
+
+    def sink(records: List[SpanRecord]):
+        spans: Dict[str, object] = {}
+        # records は親が子より先に並んでいる（開始順）
+        for r in records:
+            parent = spans.get(r.parent_id) if r.parent_id else None
+            ctx = otel_trace.set_span_in_context(parent) if parent is not None else None
+            s = tracer.start_span(
+                r.name, context=ctx, start_time=r.start_ns,
+                attributes={k: _attr_value(v) for k, v in r.attrs.items() if v is not None},
+            )
+            s.end(end_time=r.end_ns)
+            spans[r.span_id] = s
+
+    telemetry.add_sink(sink)
+    _installed = True
+    print(f"[TELEMETRY] OpenTelemetry enabled endpoint={endpoint or '-'} console={console}")
+    return True
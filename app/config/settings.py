@@ -4,11 +4,51 @@ from dataclasses import dataclass
 @dataclass
 class Settings:
     provider: str = os.environ.get("PROVIDER_KIND", "ollama")
-    ollama_url: str = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+    ollama_url: str = os.environ.get("OLLAMA_URL", "http://localhost:11434")  # カンマ区切りで複数可
+    ollama_connect_timeout: float = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+    ollama_read_timeout: float = float(os.environ.get("OLLAMA_READ_TIMEOUT", "600"))
+    ollama_pool_size: int = int(os.environ.get("OLLAMA_POOL_SIZE", "32"))  # keep-alive 接続数
+    ollama_max_inflight: int = int(os.environ.get("OLLAMA_MAX_INFLIGHT", "4"))  # バックエンドごとの同時生成数
+    ollama_max_waiting: int = int(os.environ.get("OLLAMA_MAX_WAITING", "32"))   # 待ち行列の上限
+    ollama_wait_timeout: float = float(os.environ.get("OLLAMA_WAIT_TIMEOUT", "30"))
+    ollama_health_interval: float = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "15"))
     default_model: str = os.environ.get("DEFAULT_MODEL", "llama3:8b")
     embed_model: str = os.environ.get("EMBED_MODEL", "intfloat/multilingual-e5-small")
+    embed_backend: str = os.environ.get("EMBED_BACKEND", "sbert")  # sbert | onnx | onnx-int8
+    onnx_dir: str = os.environ.get("ONNX_DIR", "onnx_models")
+    embed_threads: int = int(os.environ.get("EMBED_THREADS", "0"))  # onnxruntime のスレッド数（0は自動）
     chroma_path: str = os.environ.get("CHROMA_PATH", "chroma_db")
-    num_ctx: int = int(os.environ.get("NUM_CTX", "8192"))
+    vector_store: str = os.environ.get("VECTOR_STORE", "chroma")    # chroma | numpy（<chroma_path>/numpy_store/）
+    vector_dtype: str = os.environ.get("VECTOR_DTYPE", "float16")   # numpy ストアの保存形式: float16 | int8
+    embed_cache_dir: str = os.environ.get("EMBED_CACHE_DIR", "embed_cache")  # 空文字で無効
+    embed_cache_max_entries: int = int(os.environ.get("EMBED_CACHE_MAX_ENTRIES", "200000"))
+    embed_token_budget: int = int(os.environ.get("EMBED_TOKEN_BUDGET", "16384"))  # 1バッチの(最長長x件数)
+    embed_max_batch: int = int(os.environ.get("EMBED_MAX_BATCH", "64"))          # マイクロバッチの最大件数
+    embed_max_wait_ms: float = float(os.environ.get("EMBED_MAX_WAIT_MS", "5"))   # 束ねるための待ち時間（0で無効）
+    embed_service_url: str = os.environ.get("EMBED_SERVICE_URL", "")  # 例: http://127.0.0.1:8765（空文字で同一プロセス）
+    query_cache_size: int = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))       # クエリ埋め込み（0で無効）
+    query_cache_ttl: float = float(os.environ.get("QUERY_CACHE_TTL", "3600"))
+    retrieval_cache_size: int = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "512"))  # 検索結果（0で無効）
+    retrieval_cache_ttl: float = float(os.environ.get("RETRIEVAL_CACHE_TTL", "600"))
+    answer_cache_path: str = os.environ.get("ANSWER_CACHE_PATH", "")  # 例: answer_cache/answers.sqlite3（空文字で無効）
+    answer_cache_max_entries: int = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+    answer_cache_ttl: float = float(os.environ.get("ANSWER_CACHE_TTL", "86400"))
+    answer_cache_threshold: float = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))  # クエリ類似度
+    context_token_budget: int = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "2048"))  # 参考資料のトークン上限
+    retrieval_overfetch: int = int(os.environ.get("RETRIEVAL_OVERFETCH", "2"))  # top_k の何倍を候補に取るか
+    retrieval_doc_top_n: int = int(os.environ.get("RETRIEVAL_DOC_TOP_N", "0"))  # 二段検索で残す出典数（0で無効）
+    stream_flush_ms: float = float(os.environ.get("STREAM_FLUSH_MS", "50"))  # 画面に出す間隔（0でトークンごと）
+    stream_flush_chars: int = int(os.environ.get("STREAM_FLUSH_CHARS", "512"))  # これだけ溜まったら間隔を待たずに出す
+    prompt_layout: str = os.environ.get("PROMPT_LAYOUT", "stable")  # stable | legacy
+    ollama_warmup: bool = os.environ.get("OLLAMA_WARMUP", "1") == "1"  # 選択中モデルを起動時に先読み
+    keep_alive: str = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")    # モデルを常駐させておく時間
+    otel_endpoint: str = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "")  # 例: http://localhost:4317
+    otel_console: bool = os.environ.get("OTEL_CONSOLE", "") == "1"  # span を標準出力へ（確認用）
+    otel_service_name: str = os.environ.get("OTEL_SERVICE_NAME", "rag-chat")
+    telemetry_ring_size: int = int(os.environ.get("TELEMETRY_RING_SIZE", "500"))  # サイドバー集計の件数
+    num_ctx: int = int(os.environ.get("NUM_CTX", "8192"))  # num_ctx の上限（実際の値はバケットから選ぶ）
+    num_ctx_buckets: str = os.environ.get("NUM_CTX_BUCKETS", "2048,4096,8192,16384")
+    answer_reserve_tokens: int = int(os.environ.get("ANSWER_RESERVE_TOKENS", "1024"))  # 回答用に空ける分
     temperature: float = float(os.environ.get("TEMPERATURE", "0.2"))
 
 settings = Settings()
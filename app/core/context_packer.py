@@ -0,0 +1,147 @@
+# 検索結果 → プロンプト用コンテキストの組み立て（トークン予算つき）
+# 1) source + chunk_index で連続するチャンクを1つにまとめ、チャンク間の重なりを削る
+# 2) ほぼ同じ内容の段落（文字3-gram の大半が採用済みの段落に含まれるもの）を落とす
+# 3) スコアの高い順に、予算に収まるものから詰める
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.types import RetrievalHit
+from app.core.tokens import estimate_tokens
+
+SEPARATOR = "\n\n---\n\n"
+
+
+@dataclass
+class Passage:
+    text: str
+    source: str
+    score: float
+    chunk_start: Optional[int] = None
+    chunk_end: Optional[int] = None
+    page: Optional[int] = None
+    heading: str = ""  # 見出しパス（構造化チャンクのみ）
+
+
+def strip_overlap(prev: str, nxt: str, max_overlap: int = 200, min_overlap: int = 8) -> str:
+    """nxt の先頭のうち prev の末尾と一致する最長部分を削って返す"""
+    limit = min(len(prev), len(nxt), max_overlap)
+    for k in range(limit, min_overlap - 1, -1):
+        if prev.endswith(nxt[:k]):
+            return nxt[k:]
+    return nxt
+
+
+def merge_adjacent(hits: List[RetrievalHit]) -> List[Passage]:
+    """同じ source で chunk_index が連続するヒットを結合（chunk_index が無いものは単独）"""
+    passages: List[Passage] = []
+    indexed = [h for h in hits if h.chunk_index is not None]
+    for h in hits:
+        if h.chunk_index is None:
+            passages.append(Passage(h.text, h.source, h.score, page=h.page,
+                                    heading=h.metadata.get("heading_path") or ""))
+
+    indexed.sort(key=lambda h: (h.source, h.chunk_index))
+    for source, group in groupby(indexed, key=lambda h: h.source):
+        run: Optional[Passage] = None
+        last_text = ""
+        for h in group:
+            if run is not None and h.chunk_index == run.chunk_end:
+                continue  # 同一チャンクの重複ヒット
+            if run is not None and h.chunk_index == run.chunk_end + 1:
+                run.text += strip_overlap(last_text, h.text)
+                run.chunk_end = h.chunk_index
+                run.score = max(run.score, h.score)
+            else:
+                if run is not None:
+                    passages.append(run)
+                run = Passage(h.text, source, h.score, h.chunk_index, h.chunk_index, h.page,
+                              h.metadata.get("heading_path") or "")
+            last_text = h.text
+        if run is not None:
+            passages.append(run)
+    return passages
+
+
+def _shingles(text: str, n: int = 3) -> Set[str]:
+    t = "".join(text.split())
+    if len(t) <= n:
+        return {t}
+    return {t[i:i + n] for i in range(len(t) - n + 1)}
+
+
+def _containment(a: Set[str], b: Set[str]) -> float:
+    """a の 3-gram のうち b にも含まれる割合（別ファイルに同じ文章が入っているケースも拾う）"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a)
+
+
+def render_passage(i: int, p: Passage) -> str:
+    heading = f"（{p.heading}）" if p.heading else ""
+    return f"[{i}] 出典: {p.source}{heading}\n{p.text}"
+
+
+def pack_context(
+    hits: List[RetrievalHit],
+    token_budget: int,
+    max_passages: Optional[int] = None,
+    dedup_threshold: float = 0.85,
+) -> Tuple[str, List[Passage], Dict[str, int]]:
+    """
+    hits をまとめて token_budget 以内のコンテキスト文字列にする。
+    戻り値: (context, 採用した Passage（スコア順）, 統計)
+    """
+    merged = merge_adjacent(hits)
+    merged.sort(key=lambda p: p.score, reverse=True)
+
+    chosen: List[Passage] = []
+    chosen_shingles: List[Set[str]] = []
+    used = 0
+    dropped_dup = dropped_budget = 0
+    sep_cost = estimate_tokens(SEPARATOR)
+    for p in merged:
+        if max_passages is not None and len(chosen) >= max_passages:
+            break
+        sh = _shingles(p.text)
+        if any(_containment(sh, c) >= dedup_threshold for c in chosen_shingles):
+            dropped_dup += 1
+            continue
+        cost = estimate_tokens(render_passage(len(chosen) + 1, p)) + (sep_cost if chosen else 0)
+        if used + cost > token_budget:
+            if chosen:
+                dropped_budget += 1
+                continue  # 小さいものなら後続が入るかもしれない
+            # 最上位すら入らない場合は切り詰めて1件だけ入れる
+            header_cost = estimate_tokens(render_passage(1, Passage("", p.source, p.score)))
+            p = Passage(_truncate_to_tokens(p.text, token_budget - header_cost),
+                        p.source, p.score, p.chunk_start, p.chunk_end, p.page, p.heading)
+            cost = estimate_tokens(render_passage(1, p))
+        chosen.append(p)
+        chosen_shingles.append(sh)
+        used += cost
+
+    context = SEPARATOR.join(render_passage(i, p) for i, p in enumerate(chosen, 1))
+    stats = {
+        "hits": len(hits),
+        "merged": len(merged),
+        "passages": len(chosen),
+        "dropped_duplicate": dropped_dup,
+        "dropped_budget": dropped_budget,
+        "tokens": estimate_tokens(context),
+        "raw_tokens": sum(estimate_tokens(h.text) for h in hits),
+    }
+    return context, chosen, stats
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    if budget <= 0:
+        return ""
+    lo, hi = 0, len(text)
+    while lo < hi:  # 予算に収まる最長の先頭部分（二分探索）
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
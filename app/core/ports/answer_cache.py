@@ -0,0 +1,7 @@
+from typing import Any, Dict, List, Optional, Protocol, Sequence
+from app.core.types import Message, CachedAnswer
+
+class AnswerCache(Protocol):
+    def make_key(self, model: str, options: Dict[str, Any], context: str, prefix: Sequence[Message]) -> str: ...
+    def lookup(self, key: str, qvec: List[float]) -> Optional[CachedAnswer]: ...
+    def put(self, key: str, query: str, qvec: List[float], answer: str, sources: Sequence[str]) -> None: ...
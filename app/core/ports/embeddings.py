@@ -2,4 +2,5 @@ from typing import List, Protocol
 
 class Embedder(Protocol):
     def embed_query(self, text: str) -> List[float]: ...
+    def embed_queries(self, texts: List[str]) -> List[List[float]]: ...
     def embed_texts(self, texts: List[str]) -> List[List[float]]: ...
@@ -1,8 +1,14 @@
-from typing import Iterable, List, Dict, Any, Protocol
-from app.core.types import Message, ChatChunk
+from typing import AsyncIterator, Iterable, List, Dict, Any, Optional, Protocol
+from app.core.types import Message, ChatChunk, CancelToken
 
 class LLMClient(Protocol):
     def list_models(self) -> List[str]: ...
+    def preload(self, model: str, keep_alive: Optional[str] = None) -> Any: ...
     def chat_stream(
-        self, messages: List[Message], model: str, options: Dict[str, Any]
+        self, messages: List[Message], model: str, options: Dict[str, Any],
+        cancel: Optional[CancelToken] = None,
     ) -> Iterable[ChatChunk]: ...
+    def chat_stream_async(
+        self, messages: List[Message], model: str, options: Dict[str, Any],
+        cancel: Optional[CancelToken] = None,
+    ) -> AsyncIterator[ChatChunk]: ...
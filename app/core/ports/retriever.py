@@ -1,4 +1,9 @@
-from typing import Protocol, Tuple
+from typing import Protocol, Sequence, Tuple
+
+from app.core.types import RetrievalHit
 
 class Retriever(Protocol):
-    def retrieve(self, query: str, top_k: int = 6) -> Tuple[str, list[str]]: ...
+    def retrieve(self, query: str, top_k: int = 6, where: dict | None = None) -> Tuple[str, list[str]]: ...
+    def retrieve_many(
+        self, queries: Sequence[str], top_k: int = 6, where: dict | None = None
+    ) -> list[list[RetrievalHit]]: ...
@@ -1,8 +1,94 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core.types import Message
+from app.core.tokens import estimate_messages_tokens, choose_num_ctx
+
+ANSWER_RULES = (
+    "\n\n※上記の資料のみを根拠に、日本語で簡潔に回答してください。"
+    + "\n必要に応じて [番号] を使って根拠を示してください。"
+)
+
 def build_system_prompt(base_system: str, context: str) -> str:
     return (
         (base_system or "")
         + "\n\n# 参考資料（抜粋）\n"
         + (context or "（該当資料なし）")
-        + "\n\n※上記の資料のみを根拠に、日本語で簡潔に回答してください。"
+        + ANSWER_RULES
+    )
+
+# -------- プレフィックス固定レイアウト（Ollama の KV キャッシュ再利用向け） --------
+# system とそれまでの履歴はターンをまたいでバイト単位で同一に保ち、
+# 毎ターン変わる参考資料は最新の user 発話の直前にだけ置く。
+def build_stable_system_prompt(base_system: str) -> str:
+    return (
+        (base_system or "")
+        + "\n\n各質問の直前に「# 参考資料（抜粋）」が付きます。"
+        + "\n※その質問に付いた資料のみを根拠に、日本語で簡潔に回答してください。"
         + "\n必要に応じて [番号] を使って根拠を示してください。"
     )
+
+def build_user_turn(user_input: str, context: str | None) -> str:
+    return (
+        "# 参考資料（抜粋）\n"
+        + (context or "（該当資料なし）")
+        + "\n\n# 質問\n"
+        + (user_input or "")
+    )
+
+# -------- メッセージ列の組み立て（ChatOrchestrator と app.py で共通） --------
+def build_messages(
+    base_system: str, user_input: str, history: List[Message], context: str, layout: str = "stable",
+) -> List[Message]:
+    """
+    layout:
+      "stable" … system+履歴を毎ターン同一に保ち、資料は最新の user 発話に付ける（KV キャッシュ再利用）
+      "legacy" … 資料を system に埋め込む従来方式（毎ターン先頭から再評価になる）
+    """
+    history = [m for m in history if m.role in ("user", "assistant")]
+    if layout == "legacy":
+        messages = [Message(role="system", content=build_system_prompt(base_system, context))]
+        messages.extend(history)
+        messages.append(Message(role="user", content=user_input))
+        return messages
+
+    messages = [Message(role="system", content=build_stable_system_prompt(base_system))]
+    for m in history:
+        if m.role == "user" and m.context is not None:
+            # 前のターンで送ったのと同じ文字列を再構成（プレフィックスが一致する）
+            messages.append(Message(role="user", content=build_user_turn(m.content, m.context)))
+        else:
+            messages.append(Message(role=m.role, content=m.content))
+    messages.append(Message(role="user", content=build_user_turn(user_input, context)))
+    return messages
+
+def fit_messages(
+    base_system: str, user_input: str, history: List[Message], context: str,
+    buckets: Sequence[int], reserve: int, max_num_ctx: Optional[int] = None, layout: str = "stable",
+) -> Tuple[List[Message], int, Dict[str, int]]:
+    """
+    プロンプトのトークン数を見積もって num_ctx のバケットを選ぶ。
+    上限（max_num_ctx 以下の最大バケット）にも収まらなければ古い履歴から往復単位で落とす。
+    戻り値: (messages, num_ctx, 統計)
+    """
+    buckets = [b for b in buckets if max_num_ctx is None or b <= max_num_ctx]
+    if not buckets:
+        buckets = [int(max_num_ctx)]
+    limit = max(buckets)
+
+    history = [m for m in history if m.role in ("user", "assistant")]
+    dropped = 0
+    while True:
+        messages = build_messages(base_system, user_input, history, context, layout)
+        prompt_tokens = estimate_messages_tokens(messages)
+        if prompt_tokens + reserve <= limit or not history:
+            break
+        # 最古の user から次の user の手前まで（= 1往復）を落とす
+        cut = 1
+        while cut < len(history) and history[cut].role != "user":
+            cut += 1
+        dropped += cut
+        history = history[cut:]
+
+    num_ctx = choose_num_ctx(prompt_tokens + reserve, buckets)
+    stats = {"prompt_tokens": prompt_tokens, "num_ctx": num_ctx, "history_dropped": dropped}
+    return messages, num_ctx, stats
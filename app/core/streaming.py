@@ -0,0 +1,71 @@
+# app/core/streaming.py
+# ----------------------------------------
+# トークン単位の ChatChunk 列 → 画面に出すフレームへのまとめ
+# - Ollama の NDJSON は 1トークン = 1 ChatChunk。st.write_stream は yield ごとに「それまでの全文」の
+#   markdown を送り直すので、長い回答では Streamlit サーバの CPU が差分送信と再描画に取られる
+# - 直前のフレームから interval_ms 経つか、max_chars 溜まったらまとめて1フレームにする
+# - 最初のトークンはすぐに出す（TTFT は遅らせない）。完了・エラーのときは溜まっている分を必ず出す
+# - 判定は上流からトークンを受け取ったときだけ（タイマースレッドは持たない）。
+#   トークンの間隔が interval_ms より空いたときは、その間隔の分だけ表示が遅れる
+# ----------------------------------------
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from app.core.types import ChatChunk
+
+
+def coalesce_chunks(
+    stream: Iterable[ChatChunk],
+    interval_ms: float = 50.0,
+    max_chars: int = 512,
+    stats: Optional[Dict[str, int]] = None,
+    clock: Callable[[], float] = time.perf_counter,
+) -> Iterator[ChatChunk]:
+    """
+    interval_ms <= 0 ならまとめずにそのまま流す（max_chars <= 0 は文字数で区切らない）。
+    stats を渡すと {"tokens": 受け取った本文チャンク数, "frames": 本文のあるフレーム数} を書き込む。
+    """
+    stats = stats if stats is not None else {}
+    stats.update(tokens=0, frames=0)
+    interval = interval_ms / 1000.0
+    buf: List[str] = []
+    n_chars = 0
+    last: Optional[float] = None  # 直前のフレームを出した時刻（None = まだ1つも出していない）
+    try:
+        for chunk in stream:
+            if chunk.content and not chunk.error:
+                stats["tokens"] += 1
+            if chunk.error:
+                # エラー文は独立したフレームにする（溜まっている本文を先に出す）
+                if buf:
+                    stats["frames"] += 1
+                    yield ChatChunk(content="".join(buf))
+                    buf, n_chars = [], 0
+                stats["frames"] += 1
+                yield chunk
+                last = clock()
+                continue
+            if not chunk.content and not chunk.done:
+                continue
+            buf.append(chunk.content)
+            n_chars += len(chunk.content)
+            now = clock()
+            if (
+                chunk.done or interval <= 0 or last is None
+                or now - last >= interval or (max_chars > 0 and n_chars >= max_chars)
+            ):
+                content = "".join(buf)
+                if content:
+                    stats["frames"] += 1  # 本文の無い完了通知は画面の更新にならない
+                yield ChatChunk(content=content, done=chunk.done, usage=chunk.usage)
+                buf, n_chars = [], 0
+                last = now
+        if buf:
+            # done を付けずに上流が終わった（途中切断など）
+            stats["frames"] += 1
+            yield ChatChunk(content="".join(buf))
+    finally:
+        # UI 側で打ち切られたら上流（HTTP 応答を読むジェネレータ）もすぐ閉じる
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
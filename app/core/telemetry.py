@@ -0,0 +1,151 @@
+# app/core/telemetry.py
+# ----------------------------------------
+# 段階ごとの所要時間の計測（依存なしの軽量版）
+# - 1ターン = 1 Trace（ルート span "chat.turn"）。検索・プロンプト組み立て・TTFT・生成を子 span として記録
+# - Trace が終わったら span をまとめてシンクへ渡す（既定は直近の分布を持つリングバッファ）
+# - OpenTelemetry への送信は adapters/telemetry/otel.py がシンクとして追加する
+# ----------------------------------------
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+
+@dataclass
+class SpanRecord:
+    name: str
+    start_ns: int  # epoch ns（OTel にそのまま渡せる）
+    end_ns: int = 0
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+Sink = Callable[[List[SpanRecord]], None]
+
+
+class StageStats:
+    """span 名ごとに直近 maxlen 件の所要時間(ms)を持つリングバッファ"""
+
+    def __init__(self, maxlen: int = 500):
+        self.maxlen = maxlen
+        self._lock = threading.Lock()
+        self._data: Dict[str, Deque[float]] = {}
+
+    def __call__(self, records: List[SpanRecord]):
+        with self._lock:
+            for r in records:
+                self._data.setdefault(r.name, deque(maxlen=self.maxlen)).append(r.duration_ms)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            data = {k: sorted(v) for k, v in self._data.items()}
+        rows = []
+        for name, xs in sorted(data.items()):
+            rows.append({
+                "stage": name,
+                "n": len(xs),
+                "p50_ms": round(xs[int(0.50 * (len(xs) - 1))], 1),
+                "p95_ms": round(xs[int(0.95 * (len(xs) - 1))], 1),
+            })
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+STAGES = StageStats()
+_sinks: List[Sink] = [STAGES]
+_current: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+def add_sink(sink: Sink):
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+
+def _emit(records: List[SpanRecord]):
+    for sink in list(_sinks):
+        try:
+            sink(records)
+        except Exception as e:
+            print(f"[TELEMETRY] sink failed: {type(e).__name__}: {e}")
+
+
+class Trace:
+    """1処理分の span の集まり。finish() でシンクへ送る（2回目以降は無視）"""
+
+    def __init__(self, name: str, **attrs: Any):
+        self.root = SpanRecord(name, time.time_ns(), attrs=dict(attrs))
+        self.records: List[SpanRecord] = [self.root]
+        self._stack: List[SpanRecord] = [self.root]
+        self._done = False
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[SpanRecord]:
+        rec = SpanRecord(name, time.time_ns(), attrs=dict(attrs), parent_id=self._stack[-1].span_id)
+        self.records.append(rec)
+        self._stack.append(rec)
+        try:
+            yield rec
+        finally:
+            rec.end_ns = time.time_ns()
+            self._stack.pop()
+
+    def record(self, name: str, start_ns: int, end_ns: int, **attrs: Any) -> SpanRecord:
+        """終了済みの区間を後から足す（TTFT やサーバ側の計測値など）"""
+        rec = SpanRecord(name, start_ns, end_ns, dict(attrs), parent_id=self.root.span_id)
+        self.records.append(rec)
+        return rec
+
+    def finish(self, **attrs: Any):
+        if self._done:
+            return
+        self._done = True
+        self.root.end_ns = time.time_ns()
+        self.root.attrs.update(attrs)
+        for r in self.records:
+            r.end_ns = r.end_ns or self.root.end_ns
+        _emit(self.records)
+
+    def durations(self) -> Dict[str, float]:
+        return {r.name: round(r.duration_ms, 1) for r in self.records if r.end_ns}
+
+
+def start_trace(name: str, **attrs: Any) -> Trace:
+    return Trace(name, **attrs)
+
+
+@contextmanager
+def use_trace(trace: Trace) -> Iterator[Trace]:
+    """この with の中で呼ばれた span() を trace の子にする"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[SpanRecord]:
+    """現在の Trace があればその子 span、なければ単独で記録してすぐ送る"""
+    trace = _current.get()
+    if trace is not None:
+        with trace.span(name, **attrs) as rec:
+            yield rec
+        return
+    rec = SpanRecord(name, time.time_ns(), attrs=dict(attrs))
+    try:
+        yield rec
+    finally:
+        rec.end_ns = time.time_ns()
+        _emit([rec])
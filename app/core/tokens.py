@@ -0,0 +1,23 @@
+# トークン数の概算（LLM 側のトークナイザを読み込まずに使える軽量版）
+# - 日本語などの非 ASCII 文字: 1文字 ≒ 1トークン
+# - ASCII（英数字・記号・空白）: 4文字 ≒ 1トークン
+# 実際より少し多めに出る想定。num_ctx やコンテキスト予算の見積もりに使う。
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    n_ascii = len(text.encode("ascii", errors="ignore"))
+    return (len(text) - n_ascii) + (n_ascii + 3) // 4
+
+# 1メッセージあたりのテンプレート分（role タグ・区切り）の上乗せ
+MESSAGE_OVERHEAD = 4
+
+def estimate_messages_tokens(messages) -> int:
+    return sum(estimate_tokens(m.content) + MESSAGE_OVERHEAD for m in messages)
+
+def choose_num_ctx(needed: int, buckets) -> int:
+    """needed 以上の最小バケット。どれにも収まらなければ最大バケット"""
+    for b in sorted(buckets):
+        if b >= needed:
+            return b
+    return max(buckets)
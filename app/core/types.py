@@ -1,5 +1,6 @@
-from dataclasses import dataclass
-from typing import Dict, Optional
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 
 Role = str  # "system" | "user" | "assistant" | "tool"
 
@@ -7,9 +8,77 @@ Role = str  # "system" | "user" | "assistant" | "tool"
 class Message:
     role: Role
     content: str
+    context: Optional[str] = None  # user 発話に付けた参考資料（プレフィックス固定レイアウトで再現用）
+
+    def to_api(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
 
 @dataclass
 class ChatChunk:
     content: str
     done: bool = False
-    usage: Optional[Dict[str, int]] = None  # tokens 等（必要に応じて）
+    usage: Optional[Dict[str, float]] = None  # 最終チャンクのみ：prompt_eval_count / eval_count / *_ms
+    error: Optional[str] = None  # "connect" | "http" | "busy" | "cancelled" | "unexpected"
+
+class CancelToken:
+    """生成のキャンセル通知。cancel() で登録済みのクローズ処理（HTTP応答の close 等）を呼ぶ"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._closers: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def attach(self, closer: Callable[[], None]):
+        with self._lock:
+            if not self._event.is_set():
+                self._closers.append(closer)
+                return
+        closer()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            closers, self._closers = self._closers, []
+        for fn in closers:
+            try:
+                fn()
+            except Exception:
+                pass
+
+@dataclass
+class ChatTurn:
+    """1ターン分の実行結果。`stream, sources = turn` の2値展開にも対応"""
+    stream: Iterable[ChatChunk]
+    sources: List[str]
+    context: str = ""
+    messages: List[Message] = field(default_factory=list)
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter((self.stream, self.sources))
+
+@dataclass
+class RetrievalHit:
+    """ベクトル検索の1件（score は類似度。大きいほど近い。distance はストアが返した cosine 距離）"""
+    text: str
+    source: str
+    score: float = 0.0
+    chunk_index: Optional[int] = None
+    page: Optional[int] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    id: str = ""
+    distance: Optional[float] = None
+
+@dataclass
+class CachedAnswer:
+    """回答キャッシュの命中結果（similarity はクエリ埋め込みのコサイン類似度）"""
+    answer: str
+    sources: List[str]
+    similarity: float
+    created: float
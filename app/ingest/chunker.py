@@ -0,0 +1,256 @@
+# app/ingest/chunker.py
+# ----------------------------------------
+# 構造を考慮したチャンク分割（固定長の文字窓の置き換え）
+# - Markdown の見出し / 段落（空行区切り）/ コードフェンスをブロックとして読み、見出しの階層を保持
+# - ブロックを埋め込みモデルのトークナイザで数え、target_tokens まで詰めて1チャンクにする
+# - 大きすぎるブロックは 文（。！？!? / 英文の . ）→ 行 → 文字 の順に細かくしてから詰める
+# - 重なりは任意で「直前チャンクの末尾 n 文」（0 なら重ねない）
+# - セグメント列（ページ単位など）を逐次に処理するので巨大ファイルでも全文を持たない
+# ----------------------------------------
+import re
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.core.tokens import estimate_tokens
+
+TokenCounter = Callable[[str], int]
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+FENCE_RE = re.compile(r"^\s*(```|~~~)")
+# 文末: 句点・感嘆符・疑問符（後ろの閉じ括弧も含める）/ 英文のピリオド + 空白 / 改行
+SENTENCE_END_RE = re.compile(r"[。！？!?]+[」』）)\"']*|\.(?=\s)|\n")
+HEADING_SEP = " > "
+MAX_BLOCK_CHARS = 1 << 14  # 空行のない長文（PDF など）を途中でブロックとして区切る
+
+
+class TextChunk(NamedTuple):
+    text: str
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+    heading_path: str = ""
+
+
+@dataclass
+class Unit:
+    """チャンクを組み立てる最小単位（ブロック / 文 / 行）"""
+    text: str
+    tokens: int
+    kind: str  # "heading" | "text" | "code"
+    path: Tuple[str, ...]
+    page_start: Optional[int]
+    page_end: Optional[int]
+    sep: str = "\n\n"  # 直前の単位との区切り（同じブロック内の文・行は "" ＝本文に含む）
+
+
+_tokenizers = {}
+
+
+def make_token_counter(model_name: str = "") -> Tuple[TokenCounter, str]:
+    """
+    埋め込みモデルのトークナイザで数える関数と、その識別子（チャンク設定の署名用）。
+    transformers / モデルが手元に無ければ estimate_tokens で代用する。
+    """
+    if model_name:
+        tok = _tokenizers.get(model_name)
+        if tok is None:
+            try:
+                from transformers import AutoTokenizer
+                tok = AutoTokenizer.from_pretrained(model_name)
+            except Exception as e:
+                print(f"[CHUNK] tokenizer unavailable ({type(e).__name__}: {e}), using estimate_tokens")
+                tok = False
+            _tokenizers[model_name] = tok
+        if tok:
+            return (lambda s: len(tok(s, add_special_tokens=False)["input_ids"])), f"tok:{model_name}"
+    return estimate_tokens, "est"
+
+
+def split_sentences(text: str) -> List[str]:
+    """文に分ける。区切り文字・空白は直前の文に残すので、連結すると元の文字列に戻る"""
+    out, start = [], 0
+    for m in SENTENCE_END_RE.finditer(text):
+        end = m.end()
+        while end < len(text) and text[end] in " \t　":
+            end += 1
+        if end > start and text[start:end].strip():
+            out.append(text[start:end])
+            start = end
+    if text[start:].strip():
+        out.append(text[start:])
+    elif out:
+        out[-1] += text[start:]
+    return out
+
+
+def iter_lines(segments: Iterable[Tuple[str, Optional[int]]]) -> Iterator[Tuple[str, Optional[int]]]:
+    """セグメント列 → (行, 行の先頭があるページ)。改行は行から外す"""
+    buf, page = "", None
+    for text, seg_page in segments:
+        if seg_page is not None and not buf:
+            page = seg_page
+        buf += text
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            yield line, page
+            if seg_page is not None:
+                page = seg_page
+    if buf:
+        yield buf, page
+
+
+Block = Tuple[str, str, Tuple[str, ...], List[Optional[int]]]
+
+
+def iter_blocks(segments: Iterable[Tuple[str, Optional[int]]], markdown: bool = True) -> Iterator[Block]:
+    """(kind, text, 見出しパス, 行ごとのページ)。markdown=False では見出し・フェンスを解釈しない"""
+    path: List[Tuple[int, str]] = []
+    lines: List[str] = []
+    pages: List[Optional[int]] = []
+    n_chars = 0
+    fence = ""
+
+    def flush(kind: str):
+        nonlocal lines, pages, n_chars
+        text = "\n".join(lines)
+        block = (kind, text, tuple(t for _, t in path), pages)
+        lines, pages, n_chars = [], [], 0
+        return block if text.strip() else None
+
+    for line, page in iter_lines(segments):
+        if fence:
+            lines.append(line)
+            pages.append(page)
+            if line.strip().startswith(fence):
+                fence = ""
+                block = flush("code")
+                if block:
+                    yield block
+            continue
+        if markdown and FENCE_RE.match(line):
+            block = flush("text")
+            if block:
+                yield block
+            fence = FENCE_RE.match(line).group(1)
+            lines.append(line)
+            pages.append(page)
+            continue
+        m = HEADING_RE.match(line) if markdown else None
+        if m:
+            block = flush("text")
+            if block:
+                yield block
+            level = len(m.group(1))
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, m.group(2)))
+            yield "heading", line, tuple(t for _, t in path), [page]
+            continue
+        if not line.strip():
+            block = flush("text")
+            if block:
+                yield block
+            continue
+        lines.append(line)
+        pages.append(page)
+        n_chars += len(line) + 1
+        if n_chars >= MAX_BLOCK_CHARS:
+            block = flush("text")
+            if block:
+                yield block
+    block = flush("code" if fence else "text")
+    if block:
+        yield block
+
+
+def _common_path(units: List[Unit]) -> Tuple[str, ...]:
+    path = units[0].path
+    for u in units[1:]:
+        n = 0
+        while n < min(len(path), len(u.path)) and path[n] == u.path[n]:
+            n += 1
+        path = path[:n]
+    return path
+
+
+class StructuredChunker:
+    def __init__(self, count_tokens: TokenCounter = estimate_tokens, target_tokens: int = 320, overlap_sentences: int = 0):
+        self.count = count_tokens
+        self.target = max(16, int(target_tokens))
+        self.overlap = max(0, int(overlap_sentences))
+
+    # -------- ブロック → 単位 --------
+    def _hard_split(self, text: str, tokens: int) -> List[str]:
+        """1文・1行でも大きすぎるものは文字数の比で割る"""
+        step = max(1, len(text) * self.target // max(tokens, 1))
+        return [text[i:i + step] for i in range(0, len(text), step)]
+
+    def _units(self, kind: str, text: str, path, line_pages: List[Optional[int]]) -> List[Unit]:
+        tokens = self.count(text)
+        if tokens <= self.target or kind == "heading":
+            return [Unit(text, tokens, kind, path, line_pages[0], line_pages[-1])]
+        pieces = [ln + "\n" for ln in text.split("\n")] if kind == "code" else split_sentences(text)
+        if kind == "code":
+            pieces[-1] = pieces[-1][:-1]
+        units: List[Unit] = []
+        line = 0  # 単位の先頭がある行（ページを引くため）
+        for piece in pieces:
+            n = self.count(piece)
+            parts = [piece] if n <= self.target else self._hard_split(piece, n)
+            for part in parts:
+                end = min(line + part.rstrip("\n").count("\n"), len(line_pages) - 1)
+                units.append(Unit(
+                    part, n if len(parts) == 1 else self.count(part), kind, path,
+                    line_pages[line], line_pages[end], sep="",
+                ))
+                line = min(line + part.count("\n"), len(line_pages) - 1)
+        units[0].sep = "\n\n"
+        return units
+
+    # -------- 詰める --------
+    def _render(self, units: List[Unit]) -> TextChunk:
+        text = units[0].text + "".join(u.sep + u.text for u in units[1:])
+        pages = [p for u in units for p in (u.page_start, u.page_end) if p is not None]
+        return TextChunk(
+            text.strip(), min(pages) if pages else None, max(pages) if pages else None,
+            HEADING_SEP.join(_common_path(units)),
+        )
+
+    def _carry(self, units: List[Unit]) -> List[Unit]:
+        """直前チャンク末尾の n 文（本文のみ・最大 target/2）を次チャンクの先頭に"""
+        if not self.overlap or not units or units[-1].kind != "text":
+            return []
+        last = units[-1]
+        tail = split_sentences(last.text)[-self.overlap:]
+        text = "".join(tail)
+        tokens = self.count(text)
+        if tokens > self.target // 2:
+            return []
+        return [Unit(text, tokens, "text", last.path, last.page_end, last.page_end)]
+
+    def chunk(self, segments: Iterable[Tuple[str, Optional[int]]], markdown: bool = True) -> Iterator[TextChunk]:
+        cur: List[Unit] = []
+        cur_tokens = 0
+        n_carried = 0  # cur の先頭にある重なり分（それだけならチャンクにしない）
+        for kind, text, path, line_pages in iter_blocks(segments, markdown):
+            if kind == "heading" and cur and cur_tokens >= self.target // 2:
+                # 十分な量があれば見出しの前で切る（小さな節は次の節とまとめる）
+                yield self._render(cur)
+                cur, cur_tokens, n_carried = [], 0, 0
+            for u in self._units(kind, text, path, line_pages):
+                if cur and len(cur) > n_carried and cur_tokens + u.tokens > self.target:
+                    # 末尾の見出しは本文と一緒に次のチャンクへ送る
+                    moved = []
+                    while cur and cur[-1].kind == "heading":
+                        moved.insert(0, cur.pop())
+                    if len(cur) > n_carried:
+                        yield self._render(cur)
+                        carried = [] if moved else self._carry(cur)
+                    else:
+                        carried = cur
+                    cur = carried + moved
+                    n_carried = len(carried)
+                    cur_tokens = sum(x.tokens for x in cur)
+                cur.append(u)
+                cur_tokens += u.tokens
+        if len(cur) > n_carried:
+            yield self._render(cur)
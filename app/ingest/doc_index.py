@@ -0,0 +1,67 @@
+# app/ingest/doc_index.py
+# ----------------------------------------
+# 文書単位の索引（1出典 = 1ベクトル）の維持
+# - ベクトル: その出典の全チャンクの埋め込みの平均（正規化し直す）。埋め込み直しは不要
+# - メタデータ: チャンクと共通のもの（type / date / tags_csv / study_time_hours / file_hash）+ チャンク数
+# - id は出典の絶対パス（= チャンクの source）。検索側は上位 N 文書の id でチャンク検索を絞る
+# - ingest.py がチャンクの書き込みを終えたあと、変更のあった出典だけを作り直す
+# ----------------------------------------
+import os
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+DOC_COLLECTION_NAME = "rag_sources"
+CHUNK_ONLY_KEYS = ("chunk_index", "page", "page_end", "heading_path")
+
+
+def doc_record(col, source: str) -> Optional[Tuple[np.ndarray, Dict[str, Any], str]]:
+    """チャンクのコレクションから (平均ベクトル, 文書メタデータ, 表示用テキスト)。チャンクが無ければ None"""
+    res = col.get(where={"source": source}, include=["embeddings", "metadatas"])
+    embs = res.get("embeddings")
+    if embs is None or not len(embs):
+        return None
+    vec = np.asarray(embs, dtype=np.float32).mean(axis=0)
+    vec /= max(float(np.linalg.norm(vec)), 1e-12)
+    metas = res.get("metadatas") or [{}]
+    first = min(metas, key=lambda m: (m or {}).get("chunk_index", 0)) or {}
+    meta = {k: v for k, v in first.items() if k not in CHUNK_ONLY_KEYS and v is not None}
+    meta["source"] = source
+    meta["n_chunks"] = len(metas)
+    title = os.path.basename(source)
+    if first.get("heading_path"):
+        title += f" — {first['heading_path']}"
+    return vec, meta, title
+
+
+def update_doc_index(col, doc_col, sources: Iterable[str], batch_size: int = 256) -> Dict[str, int]:
+    """sources の文書ベクトルを作り直す（チャンクが無くなった出典は削除）"""
+    ids, vecs, metas, docs = [], [], [], []
+    counts = {"upserted": 0, "deleted": 0}
+
+    def flush():
+        if ids:
+            doc_col.upsert(ids=list(ids), embeddings=np.vstack(vecs), metadatas=list(metas), documents=list(docs))
+            counts["upserted"] += len(ids)
+            ids.clear(), vecs.clear(), metas.clear(), docs.clear()
+
+    gone = []
+    for source in sorted(set(sources)):
+        rec = doc_record(col, source)
+        if rec is None:
+            gone.append(source)
+            continue
+        vec, meta, title = rec
+        ids.append(source)
+        vecs.append(vec)
+        metas.append(meta)
+        docs.append(title)
+        if len(ids) >= batch_size:
+            flush()
+    flush()
+    if gone:
+        existing = doc_col.get(ids=gone, include=[]).get("ids") or []
+        if existing:
+            doc_col.delete(ids=list(existing))
+            counts["deleted"] = len(existing)
+    return counts
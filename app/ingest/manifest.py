@@ -0,0 +1,137 @@
+# app/ingest/manifest.py
+# ----------------------------------------
+# インジェスト・マニフェスト
+# - ファイルごとの size / mtime / 内容ハッシュ / チャンク数 / 埋め込みモデルを記録
+# - 次回インジェストで「変更なし」のファイルを読み込み前にスキップする
+# ----------------------------------------
+import os
+import json
+import hashlib
+import tempfile
+from typing import Any, Dict, Iterable, Optional
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "ingest_manifest.json"  # ベクトルストアのディレクトリ直下に置く
+
+
+def manifest_path(chroma_dir: str) -> str:
+    """インジェストと回答キャッシュが同じファイルを見るよう、置き場所はここで決める"""
+    return os.path.join(chroma_dir, MANIFEST_NAME)
+
+
+def file_sha1(path: str, bufsize: int = 1 << 20) -> str:
+    """ファイルの生バイト列の sha1（PDF のパースより圧倒的に安い）"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            b = f.read(bufsize)
+            if not b:
+                break
+            h.update(b)
+    return h.hexdigest()
+
+
+class IngestManifest:
+    """
+    path(絶対パス) -> エントリ の JSON 永続マップ。
+    エントリ: {size, mtime_ns, content_hash, chunks, embed_model, chunking}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[WARN] manifest 読込失敗のため全件処理します: {self.path} ({e})")
+            return
+        if data.get("version") != MANIFEST_VERSION:
+            print(f"[INFO] manifest のバージョンが異なるため破棄: {self.path}")
+            return
+        self.entries = data.get("files", {})
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def paths(self) -> Iterable[str]:
+        return list(self.entries.keys())
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(path)
+
+    def clear(self):
+        self.entries = {}
+
+    def is_unchanged(self, path: str, st: os.stat_result, embed_model: str, chunking: str) -> bool:
+        """stat と設定だけで判定（ファイルは開かない）"""
+        e = self.entries.get(path)
+        return bool(
+            e
+            and e.get("size") == st.st_size
+            and e.get("mtime_ns") == st.st_mtime_ns
+            and e.get("embed_model") == embed_model
+            and e.get("chunking") == chunking
+        )
+
+    def known_hash(self, path: str, embed_model: str, chunking: str) -> Optional[str]:
+        """
+        前回と同じ設定で登録済みならそのときの内容ハッシュを返す。
+        mtime/size が変わっても中身が同じ（touch・コピー等）ならパースを省ける。
+        """
+        e = self.entries.get(path)
+        if e and e.get("embed_model") == embed_model and e.get("chunking") == chunking:
+            return e.get("content_hash")
+        return None
+
+    def update(
+        self,
+        path: str,
+        st: os.stat_result,
+        content_hash: str,
+        chunks: int,
+        embed_model: str,
+        chunking: str,
+    ):
+        self.entries[path] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "content_hash": content_hash,
+            "chunks": chunks,
+            "embed_model": embed_model,
+            "chunking": chunking,
+        }
+
+    def touch(self, path: str, st: os.stat_result):
+        """中身が同じ場合に size/mtime だけ更新"""
+        e = self.entries.get(path)
+        if e is not None:
+            e["size"] = st.st_size
+            e["mtime_ns"] = st.st_mtime_ns
+
+    def remove(self, path: str):
+        self.entries.pop(path, None)
+
+    def save(self):
+        """一時ファイルに書いてから置き換え（途中クラッシュで壊さない）"""
+        d = os.path.dirname(self.path) or "."
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".manifest-", dir=d)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": MANIFEST_VERSION, "files": self.entries},
+                    f,
+                    ensure_ascii=False,
+                    indent=1,
+                )
+            os.replace(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
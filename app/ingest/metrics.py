@@ -0,0 +1,151 @@
+# app/ingest/metrics.py
+# ----------------------------------------
+# インジェスト1回分の計測（段階ごとの時間・スループット・最大 RSS・遅いファイル）
+# - 段階: setup（コレクション・トークナイザの準備）/ scan
+#         hash / read / metadata / chunk（パース用ワーカー内）
+#         embed / write（書き込みスレッド）/ doc_index / compact
+#   ワーカーの時間はファイルごとに結果と一緒に返してもらい、ここで足し込む（プロセスをまたいだ合計なので経過時間を超えうる）
+# - 進捗は一定間隔で [PROGRESS] 行を出す（ファイル数・件/s・MB/s・残り時間の目安）
+# - report() は JSON にそのまま書ける dict。--report で保存する
+# - profile_call: cProfile で1回分を記録（--profile）
+# ----------------------------------------
+import os
+import sys
+import time
+import heapq
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGE_ORDER = ("setup", "scan", "hash", "read", "metadata", "chunk", "embed", "write", "doc_index", "compact")
+PROGRESS_INTERVAL_S = float(os.environ.get("INGEST_PROGRESS_SECONDS", "5"))
+SLOWEST_FILES = 10
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """このプロセスと、終了済みの子プロセス（パース用ワーカー）の最大 RSS"""
+    if resource is None:
+        return {"main": None, "workers": None}
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024  # macOS はバイト、Linux は KiB
+    return {
+        "main": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+        "workers": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1),
+    }
+
+
+class IngestMetrics:
+    """段階ごとの累積秒と、ファイルごとの記録（遅い順に slowest 件だけ保持）"""
+
+    def __init__(self, total_files: int = 0, slowest: int = SLOWEST_FILES,
+                 progress_interval: float = PROGRESS_INTERVAL_S):
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        self.total_files = total_files
+        self.slowest = slowest
+        self.progress_interval = progress_interval
+        self.stages: Dict[str, float] = {}
+        self.files = 0
+        self.chunks = 0
+        self.bytes = 0
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._seq = 0
+        self._last_progress = self.t0
+        self._lock = threading.Lock()  # 書き込みスレッドからも足し込む
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def file_done(self, path: str, n_bytes: int, n_chunks: int, timings: Dict[str, float],
+                  slow_page: Optional[Tuple[int, float]] = None):
+        """1ファイル分の段階別の秒を足し込み、遅いファイルの候補に入れる"""
+        for k, v in timings.items():
+            self.add(k, v)
+        self.files += 1
+        self.chunks += n_chunks
+        self.bytes += n_bytes
+        row: Dict[str, Any] = {
+            "path": path,
+            "seconds": round(sum(timings.values()), 4),
+            "bytes": n_bytes,
+            "chunks": n_chunks,
+            "stages": {k: round(v, 4) for k, v in timings.items()},
+        }
+        if slow_page is not None:
+            row["slowest_page"] = {"page": slow_page[0], "seconds": round(slow_page[1], 4)}
+        self._seq += 1
+        item = (row["seconds"], self._seq, row)
+        if len(self._heap) < self.slowest:
+            heapq.heappush(self._heap, item)
+        elif item[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, item)
+
+    def maybe_progress(self, done: int):
+        now = time.perf_counter()
+        if done <= 0 or self.progress_interval <= 0 or now - self._last_progress < self.progress_interval:
+            return
+        self._last_progress = now
+        dt = now - self.t0
+        total = self.total_files
+        eta = f" eta={(total - done) * dt / done:.0f}s" if done and total > done else ""
+        print(f"[PROGRESS] {done}/{total} files {done / dt:.1f} files/s {self.chunks / dt:.1f} chunks/s "
+              f"{self.bytes / dt / 1e6:.2f} MB/s{eta}")
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.t0
+        per_s = (lambda n: round(n / elapsed, 2) if elapsed else 0.0)
+        order = [s for s in STAGE_ORDER if s in self.stages] + sorted(set(self.stages) - set(STAGE_ORDER))
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "cpu_s": round(time.process_time() - self.cpu0, 3),  # メインプロセスのみ
+            "files": self.files,
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "files_per_s": per_s(self.files),
+            "chunks_per_s": per_s(self.chunks),
+            "bytes_per_s": per_s(self.bytes),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages_s": {s: round(self.stages[s], 3) for s in order},
+            "slowest_files": [row for _, _, row in sorted(self._heap, reverse=True)],
+        }
+
+    def print_summary(self, report: Optional[Dict[str, Any]] = None, show: int = 5):
+        r = report or self.report()
+        rss = r["peak_rss_mb"]
+        print(f"[THROUGHPUT] {r['files']} files / {r['chunks']} chunks / {r['bytes'] / 1e6:.1f} MB "
+              f"in {r['elapsed_s']:.1f}s: {r['files_per_s']} files/s {r['chunks_per_s']} chunks/s "
+              f"{r['bytes_per_s'] / 1e6:.2f} MB/s peak_rss={rss['main']}MB (workers {rss['workers']}MB)")
+        print("[STAGES] " + " ".join(f"{k}={v:.2f}s" for k, v in r["stages_s"].items()))
+        for row in r["slowest_files"][:show]:
+            page = row.get("slowest_page")
+            page = f" slowest_page={page['page']} ({page['seconds']:.2f}s)" if page else ""
+            print(f"[SLOWEST] {row['seconds']:.2f}s {row['path']} {row['bytes'] / 1e6:.2f}MB "
+                  f"{row['chunks']} chunks{page}")
+
+
+def profile_call(path: str, fn: Callable[..., Any], *args, top: int = 25, **kwargs) -> Any:
+    """fn を cProfile 付きで実行し、path に pstats 形式で保存して上位を表示（このプロセスのメインスレッドのみ）"""
+    import cProfile
+    import pstats
+
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(fn, *args, **kwargs)
+    finally:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        prof.dump_stats(path)
+        pstats.Stats(prof).sort_stats("cumulative").print_stats(top)
+        print(f"[PROFILE] saved {path}（python -m pstats {path} / snakeviz {path} で確認）")
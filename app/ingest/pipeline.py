@@ -0,0 +1,176 @@
+# app/ingest/pipeline.py
+# ----------------------------------------
+# インジェストのステージ部品
+# - iter_parallel : プロセスプールでファイルを並列パース（投入数を制限）
+# - ChromaWriter  : バックグラウンドで Chroma へ書き込むスレッド
+# ----------------------------------------
+import time
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def iter_parallel(
+    fn: Callable[..., Any],
+    args_list: Iterable[Tuple],
+    workers: int,
+    max_inflight: Optional[int] = None,
+) -> Iterator[Any]:
+    """
+    fn(*args) をプロセスプールで実行し、終わった順に結果を返す。
+    同時に抱える未消費の結果は max_inflight 件まで（メモリ上限）。
+    workers <= 1 のときはプールを作らずその場で実行する。
+    """
+    if workers <= 1:
+        for a in args_list:
+            yield fn(*a)
+        return
+
+    max_inflight = max_inflight or workers * 4
+    it = iter(args_list)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        inflight = set()
+        for a in it:
+            inflight.add(ex.submit(fn, *a))
+            if len(inflight) >= max_inflight:
+                break
+        while inflight:
+            done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+            for f in done:
+                yield f.result()
+                a = next(it, None)
+                if a is not None:
+                    inflight.add(ex.submit(fn, *a))
+
+
+def set_torch_threads(n: Optional[int]):
+    """埋め込み（torch）の intra-op スレッド数を指定（None/0 は既定のまま）"""
+    if not n:
+        return
+    import torch
+    torch.set_num_threads(int(n))
+
+
+class ChromaWriter(threading.Thread):
+    """
+    Chroma への delete / add を別スレッドで実行する。
+    メインスレッドは次のバッチを埋め込んでいる間に書き込みが進む。
+    キューは有界なので、書き込みが詰まれば埋め込み側が待つ。
+    upsert=True では add の代わりに upsert（--sync: 途中で止まった回の残りがあっても重複しない）。
+    """
+
+    def __init__(self, col, batch_size: int = 1000, max_queue: int = 4, upsert: bool = False):
+        super().__init__(name="chroma-writer", daemon=True)
+        self.col = col
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.q: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self.error: Optional[BaseException] = None
+        self.added = 0
+        self.deleted_sources = 0
+        self.updated = 0
+        self.deleted_ids = 0
+        self.seconds = 0.0  # 書き込み（delete / add / update）に掛かった時間の合計
+        self._ids: List[str] = []
+        self._docs: List[str] = []
+        self._metas: List[dict] = []
+        self._embs: List[np.ndarray] = []
+        self._buffered_sources = set()
+
+    # -------- メインスレッド側 --------
+    def delete_source(self, source: str):
+        self._put(("delete", source))
+
+    def add(self, ids: Sequence[str], docs: Sequence[str], metas: Sequence[dict], embs):
+        self._put(("add", list(ids), list(docs), list(metas), np.asarray(embs, dtype=np.float32)))
+
+    def delete_ids(self, ids: Sequence[str]):
+        """id 指定の削除（batch_size 件ずつ）"""
+        ids = list(ids)
+        for i in range(0, len(ids), self.batch_size):
+            self._put(("delete_ids", ids[i:i + self.batch_size]))
+
+    def update_metadata(self, ids: Sequence[str], metas: Sequence[dict]):
+        """埋め込みはそのまま、メタデータ（chunk_index など）だけ書き換える"""
+        if ids:
+            self._put(("update", list(ids), list(metas)))
+
+    def close(self):
+        """残りを書き出してスレッド終了を待つ。書き込みエラーはここで再送出"""
+        self.q.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def _put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.q.put(item)
+
+    # -------- 書き込みスレッド側 --------
+    def run(self):
+        while True:
+            item = self.q.get()
+            if item is None:
+                if self.error is None:
+                    self._guard(self._do_flush, "final")
+                return
+            if self.error is not None:
+                continue  # 失敗後はメインが止まるまで読み捨てる
+            if item[0] == "delete":
+                self._guard(self._do_delete, item[1])
+            elif item[0] == "delete_ids":
+                self._guard(self._do_delete_ids, item[1])
+            elif item[0] == "update":
+                self._guard(self._do_update, *item[1:])
+            else:
+                self._guard(self._do_buffer, *item[1:])
+
+    def _guard(self, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            fn(*args)
+        except BaseException as e:  # メインスレッドへ引き渡す
+            self.error = e
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+    def _do_delete(self, source: str):
+        # 同じ source の追加がまだバッファにあれば先に書く（順序保証）
+        if source in self._buffered_sources:
+            self._do_flush("order")
+        self.col.delete(where={"source": source})
+        self.deleted_sources += 1
+        print(f"[DEL] source={source}")
+
+    def _do_delete_ids(self, ids: List[str]):
+        self.col.delete(ids=ids)
+        self.deleted_ids += len(ids)
+        print(f"[DEL] {len(ids)} chunks by id")
+
+    def _do_update(self, ids: List[str], metas: List[dict]):
+        self.col.update(ids=ids, metadatas=metas)
+        self.updated += len(ids)
+
+    def _do_buffer(self, ids, docs, metas, embs):
+        self._ids += ids
+        self._docs += docs
+        self._metas += metas
+        self._embs.append(embs)
+        self._buffered_sources.update(m.get("source") for m in metas)
+        if len(self._ids) >= self.batch_size:
+            self._do_flush("flush")
+
+    def _do_flush(self, label: str):
+        if not self._ids:
+            return
+        embs = np.vstack(self._embs)
+        write = self.col.upsert if self.upsert else self.col.add
+        write(ids=self._ids, documents=self._docs, metadatas=self._metas, embeddings=embs)
+        self.added += len(self._ids)
+        print(f"[{'UPSERT' if self.upsert else 'ADD'}] {len(self._ids)} chunks ({label})")
+        self._ids, self._docs, self._metas, self._embs = [], [], [], []
+        self._buffered_sources = set()
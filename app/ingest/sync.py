@@ -0,0 +1,53 @@
+# app/ingest/sync.py
+# ----------------------------------------
+# コレクションとディスク上のファイルの突き合わせ（ingest.py --sync 用）
+# - チャンク id は「source + 本文の sha1」で決まる（同じ本文なら同じ id → 埋め込み・HNSW への再挿入を省ける）
+# - ファイル単位: 既存 id と新しい id を比べ、増えた分だけ upsert・減った分だけ id 指定で削除
+# - コレクション全体: ディスクに無い source のチャンク（孤児）をページングで集めてまとめて削除
+# ----------------------------------------
+import hashlib
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+GET_PAGE_SIZE = 5000
+
+
+def chunk_id(source: str, text: str, seen: Dict[str, int]) -> str:
+    """内容から決まる安定 id。同じファイルに同じ本文が複数あれば2つ目以降に連番を付ける"""
+    h = hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()[:16]
+    k = seen.get(h, 0)
+    seen[h] = k + 1
+    return f"{source}#{h}" if k == 0 else f"{source}#{h}-{k}"
+
+
+def clean_metadata(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Chroma は None の値を保存しないので、比較用に落としておく"""
+    return {k: v for k, v in meta.items() if v is not None}
+
+
+def existing_chunks(col, source: str) -> Dict[str, Dict[str, Any]]:
+    """source のチャンク id → メタデータ"""
+    res = col.get(where={"source": source}, include=["metadatas"])
+    return {i: (m or {}) for i, m in zip(res.get("ids") or [], res.get("metadatas") or [])}
+
+
+def iter_collection_sources(col, page_size: int = GET_PAGE_SIZE) -> Iterator[Tuple[str, str]]:
+    """コレクション全体の (id, source) をページ単位で読む（埋め込み・本文は読まない）"""
+    offset = 0
+    while True:
+        res = col.get(include=["metadatas"], limit=page_size, offset=offset)
+        ids = res.get("ids") or []
+        for i, m in zip(ids, res.get("metadatas") or []):
+            yield i, str((m or {}).get("source", ""))
+        if len(ids) < page_size:
+            return
+        offset += len(ids)
+
+
+def find_orphans(col, current: Iterable[str], page_size: int = GET_PAGE_SIZE) -> Dict[str, List[str]]:
+    """ディスク上に無い source → そのチャンク id のリスト"""
+    keep: Set[str] = set(current)
+    orphans: Dict[str, List[str]] = {}
+    for i, source in iter_collection_sources(col, page_size):
+        if source not in keep:
+            orphans.setdefault(source, []).append(i)
+    return orphans
@@ -1,12 +1,116 @@
-from app.adapters.providers.ollama_client import OllamaClient
-from app.adapters.embeddings.sbert_embedder import SbertEmbedder
+from app.adapters.providers.ollama_pool import OllamaPool
+from app.adapters.embeddings.embedding_cache import EmbeddingCache, embed_signature
 from app.adapters.rag.chroma_retriever import ChromaRetriever
 
+def build_embedder(**kwargs):
+    embed_model = kwargs.get("embed_model", "intfloat/multilingual-e5-small")
+    backend = kwargs.get("embed_backend", "sbert")
+    # 埋め込みサービス指定時はモデルをこのプロセスに読み込まない
+    if kwargs.get("embed_service_url"):
+        from app.adapters.embeddings.remote_embedder import RemoteEmbedder
+        return RemoteEmbedder(
+            kwargs["embed_service_url"],
+            timeout=kwargs.get("embed_service_timeout", 60.0),
+            query_cache_size=kwargs.get("query_cache_size", 1024),
+            query_cache_ttl=kwargs.get("query_cache_ttl", 3600),
+        )
+    cache = None
+    if kwargs.get("embed_cache_dir"):
+        cache = EmbeddingCache(
+            kwargs["embed_cache_dir"], embed_signature(embed_model, backend),
+            max_entries=kwargs.get("embed_cache_max_entries", 200_000),
+        )
+    common = dict(
+        cache=cache,
+        token_budget=kwargs.get("embed_token_budget", 16384),
+        query_cache_size=kwargs.get("query_cache_size", 1024),
+        query_cache_ttl=kwargs.get("query_cache_ttl", 3600),
+    )
+    # 選ばれたバックエンドだけ import（onnx 選択時は torch を読み込まない）
+    if backend == "sbert":
+        from app.adapters.embeddings.sbert_embedder import SbertEmbedder
+        embedder = SbertEmbedder(embed_model, **common)
+    elif backend in ("onnx", "onnx-int8"):
+        from app.adapters.embeddings.onnx_embedder import OnnxEmbedder
+        embedder = OnnxEmbedder(
+            embed_model,
+            onnx_dir=kwargs.get("onnx_dir", "onnx_models"),
+            quantize=backend == "onnx-int8",
+            threads=kwargs.get("embed_threads", 0),
+            **common,
+        )
+    else:
+        raise ValueError(f"unknown embed backend: {backend}")
+    # 同時セッションの 1 件ずつの埋め込みを束ねる（0 で無効）
+    if kwargs.get("embed_max_wait_ms", 0) > 0:
+        from app.adapters.embeddings.micro_batch import BatchingEmbedder
+        embedder = BatchingEmbedder(
+            embedder, max_batch=kwargs.get("embed_max_batch", 64), max_wait_ms=kwargs["embed_max_wait_ms"],
+        )
+    return embedder
+
+def build_answer_cache(**kwargs):
+    """answer_cache_path が空なら None（回答キャッシュ無効）"""
+    if not kwargs.get("answer_cache_path"):
+        return None
+    from app.adapters.cache.answer_cache import AnswerCache
+    return AnswerCache(
+        kwargs["answer_cache_path"],
+        chroma_path=kwargs.get("chroma_path", "chroma_db"),
+        max_entries=kwargs.get("answer_cache_max_entries", 5000),
+        ttl=kwargs.get("answer_cache_ttl", 86400),
+        threshold=kwargs.get("answer_cache_threshold", 0.95),
+    )
+
+def setup_telemetry(**kwargs):
+    """リングバッファの件数を設定し、エンドポイント（または console）指定時だけ OTel を有効化"""
+    from app.core import telemetry
+    telemetry.STAGES.maxlen = kwargs.get("telemetry_ring_size", 500)
+    if kwargs.get("otel_endpoint") or kwargs.get("otel_console"):
+        from app.adapters.telemetry.otel import install_otel
+        install_otel(
+            endpoint=kwargs.get("otel_endpoint", ""),
+            service_name=kwargs.get("otel_service_name", "rag-chat"),
+            console=kwargs.get("otel_console", False),
+        )
+    return telemetry.STAGES
+
+def build_llm(**kwargs):
+    # base_url はカンマ区切りで複数指定可（負荷分散・同時実行数の制御は OllamaPool）
+    urls = [u.strip() for u in kwargs.get("base_url", "http://localhost:11434").split(",") if u.strip()]
+    return OllamaPool(
+        urls,
+        max_inflight_per_backend=kwargs.get("max_inflight", 4),
+        max_waiting=kwargs.get("max_waiting", 32),
+        wait_timeout=kwargs.get("wait_timeout", 30.0),
+        health_interval=kwargs.get("health_interval", 15.0),
+        timeout=kwargs.get("read_timeout", 600),
+        connect_timeout=kwargs.get("connect_timeout", 5.0),
+        pool_size=kwargs.get("pool_size", 32),
+    )
+
+def build_retriever(embedder=None, **kwargs):
+    """埋め込み + ベクトルストア（LLM の接続先とは独立。embedder を渡せば使い回す）"""
+    store = kwargs.get("vector_store", "chroma")
+    if store == "numpy":
+        from app.adapters.rag.numpy_store import NumpyRetriever
+        cls, extra = NumpyRetriever, dict(dtype=kwargs.get("vector_dtype", "float16"))
+    elif store == "chroma":
+        cls, extra = ChromaRetriever, {}
+    else:
+        raise ValueError(f"unknown vector store: {store}")
+    return cls(
+        path=kwargs.get("chroma_path", "chroma_db"), embedder=embedder or build_embedder(**kwargs),
+        result_cache_size=kwargs.get("retrieval_cache_size", 512),
+        result_cache_ttl=kwargs.get("retrieval_cache_ttl", 600),
+        context_token_budget=kwargs.get("context_token_budget", 2048),
+        overfetch=kwargs.get("retrieval_overfetch", 2),
+        doc_top_n=kwargs.get("retrieval_doc_top_n", 0),
+        **extra,
+    )
+
 def build_stack(kind: str, **kwargs):
     if kind == "ollama":
-        llm = OllamaClient(base_url=kwargs.get("base_url", "http://localhost:11434"))
-        embed = SbertEmbedder(kwargs.get("embed_model", "intfloat/multilingual-e5-small"))
-        retriever = ChromaRetriever(path=kwargs.get("chroma_path", "chroma_db"), embedder=embed)
-        return llm, retriever
+        return build_llm(**kwargs), build_retriever(**kwargs)
     # 追って openai/claude を追加
     raise ValueError(f"unknown provider kind: {kind}")
@@ -0,0 +1,73 @@
+# app/registry/warmup.py
+# ----------------------------------------
+# 起動時の重い初期化をバックグラウンドで進める
+# - 埋め込みモデル + ベクトルストア（LLM の接続先とは独立に1回だけ）
+# - 選択中モデルの Ollama へのプリロード（任意）
+# 所要時間は [STARTUP] ログと telemetry の startup.* に残す
+# ----------------------------------------
+import time
+import threading
+from typing import Any, Callable, Optional
+
+from app.core import telemetry
+from app.registry.providers import build_embedder, build_retriever
+
+
+class BackgroundTask:
+    """fn を別スレッドで1回だけ実行し、結果（または例外）と所要時間を保持する"""
+
+    def __init__(self, name: str, fn: Callable[[], Any]):
+        self.name = name
+        self.seconds: Optional[float] = None
+        self._fn = fn
+        self._result: Any = None
+        self._error: Optional[BaseException] = None
+        self._done = threading.Event()
+        self._t0 = time.perf_counter()
+        threading.Thread(target=self._run, name=f"warmup-{name}", daemon=True).start()
+
+    def _run(self):
+        try:
+            with telemetry.span(f"startup.{self.name}"):
+                self._result = self._fn()
+        except BaseException as e:
+            self._error = e
+            print(f"[STARTUP] {self.name} failed: {type(e).__name__}: {e}")
+        finally:
+            self.seconds = time.perf_counter() - self._t0
+            self._done.set()
+            if self._error is None:
+                print(f"[STARTUP] {self.name} ready in {self.seconds:.2f}s")
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} is still loading")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def _warm_embedder(embedder):
+    # 最初のクエリで起きるカーネル初期化などを先に済ませる（クエリキャッシュには入れない）
+    encode = getattr(embedder, "_encode_query", None) or embedder.embed_query
+    encode("warmup")
+
+
+def start_retriever_warmup(**kwargs) -> BackgroundTask:
+    """build_retriever と同じ引数。埋め込みモデルのロード → 試し埋め込み → Chroma を開く"""
+    def run():
+        with telemetry.span("startup.embedder", backend=kwargs.get("embed_backend", "sbert")):
+            embedder = build_embedder(**kwargs)
+        with telemetry.span("startup.embedder_warm"):
+            _warm_embedder(embedder)
+        with telemetry.span("startup.vector_store"):
+            return build_retriever(embedder=embedder, **kwargs)
+
+    return BackgroundTask("retriever", run)
+
+
+def start_model_preload(llm, model: str, keep_alive: Optional[str] = None) -> BackgroundTask:
+    return BackgroundTask("model_preload", lambda: llm.preload(model, keep_alive))
@@ -1,14 +1,58 @@
-from typing import List, Dict, Any, Tuple, Iterable
-from app.core.types import Message, ChatChunk
+import time
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence, Tuple
+from app.core import telemetry
+from app.core.types import Message, ChatChunk, CancelToken, ChatTurn
 from app.core.ports.llm import LLMClient
 from app.core.ports.retriever import Retriever
-from app.core.prompts import build_system_prompt
+from app.core.ports.embeddings import Embedder
+from app.core.ports.answer_cache import AnswerCache
+from app.core.prompts import build_messages, fit_messages
+
+DEFAULT_NUM_CTX_BUCKETS = (2048, 4096, 8192, 16384)
+REPLAY_CHUNK_CHARS = 24  # キャッシュ命中時に流す1チャンクの文字数
 
 class ChatOrchestrator:
-    def __init__(self, llm: LLMClient, retriever: Retriever, base_system_prompt: str):
+    def __init__(
+        self,
+        llm: LLMClient,
+        retriever: Retriever,
+        base_system_prompt: str,
+        prompt_layout: str = "stable",
+        num_ctx_buckets: Sequence[int] = DEFAULT_NUM_CTX_BUCKETS,
+        answer_reserve: int = 1024,
+        answer_cache: Optional[AnswerCache] = None,
+        query_embedder: Optional[Embedder] = None,
+    ):
+        """
+        prompt_layout:
+          "stable" … system+履歴を毎ターン同一に保ち、資料は最新の user 発話に付ける（KV キャッシュ再利用）
+          "legacy" … 資料を system に埋め込む従来方式（毎ターン先頭から再評価になる）
+        num_ctx_buckets: num_ctx はこの中から選ぶ（値がばらつくと Ollama がモデルを再ロードするため）
+        answer_reserve: 回答用に空けておくトークン数（options の num_predict があればそちらを使う）
+        answer_cache: 指定すると、同じ資料・会話文脈での似た質問には生成せず保存済みの回答を返す
+        query_embedder: answer_cache の類似度判定に使う埋め込み（省略時は retriever.embedder）
+        """
         self.llm = llm
         self.retriever = retriever
         self.base_system_prompt = base_system_prompt
+        self.prompt_layout = prompt_layout
+        self.num_ctx_buckets = tuple(sorted(int(b) for b in num_ctx_buckets))
+        self.answer_reserve = answer_reserve
+        self.answer_cache = answer_cache
+        self.query_embedder = query_embedder or getattr(retriever, "embedder", None)
+
+    def build_messages(self, user_input: str, history: List[Message], context: str) -> List[Message]:
+        return build_messages(self.base_system_prompt, user_input, history, context, self.prompt_layout)
+
+    def fit_messages(
+        self, user_input: str, history: List[Message], context: str, max_num_ctx: Optional[int] = None,
+        reserve: Optional[int] = None,
+    ) -> Tuple[List[Message], int, Dict[str, int]]:
+        """app.core.prompts.fit_messages をこの設定（system・レイアウト・バケット・回答用の予約）で呼ぶ"""
+        return fit_messages(
+            self.base_system_prompt, user_input, history, context, self.num_ctx_buckets,
+            self.answer_reserve if reserve is None else reserve, max_num_ctx, self.prompt_layout,
+        )
 
     def run_stream(
         self,
@@ -17,18 +61,123 @@ class ChatOrchestrator:
         model: str,
         options: Dict[str, Any],
         top_k: int = 4,
-    ) -> Tuple[Iterable[ChatChunk], list[str]]:
-        # 1) RAG
-        context, sources = self.retriever.retrieve(user_input, top_k=top_k)
+        cancel: Optional[CancelToken] = None,
+    ) -> ChatTurn:
+        trace = telemetry.start_trace("chat.turn", model=model, top_k=top_k)
+        try:
+            return self._run(trace, user_input, history, model, options, top_k, cancel)
+        except Exception:
+            trace.finish(status="error")
+            raise
+
+    def _run(self, trace, user_input, history, model, options, top_k, cancel) -> ChatTurn:
+        with telemetry.use_trace(trace):
+            # 1) RAG
+            with trace.span("retrieve"):
+                context, sources = self.retriever.retrieve(user_input, top_k=top_k)
+
+            # 2) Prompt 合成 + 3) メッセージ（num_ctx はプロンプト長から選ぶ。options の値は上限扱い）
+            options = dict(options or {})
+            # num_predict は -1（無制限）/ -2（num_ctx まで）もあるので、正の値のときだけ回答用の予約に使う
+            num_predict = options.get("num_predict")
+            reserve = int(num_predict) if num_predict is not None and int(num_predict) > 0 else None
+            with trace.span("prompt.build"):
+                messages, num_ctx, fit = self.fit_messages(
+                    user_input, history, context, max_num_ctx=options.get("num_ctx"), reserve=reserve,
+                )
+            options["num_ctx"] = num_ctx
+            trace.root.attrs.update(num_ctx=num_ctx, prompt_tokens=fit["prompt_tokens"])
+
+            # 4) 回答キャッシュ（同じ資料・同じ会話文脈で似た質問なら生成しない）
+            cache_key = qvec = None
+            if self.answer_cache is not None and self.query_embedder is not None:
+                with trace.span("answer_cache.lookup") as sp:
+                    qvec = self.query_embedder.embed_query(user_input)
+                    cache_key = self.answer_cache.make_key(model, options, context, messages[:-1])
+                    hit = self.answer_cache.lookup(cache_key, qvec)
+                    sp.attrs["hit"] = hit is not None
+                if hit is not None:
+                    fit["answer_cache"] = {"hit": True, "similarity": round(hit.similarity, 4)}
+                    return ChatTurn(
+                        stream=self._instrument(replay_answer(hit.answer), trace, fit),
+                        sources=sources, context=context, messages=messages, meta=fit,
+                    )
+                fit["answer_cache"] = {"hit": False}
+
+        # 5) 実行（ストリームは呼び出し側が消費するので、計測は _instrument の中で続ける）
+        stream: Iterable[ChatChunk] = self.llm.chat_stream(
+            messages=messages, model=model, options=options, cancel=cancel
+        )
+        if cache_key is not None:
+            stream = self._record(stream, cache_key, user_input, qvec, sources)
+        return ChatTurn(
+            stream=self._instrument(stream, trace, fit), sources=sources, context=context,
+            messages=messages, meta=fit,
+        )
+
+    @staticmethod
+    def _instrument(stream: Iterable[ChatChunk], trace: telemetry.Trace, meta: Dict[str, Any]) -> Iterator[ChatChunk]:
+        """
+        TTFT・生成時間と、最終チャンクの usage（Ollama 側のロード/プリフィル/生成時間）を記録。
+        消費し終わるか途中で close されたら trace を閉じ、meta["usage"] / meta["timings"] を埋める。
+        """
+        t_req = time.time_ns()
+        t_first = None
+        usage = None
+        status = "ok"
+        try:
+            for chunk in stream:
+                if chunk.content and t_first is None and not chunk.error:
+                    t_first = time.time_ns()
+                    trace.record("llm.ttft", t_req, t_first)
+                    trace.record("turn.ttft", trace.root.start_ns, t_first)
+                if chunk.error:
+                    status = chunk.error
+                if chunk.usage:
+                    usage = chunk.usage
+                yield chunk
+        except GeneratorExit:
+            status = "closed"
+            raise
+        finally:
+            t_end = time.time_ns()
+            if t_first is not None:
+                trace.record("llm.generate", t_first, t_end)
+            if usage:
+                # サーバ側の内訳（ロード → プリフィル → 生成の順に並べて近似）
+                t = t_req
+                for name, key in (("ollama.load", "load_ms"), ("ollama.prefill", "prompt_eval_ms"),
+                                  ("ollama.eval", "eval_ms")):
+                    d = int(usage.get(key, 0) * 1e6)
+                    trace.record(name, t, t + d)
+                    t += d
+                meta["usage"] = usage
+            attrs = {"status": status}
+            if usage:
+                attrs.update({f"ollama.{k}": v for k, v in usage.items()})
+            trace.finish(**attrs)
+            meta["timings"] = trace.durations()
 
-        # 2) Prompt 合成
-        system = build_system_prompt(self.base_system_prompt, context)
+    def _record(self, stream: Iterable[ChatChunk], key: str, query: str, qvec, sources) -> Iterator[ChatChunk]:
+        """最後までエラーなく流れた回答だけを保存（途中 close・キャンセル・エラーは保存しない）"""
+        parts: List[str] = []
+        ok = True
+        for chunk in stream:
+            if chunk.error:
+                ok = False
+            else:
+                parts.append(chunk.content)
+            yield chunk
+        answer = "".join(parts)
+        if ok and answer.strip():
+            try:
+                self.answer_cache.put(key, query, qvec, answer, sources)
+            except Exception as e:
+                print(f"[ANSWER_CACHE] put failed: {type(e).__name__}: {e}")
 
-        # 3) メッセージ
-        messages = [Message(role="system", content=system)]
-        messages.extend(m for m in history if m.role in ("user", "assistant"))
-        messages.append(Message(role="user", content=user_input))
 
-        # 4) 実行
-        stream = self.llm.chat_stream(messages=messages, model=model, options=options)
-        return stream, sources
+def replay_answer(answer: str) -> Iterator[ChatChunk]:
+    """保存済みの回答を生成時と同じ ChatChunk 列として流す"""
+    for i in range(0, len(answer), REPLAY_CHUNK_CHARS):
+        yield ChatChunk(content=answer[i:i + REPLAY_CHUNK_CHARS])
+    yield ChatChunk(content="", done=True)
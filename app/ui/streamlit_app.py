@@ -1,8 +1,13 @@
+import time
+_T0 = time.perf_counter()
+
 import streamlit as st
 from typing import List
-from app.core.types import Message
+from app.core.types import Message, CancelToken
+from app.core.streaming import coalesce_chunks
 from app.services.chat_orchestrator import ChatOrchestrator
-from app.registry.providers import build_stack
+from app.registry.providers import build_llm, build_answer_cache, setup_telemetry
+from app.registry.warmup import start_retriever_warmup, start_model_preload
 from app.config.settings import settings
 
 st.set_page_config(page_title="Chat + RAG", page_icon="🦙", layout="centered")
@@ -15,25 +20,65 @@ if "model" not in st.session_state:
     st.session_state.model = settings.default_model
 
 def to_messages_dicts_to_Message(lst: List[dict]) -> List[Message]:
-    return [Message(role=m["role"], content=m["content"]) for m in lst]
+    return [Message(role=m["role"], content=m["content"], context=m.get("context")) for m in lst]
+
+@st.cache_resource(show_spinner=False)
+def get_stage_stats():
+    return setup_telemetry(
+        otel_endpoint=settings.otel_endpoint, otel_console=settings.otel_console,
+        otel_service_name=settings.otel_service_name, telemetry_ring_size=settings.telemetry_ring_size,
+    )
 
-def truncated_history(messages: List[dict], max_rounds: int):
-    if len(messages) <= max_rounds * 2:
-        return messages
-    return messages[-max_rounds * 2:]
+stage_stats = get_stage_stats()
+
+# 埋め込みモデル + ベクトルストアは LLM の接続先と無関係なので別にキャッシュし、
+# 最初のスクリプト実行で裏で読み込み始める（画面はすぐ出る。待つのは最初の質問のときだけ）
+@st.cache_resource(show_spinner=False)
+def get_retriever_task():
+    print(f"[STARTUP] script imports {time.perf_counter() - _T0:.2f}s")
+    return start_retriever_warmup(
+        embed_model=settings.embed_model, chroma_path=settings.chroma_path,
+        vector_store=settings.vector_store, vector_dtype=settings.vector_dtype,
+        embed_backend=settings.embed_backend, onnx_dir=settings.onnx_dir, embed_threads=settings.embed_threads,
+        embed_cache_dir=settings.embed_cache_dir, embed_cache_max_entries=settings.embed_cache_max_entries,
+        embed_token_budget=settings.embed_token_budget,
+        embed_max_batch=settings.embed_max_batch, embed_max_wait_ms=settings.embed_max_wait_ms,
+        embed_service_url=settings.embed_service_url,
+        query_cache_size=settings.query_cache_size, query_cache_ttl=settings.query_cache_ttl,
+        retrieval_cache_size=settings.retrieval_cache_size, retrieval_cache_ttl=settings.retrieval_cache_ttl,
+        context_token_budget=settings.context_token_budget, retrieval_overfetch=settings.retrieval_overfetch,
+        retrieval_doc_top_n=settings.retrieval_doc_top_n,
+    )
+
+retriever_task = get_retriever_task()
 
 # サイドバー
 with st.sidebar:
     st.header("⚙️ 設定（Ollama）")
-    base_url = st.text_input("Ollama URL", value=settings.ollama_url, help="例: http://localhost:11434")
+    base_url = st.text_input("Ollama URL", value=settings.ollama_url, help="例: http://localhost:11434（カンマ区切りで複数台）")
+
+    # LLM クライアントだけを URL ごとにキャッシュ（URL を変えても埋め込みモデルは読み直さない）
+    @st.cache_resource(show_spinner=False)
+    def get_llm(url: str):
+        return build_llm(
+            base_url=url,
+            connect_timeout=settings.ollama_connect_timeout, read_timeout=settings.ollama_read_timeout,
+            pool_size=settings.ollama_pool_size,
+            max_inflight=settings.ollama_max_inflight, max_waiting=settings.ollama_max_waiting,
+            wait_timeout=settings.ollama_wait_timeout, health_interval=settings.ollama_health_interval,
+        )
+
+    llm = get_llm(base_url)
 
-    # ProviderとRetrieverを構築（キャッシュ）
     @st.cache_resource(show_spinner=False)
-    def get_stack(url: str):
-        llm, retriever = build_stack("ollama", base_url=url, embed_model=settings.embed_model, chroma_path=settings.chroma_path)
-        return llm, retriever
+    def get_answer_cache():
+        return build_answer_cache(
+            answer_cache_path=settings.answer_cache_path, chroma_path=settings.chroma_path,
+            answer_cache_max_entries=settings.answer_cache_max_entries,
+            answer_cache_ttl=settings.answer_cache_ttl, answer_cache_threshold=settings.answer_cache_threshold,
+        )
 
-    llm, retriever = get_stack(base_url)
+    answer_cache = get_answer_cache()
 
     try:
         models = llm.list_models()
@@ -49,8 +94,19 @@ with st.sidebar:
 
     st.session_state.model = model
 
+    # 選択中のモデルを Ollama に先読みさせる（URL × モデルごとに1回）
+    @st.cache_resource(show_spinner=False)
+    def preload_model(url: str, name: str):
+        return start_model_preload(llm, name, settings.keep_alive)
+
+    if settings.ollama_warmup and model:
+        preload_model(base_url, model)
+
     temperature = st.slider("温度 (創造性)", 0.0, 1.0, settings.temperature, 0.1)
-    num_ctx = st.number_input("コンテキスト長 (num_ctx)", 2048, 32768, settings.num_ctx, 1024)
+    num_ctx = st.number_input(
+        "コンテキスト長の上限 (num_ctx)", 2048, 32768, settings.num_ctx, 1024,
+        help="実際の num_ctx はプロンプト長に応じて上限以下のバケットから選びます。収まらない古い履歴は送りません",
+    )
 
     system_prompt = st.text_area(
         "システムプロンプト",
@@ -61,8 +117,6 @@ with st.sidebar:
         height=140,
     )
 
-    max_history = st.number_input("履歴上限（往復数）", 2, 50, 10, 1)
-
     col1, col2 = st.columns(2)
     with col1:
         if st.button("🧹 履歴クリア"):
@@ -71,36 +125,97 @@ with st.sidebar:
     with col2:
         st.caption("Docker→ネイティブOllama: http://host.docker.internal:11434")
 
+    with st.expander("📊 キャッシュ統計"):
+        if retriever_task.done():
+            st.json(retriever_task.result().cache_stats())
+        else:
+            st.caption("埋め込みモデルを読み込み中…")
+        if answer_cache is not None:
+            st.json({"answer": answer_cache.stats()})
+    with st.expander("🦙 Ollama バックエンド"):
+        st.json(llm.stats())
+    with st.expander("⏱️ 段階別レイテンシ（直近）"):
+        rows = stage_stats.summary()
+        if rows:
+            st.table(rows)
+        else:
+            st.caption("まだ計測がありません")
+
 # 既存履歴の描画
 for m in st.session_state.messages:
     with st.chat_message(m["role"]):
         st.markdown(m["content"])
-
-# オーケストレータ（毎回再生成でも軽い）
-orch = ChatOrchestrator(llm=llm, retriever=retriever, base_system_prompt=system_prompt)
+        if m.get("cached"):
+            st.caption("⚡ キャッシュ済みの回答")
 
 # 入力受付
 if user_input := st.chat_input("メッセージを入力…"):
     user_input = user_input.strip()
 
+    # 裏で読み込み中なら、ここで初めて待つ
+    if not retriever_task.done():
+        with st.spinner("埋め込みモデルを読み込み中…"):
+            retriever_task.result()
+    retriever = retriever_task.result()
+
+    # オーケストレータ（毎回再生成でも軽い）
+    orch = ChatOrchestrator(
+        llm=llm, retriever=retriever, base_system_prompt=system_prompt, prompt_layout=settings.prompt_layout,
+        num_ctx_buckets=[int(b) for b in settings.num_ctx_buckets.split(",") if b.strip()],
+        answer_reserve=settings.answer_reserve_tokens,
+        answer_cache=answer_cache,
+    )
+
+    # 前のターンの生成がまだ走っていれば止める（GPU を空ける）
+    prev = st.session_state.get("cancel_token")
+    if prev is not None:
+        prev.cancel()
+    cancel = st.session_state.cancel_token = CancelToken()
+
     st.session_state.messages.append({"role": "user", "content": user_input})
-    st.session_state.messages = truncated_history(st.session_state.messages, max_history)
 
     with st.chat_message("user"):
         st.markdown(user_input)
 
     with st.chat_message("assistant"):
-        stream, sources = orch.run_stream(
+        # 履歴は今回の発話を除いたもの（今回分はオーケストレータが資料付きで末尾に足す）
+        turn = orch.run_stream(
             user_input=user_input,
-            history=to_messages_dicts_to_Message([m for m in st.session_state.messages if m["role"] in ("user","assistant")]),
+            history=to_messages_dicts_to_Message([m for m in st.session_state.messages[:-1] if m["role"] in ("user","assistant")]),
             model=st.session_state.model,
-            options={"temperature": float(temperature), "num_ctx": int(num_ctx)},
+            options={"temperature": float(temperature), "num_ctx": int(num_ctx), "keep_alive": settings.keep_alive},
             top_k=4,
+            cancel=cancel,
         )
-        # Streamlit の write_stream はテキストイテレータを受け取る
-        reply = st.write_stream((chunk.content for chunk in stream))
-
-    st.session_state.messages.append({"role": "assistant", "content": reply})
+        stream, sources = turn
+        # 次ターン以降も同じ文字列でプロンプトを再構成できるよう資料を保存
+        st.session_state.messages[-1]["context"] = turn.context
+        # Streamlit の write_stream はテキストイテレータを受け取る（yield ごとに全文を送り直すので
+        # トークンを STREAM_FLUSH_MS ごとのフレームにまとめて渡す）
+        # rerun・離脱でスクリプトが止められたら finally で接続を切る
+        frames = coalesce_chunks(stream, settings.stream_flush_ms, settings.stream_flush_chars)
+        try:
+            reply = st.write_stream((chunk.content for chunk in frames))
+        finally:
+            cancel.cancel()
+
+    cached = turn.meta.get("answer_cache", {}).get("hit", False)
+    st.session_state.messages.append({"role": "assistant", "content": reply, "cached": cached})
 
     if sources:
         st.caption("出典: " + " | ".join(sources))
+    fit = turn.meta
+    if cached:
+        st.caption(f"⚡ キャッシュ済みの回答（質問の類似度 {fit['answer_cache']['similarity']:.3f}）")
+    st.caption(
+        f"num_ctx={fit['num_ctx']} / プロンプト≈{fit['prompt_tokens']}トークン"
+        + (f" / 古い履歴 {fit['history_dropped']} 件は送信せず" if fit["history_dropped"] else "")
+    )
+    usage, timings = fit.get("usage"), fit.get("timings", {})
+    if usage:
+        tps = usage["eval_count"] / (usage["eval_ms"] / 1000) if usage["eval_ms"] else 0.0
+        st.caption(
+            f"検索 {timings.get('retrieve', 0):.0f}ms / TTFT {timings.get('turn.ttft', 0):.0f}ms"
+            f"（ロード {usage['load_ms']:.0f}ms・プリフィル {usage['prompt_eval_count']}tok {usage['prompt_eval_ms']:.0f}ms）"
+            f" / 生成 {usage['eval_count']}tok {tps:.1f}tok/s"
+        )
@@ -0,0 +1,169 @@
+# bench/corpus.py
+# ----------------------------------------
+# ベンチ用の合成コーパス（日本語/英語混在の txt / md / pdf）
+# - seed 固定で毎回同じ内容を生成（コミット間で比較できるように）
+# - PDF は外部ライブラリなしで書き出す（Identity-H + ToUnicode なので pypdf で日本語も抽出できる）
+# ----------------------------------------
+import os
+import random
+import argparse
+from typing import Dict, List
+
+JA_TOPICS = ["S3", "EC2", "Lambda", "IAM", "VPC", "CloudWatch", "RDS", "DynamoDB", "Streamlit", "Ollama"]
+JA_SENTENCES = [
+    "{t} の設定は管理画面またはコマンドラインから変更できます。",
+    "{t} を利用する際は、権限とコストの両方を事前に確認してください。",
+    "障害発生時には {t} のログを確認し、直近の変更点を洗い出します。",
+    "{t} のベストプラクティスとして、最小権限の原則を守ることが推奨されています。",
+    "本番環境で {t} を使う場合は、監視とアラートの設定を必ず行います。",
+    "{t} の料金は使用量に応じて課金されるため、定期的に見直しが必要です。",
+    "新しいメンバーには {t} の基本操作から順に説明すると理解が早まります。",
+    "{t} とほかのサービスを組み合わせることで、運用の自動化が進みます。",
+]
+EN_SENTENCES = [
+    "The {t} configuration can be changed from the console or the CLI.",
+    "Review permissions and cost before enabling {t} in production.",
+    "When an incident occurs, check the {t} logs and list recent changes.",
+    "Following least privilege is the recommended practice for {t}.",
+    "Always configure monitoring and alerts for {t} workloads.",
+    "{t} is billed by usage, so revisit the settings regularly.",
+]
+
+
+def paragraph(rng: random.Random, ja_ratio: float, n_sentences: int) -> str:
+    out = []
+    for _ in range(n_sentences):
+        t = rng.choice(JA_TOPICS)
+        pool = JA_SENTENCES if rng.random() < ja_ratio else EN_SENTENCES
+        out.append(rng.choice(pool).format(t=t))
+    sep = "" if ja_ratio >= 0.5 else " "
+    return sep.join(out)
+
+
+def write_txt(path: str, paras: List[str]):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(paras))
+
+
+def write_md(path: str, paras: List[str], rng: random.Random, idx: int):
+    lines = [f"# ドキュメント {idx}", "", f"日付: 2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}", ""]
+    for i, p in enumerate(paras, 1):
+        if i % 3 == 1:
+            lines += [f"## セクション {(i + 2) // 3}", ""]
+        lines += [p, ""]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def _pdf_text(s: str) -> str:
+    # Identity-H: 1文字 = 2バイトの CID（ここでは Unicode の BMP コードポイントをそのまま使う）
+    return "<" + "".join(f"{ord(c):04X}" for c in s if ord(c) <= 0xFFFF) + ">"
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """1ページ = 行のリスト。表示用ではなくテキスト抽出のベンチ用（フォントは埋め込まない）"""
+    cmap = (
+        "/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+        "/CMapName /Bench-UCS def /CMapType 2 def\n"
+        "1 begincodespacerange <0000> <FFFF> endcodespacerange\n"
+        "1 beginbfrange <0000> <FFFF> <0000> endbfrange\n"
+        "endcmap CMapName currentdict /CMap defineresource pop end end\n"
+    ).encode("ascii")
+    objs: List[bytes] = []  # objs[i] は obj 番号 i+1
+
+    def add(body: bytes) -> int:
+        objs.append(body)
+        return len(objs)
+
+    def stream(data: bytes) -> bytes:
+        return b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+
+    catalog = add(b"")  # 後で埋める
+    pages_id = add(b"")
+    tounicode = add(stream(cmap))
+    cidfont = add(
+        b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /BenchFont "
+        b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> /DW 1000 >>"
+    )
+    font = add(
+        b"<< /Type /Font /Subtype /Type0 /BaseFont /BenchFont /Encoding /Identity-H "
+        b"/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>" % (cidfont, tounicode)
+    )
+    kids = []
+    for lines in pages:
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        for ln in lines:
+            ops.append(f"{_pdf_text(ln)} Tj T*")
+        ops.append("ET")
+        content = add(stream("\n".join(ops).encode("ascii")))
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, content)
+        ))
+    objs[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    objs[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, catalog, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
+def generate_corpus(
+    root: str,
+    n_files: int = 100,
+    kinds=("txt", "md", "pdf"),
+    paragraphs: int = 12,
+    sentences: int = 8,
+    ja_ratio: float = 0.8,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """root 以下に n_files 個のファイルを作る。戻り値は種類ごとの件数と総バイト数"""
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    counts: Dict[str, int] = {k: 0 for k in kinds}
+    total_bytes = 0
+    for i in range(n_files):
+        kind = kinds[i % len(kinds)]
+        paras = [paragraph(rng, ja_ratio, sentences) for _ in range(paragraphs)]
+        path = os.path.join(root, f"doc_{i:05d}.{kind}")
+        if kind == "txt":
+            write_txt(path, paras)
+        elif kind == "md":
+            write_md(path, paras, rng, i)
+        else:
+            # 1段落を 40 文字ごとの行に折り返し、4段落で1ページ
+            lines = [p[j:j + 40] for p in paras for j in range(0, len(p), 40)]
+            per_page = max(1, len(lines) // max(1, paragraphs // 4))
+            write_pdf(path, [lines[j:j + per_page] for j in range(0, len(lines), per_page)])
+        counts[kind] += 1
+        total_bytes += os.path.getsize(path)
+    counts["bytes"] = total_bytes
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ベンチ用の合成コーパスを生成")
+    ap.add_argument("root")
+    ap.add_argument("--files", type=int, default=100)
+    ap.add_argument("--kinds", default="txt,md,pdf")
+    ap.add_argument("--paragraphs", type=int, default=12)
+    ap.add_argument("--ja-ratio", type=float, default=0.8)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    print(generate_corpus(args.root, args.files, tuple(args.kinds.split(",")), args.paragraphs,
+                          ja_ratio=args.ja_ratio, seed=args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# bench/eval_retrieval.py
+# ----------------------------------------
+# ラベル付きクエリで検索の品質とレイテンシを測る（チャンク分割・ストア設定の調整用）
+# - 入力: JSONL。1行 {"query": "...", "relevant": ["docs/aws.md", "docs/aws.md#3", "<chunk id>", ...]}
+#     出典のパス（docs/ からの相対でも可）/ 出典#chunk_index / チャンク id のどれかに当たれば正解
+# - 品質: recall@k（正解ラベルのうち top k に現れた割合の平均）と MRR（最初の正解の順位の逆数の平均）
+# - レイテンシ: 1件ずつの retrieve_many（クエリごとの分位）と、--batch-size 件まとめた場合の1件あたり
+# 検索器は Settings（VECTOR_STORE / CHROMA_PATH / EMBED_* …）から組み立てるので、環境変数で設定を切り替えて比べる。
+#   python -m bench.eval_retrieval --queries eval/queries.jsonl
+#   VECTOR_STORE=numpy python -m bench.eval_retrieval --queries eval/queries.jsonl --k 1,5,10 --out eval/numpy.json
+# ----------------------------------------
+import os
+import json
+import time
+import argparse
+from typing import Any, Dict, List, Optional, Sequence
+
+from bench.run import git_commit, percentiles
+
+
+def load_queries(path: str) -> List[Dict[str, Any]]:
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line)
+            if not item.get("query") or not item.get("relevant"):
+                raise SystemExit(f"{path}:{n}: query と relevant（1件以上）が必要です")
+            if isinstance(item["relevant"], str):
+                item["relevant"] = [item["relevant"]]
+            items.append(item)
+    return items
+
+
+def _same_source(label: str, source: str) -> bool:
+    if not label:
+        return False
+    if os.path.abspath(label) == source:
+        return True
+    return source.replace(os.sep, "/").endswith("/" + label.replace(os.sep, "/").lstrip("./"))
+
+
+def matches(label: str, hit) -> bool:
+    """ラベル1つがヒットに当たるか（チャンク id / 出典#chunk_index / 出典のパス）"""
+    if hit.id and label == hit.id:
+        return True
+    src, sep, idx = label.rpartition("#")
+    if sep and idx.isdigit():
+        return hit.chunk_index == int(idx) and _same_source(src, hit.source)
+    return _same_source(label, hit.source)
+
+
+def score_query(labels: Sequence[str], hits: list, ks: Sequence[int]) -> Dict[str, Any]:
+    first: Optional[int] = None
+    found_at: Dict[str, int] = {}  # ラベル → 最初に当たった順位
+    for rank, hit in enumerate(hits, 1):
+        hit_any = False
+        for label in labels:
+            if matches(label, hit):
+                hit_any = True
+                found_at.setdefault(label, rank)
+        if hit_any and first is None:
+            first = rank
+    out: Dict[str, Any] = {"rank": first, "rr": 1.0 / first if first else 0.0}
+    for k in ks:
+        out[f"recall@{k}"] = sum(1 for r in found_at.values() if r <= k) / len(labels)
+    return out
+
+
+def evaluate(retriever, items: List[Dict[str, Any]], ks: Sequence[int], batch_size: int, where=None) -> Dict[str, Any]:
+    top_k = max(ks)
+    queries = [it["query"] for it in items]
+    retriever.retrieve_many(queries[:2], top_k=top_k, where=where)  # ウォームアップ（モデル/ストアの初回コスト）
+
+    # 1) 1件ずつ：クエリごとのレイテンシと品質
+    per_query = []
+    for it in items:
+        t0 = time.perf_counter()
+        hits = retriever.retrieve_many([it["query"]], top_k=top_k, where=where)[0]
+        ms = (time.perf_counter() - t0) * 1000
+        rec = {"query": it["query"], "latency_ms": round(ms, 3), **score_query(it["relevant"], hits, ks)}
+        rec["top"] = [h.id or f"{h.source}#{h.chunk_index}" for h in hits[:3]]
+        per_query.append(rec)
+
+    # 2) まとめて：1回の埋め込み + 1回のストア検索
+    batch_ms = []
+    for s in range(0, len(queries), batch_size):
+        t0 = time.perf_counter()
+        retriever.retrieve_many(queries[s:s + batch_size], top_k=top_k, where=where)
+        batch_ms.append((time.perf_counter() - t0) * 1000)
+
+    n = len(per_query)
+    summary: Dict[str, Any] = {"queries": n, "mrr": round(sum(r["rr"] for r in per_query) / n, 4)}
+    for k in ks:
+        summary[f"recall@{k}"] = round(sum(r[f"recall@{k}"] for r in per_query) / n, 4)
+    summary["latency_ms"] = percentiles([r["latency_ms"] for r in per_query])
+    summary["batch"] = {
+        "batch_size": batch_size,
+        "batches": len(batch_ms),
+        "ms_per_query": round(sum(batch_ms) / n, 3),
+        "batch_latency_ms": percentiles(batch_ms),
+    }
+    return {"summary": summary, "per_query": per_query}
+
+
+def parse_args(argv=None):
+    from app.config.settings import settings
+
+    ap = argparse.ArgumentParser(description="ラベル付きクエリで recall@k / MRR / レイテンシを測る")
+    ap.add_argument("--queries", required=True, help='JSONL（1行 {"query": ..., "relevant": [...]}）')
+    ap.add_argument("--k", default="1,3,5,10", help="recall@k の k（カンマ区切り。最大値が top_k）")
+    ap.add_argument("--batch-size", type=int, default=32, help="まとめて検索するときの件数")
+    ap.add_argument("--chroma-path", default=settings.chroma_path)
+    ap.add_argument("--store", default=settings.vector_store, choices=["chroma", "numpy"])
+    ap.add_argument("--vector-dtype", default=settings.vector_dtype, choices=["float16", "int8"])
+    ap.add_argument("--doc-top-n", type=int, default=settings.retrieval_doc_top_n,
+                    help="二段検索で残す出典数（0で全チャンクを検索）")
+    ap.add_argument("--embed-backend", default=settings.embed_backend, choices=["sbert", "onnx", "onnx-int8"])
+    ap.add_argument("--where", default="", help='メタデータの絞り込み（JSON。例: {"source": "..."}）')
+    ap.add_argument("--out", default="", help="結果 JSON の保存先（クエリごとの順位・レイテンシを含む）")
+    ap.add_argument("--show", type=int, default=10, help="正解が top_k に無かったクエリを何件表示するか")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from app.config.settings import settings
+    from app.registry.providers import build_retriever
+
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    items = load_queries(args.queries)
+    if not items:
+        raise SystemExit(f"クエリがありません: {args.queries}")
+    # クエリキャッシュ・マイクロバッチの待ちはレイテンシを歪めるので切る
+    retriever = build_retriever(
+        chroma_path=args.chroma_path, vector_store=args.store, vector_dtype=args.vector_dtype,
+        embed_model=settings.embed_model, embed_backend=args.embed_backend, onnx_dir=settings.onnx_dir,
+        embed_threads=settings.embed_threads, embed_cache_dir="", embed_service_url=settings.embed_service_url,
+        query_cache_size=0, embed_max_wait_ms=0, retrieval_cache_size=0, retrieval_doc_top_n=args.doc_top_n,
+    )
+    where = json.loads(args.where) if args.where else None
+    res = evaluate(retriever, items, ks, max(1, args.batch_size), where=where)
+
+    s = res["summary"]
+    print(f"[EVAL] {s['queries']} queries store={args.store} doc_top_n={args.doc_top_n} path={args.chroma_path}")
+    print("[EVAL] " + " ".join(f"recall@{k}={s[f'recall@{k}']:.3f}" for k in ks) + f" MRR={s['mrr']:.3f}")
+    lat = s["latency_ms"]
+    print(f"[EVAL] latency/query p50={lat['p50']}ms p95={lat['p95']}ms max={lat['max']}ms")
+    print(f"[EVAL] batched x{args.batch_size}: {s['batch']['ms_per_query']}ms/query")
+    misses = [r for r in res["per_query"] if r["rank"] is None]
+    for r in misses[:args.show]:
+        print(f"[MISS] {r['query']} → {r['top']}")
+
+    if args.out:
+        res["meta"] = {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "queries_file": args.queries,
+            "args": vars(args),
+            "embed_model": settings.embed_model,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        print(f"[EVAL] saved {args.out}")
+    return res
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# bench/fake_ollama.py
+# ----------------------------------------
+# Ollama 互換のスタブサーバ（/api/tags と /api/chat の NDJSON ストリーミング）
+# - プロンプト評価: prompt_tps トークン/秒（直前のリクエストと一致する先頭部分は KV キャッシュ扱いで評価しない）
+# - 生成: gen_tps トークン/秒で num_predict（既定 64）トークン
+# - 最終レコードに本物と同じ prompt_eval_count / eval_count / *_duration(ns) を入れる
+#   python -m bench.fake_ollama --port 11435
+# ----------------------------------------
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+
+from app.core.tokens import estimate_tokens
+
+TOKENS = [
+    "はい", "、", "ご", "質問", "の", "件", "について", "説明", "します", "。",
+    "資料", "[1]", "によると", "設定", "は", "管理", "画面", "から", "変更", "できます",
+    " The", " setting", " can", " be", " changed", ".", "\n", "- ", "ポイント", "です",
+]
+
+
+class FakeOllama:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        models: Optional[List[str]] = None,
+        prompt_tps: float = 2000.0,
+        gen_tps: float = 50.0,
+        load_ms: float = 0.0,
+        seed: int = 0,
+    ):
+        self.models = models or ["bench:latest"]
+        self.prompt_tps = prompt_tps
+        self.gen_tps = gen_tps
+        self.load_ms = load_ms
+        self.seed = seed
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._last_prompt: Dict[str, str] = {}  # model -> 直前のプロンプト（KV キャッシュの模擬）
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -------- 応答の組み立て --------
+    def _prefill(self, model: str, messages: List[dict]) -> Tuple[int, int]:
+        """(評価したトークン数, 全体のトークン数)"""
+        prompt = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in messages)
+        with self._lock:
+            self.requests += 1
+            last = self._last_prompt.get(model, "")
+            self._last_prompt[model] = prompt
+        n = 0
+        for a, b in zip(last, prompt):
+            if a != b:
+                break
+            n += 1
+        total = estimate_tokens(prompt)
+        return max(1, total - estimate_tokens(prompt[:n])), total
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, obj, status=200):
+                body = orjson.dumps(obj)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, obj):
+                line = orjson.dumps(obj) + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/api/tags":
+                    self._send_json({"models": [{"name": m} for m in fake.models]})
+                else:
+                    self._send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/api/chat":
+                    self._send_json({"error": "not found"}, 404)
+                    return
+                req = orjson.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                model = req.get("model", "")
+                if model not in fake.models:
+                    self._send_json({"error": f"model '{model}' not found"}, 404)
+                    return
+                options = req.get("options") or {}
+                n_predict = int(options.get("num_predict") or 64)
+                if n_predict < 0:
+                    n_predict = 64
+                t_start = time.perf_counter()
+                if fake.load_ms:
+                    time.sleep(fake.load_ms / 1000)
+                if not req.get("messages"):
+                    # 本物と同じく、空の messages はモデルの読み込みだけ
+                    self._send_json({"model": model, "message": {"role": "assistant", "content": ""},
+                                     "done": True, "done_reason": "load"})
+                    return
+                evaluated, _ = fake._prefill(model, req.get("messages") or [])
+                prefill = evaluated / fake.prompt_tps
+                time.sleep(prefill)
+                rng = random.Random(fake.seed + fake.requests)
+                tokens = [rng.choice(TOKENS) for _ in range(n_predict)]
+
+                stream = req.get("stream", True)
+                t_gen = time.perf_counter()
+                try:
+                    if stream:
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/x-ndjson")
+                        self.send_header("Transfer-Encoding", "chunked")
+                        self.end_headers()
+                    for i, tok in enumerate(tokens):
+                        # 各トークンの予定時刻まで待つ（処理時間のぶれを吸収）
+                        delay = t_gen + (i + 1) / fake.gen_tps - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        if stream:
+                            self._write_chunk({"model": model, "message": {"role": "assistant", "content": tok},
+                                               "done": False})
+                    t_end = time.perf_counter()
+                    final = {
+                        "model": model,
+                        "message": {"role": "assistant", "content": "" if stream else "".join(tokens)},
+                        "done": True,
+                        "done_reason": "stop",
+                        "total_duration": int((t_end - t_start) * 1e9),
+                        "load_duration": int(fake.load_ms * 1e6),
+                        "prompt_eval_count": evaluated,
+                        "prompt_eval_duration": int(prefill * 1e9),
+                        "eval_count": len(tokens),
+                        "eval_duration": int((t_end - t_gen) * 1e9),
+                    }
+                    if stream:
+                        self._write_chunk(final)
+                        self.wfile.write(b"0\r\n\r\n")
+                        self.wfile.flush()
+                    else:
+                        self._send_json(final)
+                except (BrokenPipeError, ConnectionResetError):
+                    # クライアントが切断（キャンセル）→ 生成を打ち切る
+                    self.close_connection = True
+
+        return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ollama 互換のスタブサーバ")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--models", default="bench:latest", help="カンマ区切り")
+    ap.add_argument("--prompt-tps", type=float, default=2000.0)
+    ap.add_argument("--gen-tps", type=float, default=50.0)
+    ap.add_argument("--load-ms", type=float, default=0.0)
+    args = ap.parse_args()
+    fake = FakeOllama(args.host, args.port, args.models.split(","), args.prompt_tps, args.gen_tps, args.load_ms)
+    print(f"[FAKE] listening on {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
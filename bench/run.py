@@ -0,0 +1,324 @@
+# bench/run.py
+# ----------------------------------------
+# オフライン・CPU のみで回すベンチマーク
+#   1) 合成コーパス生成（txt/md/pdf、日本語/英語混在）
+#   2) ingest.main() のスループット（初回フル / 変更なし再実行）と最大 RSS
+#   3) ChromaRetriever.retrieve のレイテンシ分位（キャッシュ無効 / 有効）
+#   4) ChatOrchestrator.run_stream の TTFT と tokens/s（ローカルのスタブ Ollama 相手）
+#   5) 同時クエリ埋め込みの CPU 時間とレイテンシ（1件ずつ / マイクロバッチ）
+# 結果は JSON で保存し、コミット間で比較する。
+#   python -m bench.run                          # 既定（200ファイル）
+#   python -m bench.run --files 1000 --stages ingest
+#   python -m bench.run --out bench/results/base.json
+# 埋め込みモデルは事前にローカルキャッシュへ落としておくこと（HF_HUB_OFFLINE=1 で実行する）
+# ----------------------------------------
+import os
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import contextlib
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from bench.corpus import generate_corpus, JA_TOPICS
+from bench.fake_ollama import FakeOllama
+
+STAGES = ("ingest", "retrieve", "e2e", "embed")
+MODEL_NAME = "intfloat/multilingual-e5-small"
+BASE_SYSTEM = "あなたは日本語で丁寧かつわかりやすく回答するアシスタントです。"
+QUERY_TEMPLATES = [
+    "{t} の設定はどこで変更できますか？",
+    "{t} を本番で使うときの注意点は？",
+    "{t} の料金の考え方を教えてください。",
+    "How do I monitor {t}?",
+    "{t} で障害が起きたら最初に何を確認しますか？",
+]
+
+
+def percentiles(xs: List[float]) -> Dict[str, float]:
+    if not xs:
+        return {"n": 0}
+    s = sorted(xs)
+
+    def q(p):
+        return s[min(len(s) - 1, max(0, int(round(p * len(s) + 0.5)) - 1))]
+
+    return {
+        "n": len(s),
+        "mean": round(sum(s) / len(s), 3),
+        "p50": round(q(0.50), 3),
+        "p95": round(q(0.95), 3),
+        "p99": round(q(0.99), 3),
+        "max": round(s[-1], 3),
+    }
+
+
+def make_queries(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [rng.choice(QUERY_TEMPLATES).format(t=rng.choice(JA_TOPICS)) for _ in range(n)]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+# -------- 2) インジェスト（子プロセスで実行して RSS を分離） --------
+def _ingest_child(workdir: str, argv: List[str], verbose: bool, q):
+    import ingest
+    from app.ingest.manifest import manifest_path
+
+    ingest.CHROMA_DIR = os.path.join(workdir, "chroma_db")
+    ingest.MANIFEST_PATH = manifest_path(ingest.CHROMA_DIR)
+    ingest.DOCS_DIRS = [os.path.join(workdir, "docs")]
+    ingest.EMBED_CACHE_DIR = os.path.join(workdir, "embed_cache")
+    out = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    t0 = time.perf_counter()
+    with out:
+        summary = ingest.main(argv) or {}
+    dt = time.perf_counter() - t0
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024  # パース用ワーカー
+    q.put({"seconds": dt, "summary": summary, "peak_rss_mb": self_rss, "peak_rss_workers_mb": child_rss})
+
+
+def bench_ingest(workdir: str, argv: List[str], n_bytes: int, verbose: bool) -> Dict[str, Any]:
+    ctx = mp.get_context("spawn")  # 親で読み込んだモジュールの分を RSS に含めない
+    q = ctx.Queue()
+    p = ctx.Process(target=_ingest_child, args=(workdir, argv, verbose, q))
+    p.start()
+    res = q.get()
+    p.join()
+    dt, s = res["seconds"], res["summary"]
+    return {
+        "argv": argv,
+        "seconds": round(dt, 3),
+        "files": s.get("files", 0),
+        "changed": s.get("changed", 0),
+        "chunks": s.get("added", 0),
+        "files_per_sec": round(s.get("files", 0) / dt, 2) if dt else 0.0,
+        "chunks_per_sec": round(s.get("added", 0) / dt, 2) if dt else 0.0,
+        "mb_per_sec": round(n_bytes / 1e6 / dt, 3) if dt else 0.0,
+        "peak_rss_mb": round(res["peak_rss_mb"], 1),
+        "peak_rss_workers_mb": round(res["peak_rss_workers_mb"], 1),
+        "stages_s": (s.get("metrics") or {}).get("stages_s", {}),
+    }
+
+
+# -------- 3) 検索 --------
+def build_retriever(workdir: str, args, cached: bool):
+    from app.registry.providers import build_embedder, build_retriever as build
+
+    embedder = build_embedder(
+        embed_model=MODEL_NAME, embed_backend=args.embed_backend,
+        query_cache_size=1024 if cached else 0,
+    )
+    return build(
+        embedder=embedder, chroma_path=os.path.join(workdir, "chroma_db"),
+        vector_store=args.store, vector_dtype=args.vector_dtype,
+        retrieval_cache_size=512 if cached else 0,
+    )
+
+
+def bench_retrieve(retriever, queries: List[str], top_k: int) -> Dict[str, Any]:
+    for q in queries[:3]:  # ウォームアップ
+        retriever.retrieve(q, top_k=top_k)
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        retriever.retrieve(q, top_k=top_k)
+        lat.append((time.perf_counter() - t0) * 1000)
+    return {"top_k": top_k, "latency_ms": percentiles(lat)}
+
+
+# -------- 4) エンドツーエンド --------
+def bench_e2e(retriever, queries: List[str], args) -> Dict[str, Any]:
+    from app.adapters.providers.ollama_pool import OllamaPool
+    from app.services.chat_orchestrator import ChatOrchestrator
+
+    with FakeOllama(prompt_tps=args.prompt_tps, gen_tps=args.gen_tps) as fake:
+        llm = OllamaPool([fake.url], max_inflight_per_backend=args.concurrency, health_interval=0)
+        orch = ChatOrchestrator(llm=llm, retriever=retriever, base_system_prompt=BASE_SYSTEM)
+        model = fake.models[0]
+        options = {"temperature": 0.2, "num_ctx": 8192, "num_predict": args.num_predict}
+
+        def one(q: str) -> Dict[str, float]:
+            t0 = time.perf_counter()
+            turn = orch.run_stream(q, [], model, options, top_k=4)
+            t_ready = time.perf_counter()
+            t_first = t_last = None
+            n = 0
+            for chunk in turn.stream:
+                if chunk.content and not chunk.error:
+                    t_last = time.perf_counter()
+                    t_first = t_first or t_last
+                    n += 1
+            tps = (n - 1) / (t_last - t_first) if n > 1 and t_last > t_first else 0.0
+            return {
+                "prepare_ms": (t_ready - t0) * 1000,
+                "ttft_ms": ((t_first or time.perf_counter()) - t0) * 1000,
+                "total_ms": (time.perf_counter() - t0) * 1000,
+                "tokens": n,
+                "tokens_per_sec": tps,
+            }
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+            rows = list(ex.map(one, queries))
+        wall = time.perf_counter() - t0
+        llm.close()
+    return {
+        "concurrency": args.concurrency,
+        "requests": len(rows),
+        "fake_prompt_tps": args.prompt_tps,
+        "fake_gen_tps": args.gen_tps,
+        "prepare_ms": percentiles([r["prepare_ms"] for r in rows]),
+        "ttft_ms": percentiles([r["ttft_ms"] for r in rows]),
+        "total_ms": percentiles([r["total_ms"] for r in rows]),
+        "tokens_per_sec": percentiles([r["tokens_per_sec"] for r in rows]),
+        "requests_per_sec": round(len(rows) / wall, 3) if wall else 0.0,
+    }
+
+
+# -------- 5) 同時クエリの埋め込み --------
+def bench_embed(queries: List[str], args) -> Dict[str, Any]:
+    from app.registry.providers import build_embedder
+    from app.adapters.embeddings.micro_batch import BatchingEmbedder
+
+    inner = build_embedder(embed_model=MODEL_NAME, embed_backend=args.embed_backend, query_cache_size=0)
+    inner._encode_query("warmup")
+    out: Dict[str, Any] = {"concurrency": args.concurrency}
+    for name, wait_ms in (("single", 0.0), ("micro_batch", args.embed_max_wait_ms)):
+        emb = BatchingEmbedder(inner, max_batch=64, max_wait_ms=wait_ms) if wait_ms > 0 else inner
+
+        def one(q: str) -> float:
+            t0 = time.perf_counter()
+            emb.embed_query(q)
+            return (time.perf_counter() - t0) * 1000
+
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as ex:
+            lat = list(ex.map(one, [f"{q} #{i}" for i, q in enumerate(queries)]))
+        cpu, wall = time.process_time() - cpu0, time.perf_counter() - t0
+        out[name] = {
+            "latency_ms": percentiles(lat),
+            "cpu_ms_per_query": round(cpu * 1000 / len(queries), 2),
+            "queries_per_sec": round(len(queries) / wall, 1),
+        }
+        if emb is not inner:
+            out[name]["batches"] = emb.batcher.stats()
+            emb.close()
+    return out
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="オフラインベンチマーク")
+    ap.add_argument("--workdir", default=os.path.join("bench", ".work"), help="コーパス・DB の作業ディレクトリ")
+    ap.add_argument("--out", default="", help="結果 JSON（既定: bench/results/<時刻>_<commit>.json）")
+    ap.add_argument("--stages", default=",".join(STAGES), help="ingest,retrieve,e2e,embed から選択")
+    ap.add_argument("--files", type=int, default=200)
+    ap.add_argument("--paragraphs", type=int, default=12)
+    ap.add_argument("--ja-ratio", type=float, default=0.8)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    ap.add_argument("--embed-backend", default="sbert", choices=["sbert", "onnx", "onnx-int8"])
+    ap.add_argument("--store", default="chroma", choices=["chroma", "numpy"], help="ベクトルストア")
+    ap.add_argument("--vector-dtype", default="float16", choices=["float16", "int8"], help="--store numpy の保存形式")
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--top-k", type=int, default=4)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--prompt-tps", type=float, default=2000.0, help="スタブの prompt 評価速度")
+    ap.add_argument("--gen-tps", type=float, default=50.0, help="スタブの生成速度")
+    ap.add_argument("--num-predict", type=int, default=64)
+    ap.add_argument("--embed-max-wait-ms", type=float, default=5.0, help="embed ステージのマイクロバッチ待ち時間")
+    ap.add_argument("--keep", action="store_true", help="作業ディレクトリを再利用（コーパス再生成・フル再登録をしない）")
+    ap.add_argument("--verbose", action="store_true", help="ingest のログを表示")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"unknown stages: {sorted(unknown)}")
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        }
+    }
+
+    # 1) コーパス
+    docs = os.path.join(args.workdir, "docs")
+    if not args.keep and os.path.isdir(args.workdir):
+        shutil.rmtree(args.workdir)
+    if not os.path.isdir(docs):
+        results["corpus"] = generate_corpus(
+            docs, args.files, paragraphs=args.paragraphs, ja_ratio=args.ja_ratio, seed=args.seed
+        )
+    else:
+        results["corpus"] = {"reused": docs}
+    n_bytes = sum(os.path.getsize(os.path.join(docs, f)) for f in os.listdir(docs))
+    print(f"[BENCH] corpus {results['corpus']}")
+
+    # 2) インジェスト
+    if "ingest" in stages:
+        base = ["--workers", str(args.workers), "--embed-backend", args.embed_backend,
+                "--store", args.store, "--vector-dtype", args.vector_dtype]
+        results["ingest_full"] = bench_ingest(args.workdir, ["--full", "--no-cache"] + base, n_bytes, args.verbose)
+        print(f"[BENCH] ingest_full {results['ingest_full']}")
+        results["ingest_noop"] = bench_ingest(args.workdir, base, n_bytes, args.verbose)
+        print(f"[BENCH] ingest_noop {results['ingest_noop']}")
+
+    # 3) 検索 / 4) エンドツーエンド
+    queries = make_queries(args.queries, seed=args.seed + 1)
+    retriever = None
+    if "retrieve" in stages or "e2e" in stages:
+        retriever = build_retriever(args.workdir, args, cached=False)
+    if "retrieve" in stages:
+        results["retrieve"] = bench_retrieve(retriever, queries, args.top_k)
+        print(f"[BENCH] retrieve {results['retrieve']}")
+        cached = build_retriever(args.workdir, args, cached=True)
+        bench_retrieve(cached, queries, args.top_k)  # 1周目でキャッシュを温める
+        results["retrieve_cached"] = bench_retrieve(cached, queries, args.top_k)
+        print(f"[BENCH] retrieve_cached {results['retrieve_cached']}")
+    if "e2e" in stages:
+        results["e2e"] = bench_e2e(retriever, queries, args)
+        print(f"[BENCH] e2e {results['e2e']}")
+    if "embed" in stages:
+        results["embed"] = bench_embed(queries, args)
+        print(f"[BENCH] embed {results['embed']}")
+
+    out = args.out or os.path.join(
+        "bench", "results", f"{time.strftime('%Y%m%d-%H%M%S')}_{results['meta']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"[BENCH] saved {out}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
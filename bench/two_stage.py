@@ -0,0 +1,153 @@
+# bench/two_stage.py
+# ----------------------------------------
+# 全チャンク検索（flat）と二段検索（文書索引で上位 N 出典 → その出典のチャンクだけを検索）のレイテンシ比較
+# - 合成データ: トピック中心 → 文書中心 → チャンクの順にノイズを足した正規化ベクトル（出典ごとに --chunks-per-doc 件）
+# - 文書ベクトルは ingest と同じく app.ingest.doc_index.update_doc_index（チャンクの平均）で作る
+# - クエリ: ランダムなチャンクにノイズを足したもの。flat の top_k と二段の top_k の一致率（overlap）も出す
+# 埋め込みモデルは使わない（ストアの検索時間だけを測る）。
+#   python -m bench.two_stage                                  # 10k / 100k チャンク（numpy ストア）
+#   python -m bench.two_stage --sizes 10000,100000,1000000 --doc-top-n 20
+#   python -m bench.two_stage --store chroma --sizes 10000,100000
+# ----------------------------------------
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Any, Dict, List
+
+import numpy as np
+
+from app.ingest.doc_index import update_doc_index
+from bench.run import git_commit, percentiles
+
+DIM = 384  # multilingual-e5-small と同じ次元
+WRITE_BATCH = 5000
+
+
+def synth_vectors(n: int, chunks_per_doc: int, dim: int, seed: int = 0):
+    """(チャンクのベクトル, チャンクごとの出典番号, 出典数)"""
+    rng = np.random.default_rng(seed)
+    n_docs = max(1, n // chunks_per_doc)
+    n_topics = max(1, n_docs // 10)
+    topics = rng.standard_normal((n_topics, dim), dtype=np.float32)
+    docs = topics[rng.integers(0, n_topics, n_docs)] + 0.6 * rng.standard_normal((n_docs, dim), dtype=np.float32)
+    doc_of = np.minimum(np.arange(n) // chunks_per_doc, n_docs - 1)
+    vecs = docs[doc_of] + 0.8 * rng.standard_normal((n, dim), dtype=np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs, doc_of, n_docs
+
+
+def open_stores(kind: str, path: str, dtype: str):
+    if kind == "numpy":
+        from app.adapters.rag.numpy_store import NumpyVectorStore, DOC_STORE_DIR, STORE_DIR, numpy_store_path
+        return (NumpyVectorStore(numpy_store_path(path, STORE_DIR), dtype=dtype),
+                NumpyVectorStore(numpy_store_path(path, DOC_STORE_DIR), dtype=dtype))
+    import chromadb
+    client = chromadb.PersistentClient(path=path)
+    space = {"hnsw:space": "cosine"}
+    return (client.get_or_create_collection("rag_docs", metadata=space),
+            client.get_or_create_collection("rag_sources", metadata=space))
+
+
+def build(col, doc_col, vecs: np.ndarray, doc_of: np.ndarray, n_docs: int) -> Dict[str, float]:
+    sources = [f"/bench/doc{d:07d}.md" for d in range(n_docs)]
+    t0 = time.perf_counter()
+    for s in range(0, len(vecs), WRITE_BATCH):
+        e = min(s + WRITE_BATCH, len(vecs))
+        col.add(
+            ids=[f"c{i}" for i in range(s, e)],
+            documents=[""] * (e - s),
+            metadatas=[{"source": sources[doc_of[i]], "chunk_index": int(i)} for i in range(s, e)],
+            embeddings=vecs[s:e],
+        )
+    t1 = time.perf_counter()
+    update_doc_index(col, doc_col, sources)
+    t2 = time.perf_counter()
+    return {"chunks_s": round(t1 - t0, 2), "doc_index_s": round(t2 - t1, 2)}
+
+
+def flat(col, q: np.ndarray, top_k: int) -> List[str]:
+    return col.query(query_embeddings=[q], n_results=top_k, include=[])["ids"][0]
+
+
+def two_stage(col, doc_col, q: np.ndarray, top_k: int, doc_top_n: int) -> List[str]:
+    # ChromaRetriever._chunk_filters と同じ絞り込み
+    docs = doc_col.query(query_embeddings=[q], n_results=doc_top_n, include=[])["ids"][0]
+    where = {"source": {"$in": list(docs)}}
+    return col.query(query_embeddings=[q], n_results=top_k, where=where, include=[])["ids"][0]
+
+
+def run_size(args, n: int) -> Dict[str, Any]:
+    vecs, doc_of, n_docs = synth_vectors(n, args.chunks_per_doc, args.dim, seed=args.seed)
+    path = tempfile.mkdtemp(prefix=f"two_stage_{n}_", dir=args.workdir or None)
+    try:
+        col, doc_col = open_stores(args.store, path, args.vector_dtype)
+        build_s = build(col, doc_col, vecs, doc_of, n_docs)
+        rng = np.random.default_rng(args.seed + 1)
+        picks = rng.integers(0, n, args.queries)
+        queries = vecs[picks] + 0.05 * rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+        for q in queries[:3]:  # ウォームアップ（memmap のページイン・HNSW のロード）
+            flat(col, q, args.top_k)
+            two_stage(col, doc_col, q, args.top_k, args.doc_top_n)
+        flat_ms, two_ms, overlap = [], [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            a = flat(col, q, args.top_k)
+            t1 = time.perf_counter()
+            b = two_stage(col, doc_col, q, args.top_k, args.doc_top_n)
+            t2 = time.perf_counter()
+            flat_ms.append((t1 - t0) * 1000)
+            two_ms.append((t2 - t1) * 1000)
+            overlap.append(len(set(a) & set(b)) / max(1, len(a)))
+        for c in (col, doc_col):
+            close = getattr(c, "close", None)
+            if close is not None:
+                close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    row = {
+        "chunks": n,
+        "docs": n_docs,
+        "build": build_s,
+        "flat_ms": percentiles(flat_ms),
+        "two_stage_ms": percentiles(two_ms),
+        "overlap@k": round(float(np.mean(overlap)), 4),
+    }
+    print(f"[TWO_STAGE] chunks={n} docs={n_docs} flat p50={row['flat_ms']['p50']}ms p95={row['flat_ms']['p95']}ms "
+          f"two-stage p50={row['two_stage_ms']['p50']}ms p95={row['two_stage_ms']['p95']}ms "
+          f"overlap@{args.top_k}={row['overlap@k']:.3f} (build {build_s})")
+    return row
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="全チャンク検索と二段検索（文書 → チャンク）のレイテンシ比較")
+    ap.add_argument("--sizes", default="10000,100000", help="チャンク数（カンマ区切り。1000000 は float16 で約 0.8GB）")
+    ap.add_argument("--store", default="numpy", choices=["numpy", "chroma"])
+    ap.add_argument("--vector-dtype", default="float16", choices=["float16", "int8"])
+    ap.add_argument("--chunks-per-doc", type=int, default=20)
+    ap.add_argument("--doc-top-n", type=int, default=20)
+    ap.add_argument("--top-k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--dim", type=int, default=DIM)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir", default="", help="ストアを作る場所（既定は一時ディレクトリ）")
+    ap.add_argument("--out", default="", help="結果 JSON の保存先")
+    args = ap.parse_args(argv)
+
+    rows = [run_size(args, int(n)) for n in args.sizes.split(",") if n.strip()]
+    res = {
+        "meta": {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)},
+        "results": rows,
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        print(f"[TWO_STAGE] saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# embed_server.py
+# ローカル埋め込みサービスを起動する（モデルはこのプロセスに1つだけ）
+#   python embed_server.py --port 8765
+#   EMBED_SERVICE_URL=http://127.0.0.1:8765 streamlit run app.py     # 各ワーカーはモデルを読み込まない
+#   EMBED_SERVICE_URL=http://127.0.0.1:8765 python ingest.py
+# 埋め込みモデル・バックエンド・キャッシュは Settings（EMBED_MODEL / EMBED_BACKEND / EMBED_CACHE_DIR ...）に従う
+import argparse
+
+from app.config.settings import settings
+from app.adapters.embeddings.embedding_cache import embed_signature
+from app.adapters.embeddings.embed_service import EmbedServer
+from app.registry.providers import build_embedder
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="ローカル埋め込みサービス")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--max-batch", type=int, default=settings.embed_max_batch, help="1回の encode に束ねる最大件数")
+    ap.add_argument("--max-wait-ms", type=float, default=settings.embed_max_wait_ms or 5.0,
+                    help="最初の要求から束ねるまで待つ時間")
+    args = ap.parse_args(argv)
+
+    embedder = build_embedder(
+        embed_model=settings.embed_model, embed_backend=settings.embed_backend,
+        onnx_dir=settings.onnx_dir, embed_threads=settings.embed_threads,
+        embed_cache_dir=settings.embed_cache_dir, embed_cache_max_entries=settings.embed_cache_max_entries,
+        embed_token_budget=settings.embed_token_budget,
+        query_cache_size=settings.query_cache_size, query_cache_ttl=settings.query_cache_ttl,
+        embed_max_batch=args.max_batch, embed_max_wait_ms=max(args.max_wait_ms, 0.001),
+    )
+    embedder._encode_query("warmup")  # 最初の要求の初期化コストを先に払う（キャッシュには入れない）
+    server = EmbedServer(
+        embedder, embed_signature(settings.embed_model, settings.embed_backend), host=args.host, port=args.port,
+    )
+    print(f"[EMBED_SERVICE] {settings.embed_model} ({settings.embed_backend}) listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        embedder.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,55 @@
 # ingest.py
 import os
 import re
+import json
+import time
 import glob
 import hashlib
-from typing import List, Tuple, Dict, Any
+import argparse
+import itertools
+from typing import List, Set, Tuple, Dict, Any, Iterator, Iterable, Optional
 
-import chromadb
-from sentence_transformers import SentenceTransformer
 from pypdf import PdfReader
 
+from app.ingest.manifest import IngestManifest, file_sha1, manifest_path
+from app.ingest.pipeline import ChromaWriter, iter_parallel, set_torch_threads
+from app.ingest.chunker import StructuredChunker, TextChunk, make_token_counter
+from app.ingest.sync import chunk_id, clean_metadata, existing_chunks, find_orphans, iter_collection_sources
+from app.ingest.doc_index import DOC_COLLECTION_NAME, update_doc_index
+from app.ingest.metrics import IngestMetrics, profile_call
+from app.adapters.rag.generation import bump_generation
+from app.adapters.embeddings.embedding_cache import EmbeddingCache, encode_with_cache, embed_signature
+from app.adapters.embeddings.batching import TokenBudgetBatcher
+# chromadb / sentence_transformers(torch) は main() 内で import する
+# （パース用ワーカープロセスに重いモジュールを読み込ませないため）
+
 # -------- 設定 --------
 CHROMA_DIR = "chroma_db"          # 永続化先
 COLLECTION_NAME = "rag_docs"      # コレクション名
+VECTOR_STORE = os.environ.get("VECTOR_STORE", "chroma")    # chroma | numpy（memmap の全件内積検索）
+VECTOR_DTYPE = os.environ.get("VECTOR_DTYPE", "float16")   # numpy: float16 | int8（ベクトルごとのスケール付き）
 MODEL_NAME = "intfloat/multilingual-e5-small"
-CHUNK_SIZE = 500                  # 文字ベース（まずは簡易）
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "sbert")  # sbert | onnx | onnx-int8
+ONNX_DIR = os.environ.get("ONNX_DIR", "onnx_models")
+CHUNKER = os.environ.get("INGEST_CHUNKER", "structured")  # structured（見出し/段落/文）| chars（固定長の文字窓）
+CHUNK_TOKENS = int(os.environ.get("INGEST_CHUNK_TOKENS", "320"))  # structured: 1チャンクの目標トークン数
+CHUNK_OVERLAP_SENTENCES = int(os.environ.get("INGEST_CHUNK_OVERLAP_SENTENCES", "0"))  # structured: 重ねる文の数
+CHUNK_SIZE = 500                  # chars: 文字数
 CHUNK_OVERLAP = 50
 BATCH_SIZE = 1000                 # Chromaへの追加バッチ
+EMBED_BATCH = 256                 # 埋め込み1回あたりのチャンク数（ファイルをまたいでまとめる）
+EMBED_TOKEN_BUDGET = 16384        # 埋め込みミニバッチの (最長トークン長 x 件数) 上限
+PARSE_WORKERS = int(os.environ.get("INGEST_WORKERS", min(4, os.cpu_count() or 1)))
 DOCS_DIRS = ["docs"]              # 追加で "notes", "papers" など増やせる
+TARGET_EXTS = (".txt", ".md", ".pdf")
+WATCH_DEBOUNCE_MS = int(os.environ.get("INGEST_WATCH_DEBOUNCE_MS", "1500"))  # --watch: この間イベントが無ければ反映
+WATCH_MAX_WAIT_MS = 30_000        # --watch: 変更が続いてもこれ以上は待たずに反映
+MANIFEST_PATH = manifest_path(CHROMA_DIR)  # 差分インジェスト用
+EMBED_SERVICE_URL = os.environ.get("EMBED_SERVICE_URL", "")  # 指定時は埋め込みサービスを使う（モデルを読み込まない）
+EMBED_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR", "embed_cache")  # chroma_db を消しても残す
+EMBED_CACHE_MAX_ENTRIES = int(os.environ.get("EMBED_CACHE_MAX_ENTRIES", "200000"))
+STREAM_MIN_BYTES = int(os.environ.get("INGEST_STREAM_BYTES", str(20 * 1024 * 1024)))  # これ以上はメインで逐次処理
+TEXT_SEGMENT_CHARS = 1 << 16      # txt/md を逐次読みする単位（文字）
 
 # -------- ユーティリティ --------
 def ensure_dir(path: str):
@@ -25,19 +58,6 @@ def ensure_dir(path: str):
 def simple_hash(text: str) -> str:
     return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
 
-def split_text(text: str, size: int, overlap: int) -> List[str]:
-    """
-    文字数ベースのシンプル分割。
-    改善余地: 句読点/改行で先に軽く分割 → パックしてsizeに近づける。
-    """
-    chunks = []
-    i, n = 0, len(text)
-    step = max(1, size - overlap)
-    while i < n:
-        chunks.append(text[i:i + size])
-        i += step
-    return chunks
-
 def read_txt(path: str) -> str:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
         return f.read()
@@ -47,36 +67,108 @@ def read_md(path: str) -> str:
     return read_txt(path)
 
 def read_pdf(path: str) -> str:
+    return "".join(t for t, _ in iter_pdf_pages(path))
+
+def load_file(path: str) -> Tuple[str, str]:
+    kind, segments = iter_segments(path)
+    return "".join(t for t, _ in segments), kind
+
+# -------- 逐次読み込み（巨大ファイル用） --------
+# セグメント = (テキスト, ページ番号 or None)。連結すると load_file と同じ全文になる。
+def iter_txt_segments(path: str, seg_chars: int = TEXT_SEGMENT_CHARS) -> Iterator[Tuple[str, Optional[int]]]:
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            t = f.read(seg_chars)
+            if not t:
+                break
+            yield t, None
+
+def iter_pdf_pages(path: str) -> Iterator[Tuple[str, Optional[int]]]:
+    """1ページずつ抽出（ページ間は従来どおり改行で区切る）"""
     try:
         reader = PdfReader(path)
-        pages = []
-        for p in reader.pages:
+        for no, p in enumerate(reader.pages, 1):
             t = p.extract_text() or ""
-            pages.append(t)
-        return "\n".join(pages)
+            yield (t if no == 1 else "\n" + t), no
     except Exception as e:
         print(f"[WARN] PDF読取失敗: {path} ({e})")
-        return ""
 
-def load_file(path: str) -> Tuple[str, str]:
+def iter_segments(path: str) -> Tuple[str, Iterator[Tuple[str, Optional[int]]]]:
     ext = os.path.splitext(path)[1].lower()
     if ext == ".txt":
-        return read_txt(path), "text"
+        return "text", iter_txt_segments(path)
     if ext == ".md":
-        return read_md(path), "markdown"
+        return "markdown", iter_txt_segments(path)
     if ext == ".pdf":
-        return read_pdf(path), "pdf"
-    return "", "unknown"
+        return "pdf", iter_pdf_pages(path)
+    return "unknown", iter(())
+
+def peek_head(segments: Iterator[Tuple[str, Optional[int]]], lines: int = 30):
+    """
+    冒頭 lines 行ぶん（メタデータ抽出用）だけ先読みし、
+    (冒頭テキスト, 先読み分を戻したセグメント列) を返す
+    """
+    taken, head = [], ""
+    for seg in segments:
+        taken.append(seg)
+        head += seg[0]
+        if head.count("\n") >= lines:
+            break
+    return head, itertools.chain(taken, segments)
+
+def iter_chunks(segments: Iterable[Tuple[str, Optional[int]]], size: int, overlap: int) -> Iterator[TextChunk]:
+    """
+    固定長の窓（size 文字 / overlap 重なり）をセグメント列から逐次に切り出す（INGEST_CHUNKER=chars）。
+    ページ境界をまたいでも重なりは保たれ、保持するのは未確定の末尾だけ。
+    """
+    step = max(1, size - overlap)
+    buf, base = "", 0            # buf[0] の全体オフセット
+    pages: List[Tuple[int, int]] = []  # (開始オフセット, ページ番号)
+    i = 0                        # 次チャンクの開始オフセット
+
+    def page_at(off: int) -> Optional[int]:
+        cur = None
+        for start, no in pages:
+            if start > off:
+                break
+            cur = no
+        return cur
+
+    def emit(end: int) -> TextChunk:
+        return TextChunk(buf[i - base:end - base], page_at(i), page_at(max(i, end - 1)))
+
+    for text, page in segments:
+        if page is not None:
+            pages.append((base + len(buf), page))
+        buf += text
+        while i + size <= base + len(buf):
+            yield emit(i + size)
+            i += step
+        # 確定済みの先頭を捨てる（ページ情報も i より前の1件だけ残す）
+        if i > base:
+            buf, base = buf[i - base:], i
+            while len(pages) > 1 and pages[1][0] <= i:
+                pages.pop(0)
+    total = base + len(buf)
+    while i < total:
+        yield emit(min(i + size, total))
+        i += step
 
-def iter_target_files() -> List[str]:
+def iter_target_files(bases: Optional[Iterable[str]] = None) -> List[str]:
     patterns = []
-    for base in DOCS_DIRS:
-        patterns += glob.glob(os.path.join(base, "**", "*.txt"), recursive=True)
-        patterns += glob.glob(os.path.join(base, "**", "*.md"), recursive=True)
-        patterns += glob.glob(os.path.join(base, "**", "*.pdf"), recursive=True)
+    for base in (DOCS_DIRS if bases is None else bases):
+        for ext in TARGET_EXTS:
+            patterns += glob.glob(os.path.join(base, "**", f"*{ext}"), recursive=True)
     # 安定した処理順（再現性）
     return sorted(set(patterns))
 
+def is_target(path: str) -> bool:
+    """DOCS_DIRS 配下の対象拡張子のファイルか（エディタの一時ファイルなどを除く）"""
+    if not path.lower().endswith(TARGET_EXTS) or os.path.basename(path).startswith((".", "~")):
+        return False
+    path = os.path.abspath(path)
+    return any(path.startswith(os.path.abspath(d) + os.sep) for d in DOCS_DIRS)
+
 # -------- Markdownの日付抽出 --------
 def extract_date_from_text(text: str) -> str:
     """
@@ -166,13 +258,260 @@ def extract_study_time_from_text(text: str) -> float:
 
 
 # -------- メイン処理 --------
-def main():
+_chunker: Optional[StructuredChunker] = None
+_counter_id = ""
+
+def get_chunker() -> StructuredChunker:
+    """プロセスごとに1回だけトークナイザを読み込む（パース用ワーカーでも使う）"""
+    global _chunker, _counter_id
+    if _chunker is None:
+        count, _counter_id = make_token_counter(MODEL_NAME)
+        _chunker = StructuredChunker(count, CHUNK_TOKENS, CHUNK_OVERLAP_SENTENCES)
+    return _chunker
+
+def chunking_signature() -> str:
+    """チャンク設定が変わったら全ファイル再処理させるための識別子（p=ページ情報付き）"""
+    if CHUNKER == "chars":
+        return f"chars:{CHUNK_SIZE}/{CHUNK_OVERLAP}:p"
+    get_chunker()
+    return f"struct:{CHUNK_TOKENS}/{CHUNK_OVERLAP_SENTENCES}:{_counter_id}:h"
+
+def open_chunk_stream(abs_path: str):
+    """
+    ファイルを逐次読みしてチャンク列にする。
+    戻り値: (kind, ファイル共通メタデータ, TextChunk のイテレータ, counter)
+    counter: {"chars": 読んだ文字数, "read_s": 読込/パースの秒, "meta_s": メタデータ抽出の秒,
+              "slow_page": 一番遅かった PDF ページの (番号, 秒) or None}（チャンク列を読み進めるにつれて増える）
+    冒頭30行だけ先読みして日付/タグ/学習時間を抽出する（全文は保持しない）。
+    """
+    kind, segments = iter_segments(abs_path)
+    counter: Dict[str, Any] = {"chars": 0, "read_s": 0.0, "meta_s": 0.0, "slow_page": None}
+
+    def counted():
+        while True:
+            t0 = time.perf_counter()
+            seg = next(segments, None)
+            dt = time.perf_counter() - t0
+            counter["read_s"] += dt
+            if seg is None:
+                return
+            if seg[1] is not None and (counter["slow_page"] is None or dt > counter["slow_page"][1]):
+                counter["slow_page"] = (seg[1], dt)
+            counter["chars"] += len(seg[0])
+            yield seg
+
+    head, segs = peek_head(counted(), 30)
+    t0 = time.perf_counter()
+    tags_list = extract_tags_from_text(head)
+    meta = {
+        "source": abs_path,
+        "type": kind,
+        "date": extract_date_from_text(head),  # ← ✅ 日付を追加
+        "tags_csv": ",".join(tags_list) if tags_list else None,
+        "study_time_hours": extract_study_time_from_text(head),  # ← ✅ 学習時間を追加
+    }
+    counter["meta_s"] = time.perf_counter() - t0
+    # 空白だけのチャンクは登録しない（空ファイル判定もこれで兼ねる）
+    if CHUNKER == "chars":
+        chunks = iter_chunks(segs, CHUNK_SIZE, CHUNK_OVERLAP)
+    else:
+        chunks = get_chunker().chunk(segs, markdown=kind == "markdown")
+    chunks = (c for c in chunks if c.text.strip())
+    return kind, meta, chunks, counter
+
+def chunk_metadata(meta: Dict[str, Any], i: int, chunk: TextChunk) -> Dict[str, Any]:
+    m = {**meta, "chunk_index": i}
+    if chunk.page_start is not None:
+        m["page"] = chunk.page_start
+        m["page_end"] = chunk.page_end
+    if chunk.heading_path:
+        m["heading_path"] = chunk.heading_path
+    return m
+
+def stage_timings(counter: Dict[str, Any], total: float) -> Dict[str, float]:
+    """open_chunk_stream の counter と、チャンク列を読み切るまでの秒 → 段階別の秒（残りをチャンク化とみなす）"""
+    return {
+        "read": counter["read_s"],
+        "metadata": counter["meta_s"],
+        "chunk": max(0.0, total - counter["read_s"] - counter["meta_s"]),
+    }
+
+def prepare_file(abs_path: str, known_hash: str | None, stream: bool = False) -> Dict[str, Any]:
+    """
+    パース用ワーカープロセスで実行：ハッシュ → 読込 → メタデータ抽出 → チャンク化。
+    known_hash と一致したら読み込まずに "same" を返す。
+    stream=True（巨大ファイル）はハッシュだけ返し、本体はメインで逐次処理する。
+    res["timings"] には段階ごとの秒（hash / read / metadata / chunk）を入れる。
+    """
+    res: Dict[str, Any] = {"path": abs_path}
+    timings = res["timings"] = {}
+    try:
+        t0 = time.perf_counter()
+        content_hash = file_sha1(abs_path)
+        timings["hash"] = time.perf_counter() - t0
+        res["content_hash"] = content_hash
+        if known_hash is not None and content_hash == known_hash:
+            res["status"] = "same"
+            return res
+        if stream:
+            res["status"] = "stream"
+            return res
+
+        t0 = time.perf_counter()
+        kind, meta, chunks, counter = open_chunk_stream(abs_path)
+        res["chunks"] = list(chunks)
+        timings.update(stage_timings(counter, time.perf_counter() - t0))
+        res.update(kind=kind, meta=meta, text_len=counter["chars"], slow_page=counter["slow_page"])
+        res["status"] = "ok" if res["chunks"] else "empty"
+    except Exception as e:
+        res["status"] = "error"
+        res["error"] = f"{type(e).__name__}: {e}"
+    return res
+
+def parse_args(argv=None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="docs/ をベクトルDBへ登録")
+    ap.add_argument("--full", action="store_true",
+                    help="マニフェストを無視して全ファイルを再処理する")
+    ap.add_argument("--sync", action="store_true",
+                    help="id 単位の差分 upsert と、docs/ から消えたファイルのチャンク（孤児）の削除")
+    ap.add_argument("--watch", action="store_true",
+                    help="起動時に差分を取り込んだあと docs/ を監視し、変更のあったファイルだけを取り込み続ける")
+    ap.add_argument("--debounce-ms", type=int, default=WATCH_DEBOUNCE_MS,
+                    help="--watch: 最後の変更からこの時間イベントが無ければまとめて反映")
+    ap.add_argument("--store", choices=["chroma", "numpy"], default=VECTOR_STORE,
+                    help="書き込み先のベクトルストア（numpy は chroma_db/numpy_store/ に memmap で保存）")
+    ap.add_argument("--vector-dtype", choices=["float16", "int8"], default=VECTOR_DTYPE,
+                    help="--store numpy: ベクトルの保存形式（既存ストアがあればその形式のまま）")
+    ap.add_argument("--no-doc-index", action="store_true",
+                    help="文書単位の索引（出典ごとの平均ベクトル。二段検索用）を更新しない")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="埋め込みキャッシュを使わない")
+    ap.add_argument("--stream", action="store_true",
+                    help="全ファイルを逐次読み（ページ単位）で処理する（既定は INGEST_STREAM_BYTES 以上のみ）")
+    ap.add_argument("--workers", type=int, default=PARSE_WORKERS,
+                    help="読込/パース用のプロセス数（1 で直列）")
+    ap.add_argument("--embed-batch", type=int, default=EMBED_BATCH,
+                    help="ファイルをまたいで1回に埋め込むチャンク数")
+    ap.add_argument("--embed-tokens", type=int, default=EMBED_TOKEN_BUDGET,
+                    help="埋め込みミニバッチのトークン予算（長さでソートして詰める）")
+    ap.add_argument("--embed-backend", choices=["sbert", "onnx", "onnx-int8"], default=EMBED_BACKEND,
+                    help="埋め込みの実行系（onnx/onnx-int8 は onnxruntime で CPU 推論）")
+    ap.add_argument("--embed-procs", type=int, default=1,
+                    help="埋め込み用のプロセス数（2以上で SentenceTransformer のマルチプロセスプール）")
+    ap.add_argument("--embed-threads", type=int, default=0,
+                    help="torch のスレッド数（0 は既定値）")
+    ap.add_argument("--embed-service", default=EMBED_SERVICE_URL,
+                    help="埋め込みサービスの URL（embed_server.py。指定時は --embed-backend/--embed-procs を無視）")
+    ap.add_argument("--report", default="",
+                    help="段階別の時間・スループット・最大 RSS・遅いファイルを JSON で保存するパス")
+    ap.add_argument("--profile", nargs="?", const="ingest.prof", default="",
+                    help="cProfile で記録して保存（既定 ingest.prof。パース用ワーカーは --workers 1 のときだけ含まれる）")
+    return ap.parse_args(argv)
+
+def open_collection(args: argparse.Namespace, docs: bool = False):
+    """
+    書き込み先（Chroma のコレクション / 同じメソッドを持つ NumpyVectorStore）。
+    docs=True は文書単位の索引（1出典 = 1ベクトル）
+    """
+    if args.store == "numpy":
+        from app.adapters.rag.numpy_store import DOC_STORE_DIR, STORE_DIR, NumpyVectorStore, numpy_store_path
+        return NumpyVectorStore(
+            numpy_store_path(CHROMA_DIR, DOC_STORE_DIR if docs else STORE_DIR), dtype=args.vector_dtype,
+        )
+    import chromadb
+    client = chromadb.PersistentClient(path=CHROMA_DIR)
+    return client.get_or_create_collection(
+        name=DOC_COLLECTION_NAME if docs else COLLECTION_NAME,
+        metadata={"hnsw:space": "cosine"},
+    )
+
+class PassageEncoder:
+    """
+    パッセージ埋め込み（最初のキャッシュミスでモデルをロード）。
+    --watch では main() の呼び出しをまたいで同じインスタンスを使い、モデルを読み直さない。
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.embed = None
+        self.pool = None
+        self.batcher: Optional[TokenBudgetBatcher] = None
+        self.remote = None
+        if args.embed_service:
+            from app.adapters.embeddings.remote_embedder import RemoteEmbedder
+            self.remote = RemoteEmbedder(args.embed_service, timeout=600, query_cache_size=0)
+            self.signature = self.remote.signature  # サービス側のモデル/バックエンドでマニフェストとキャッシュを分ける
+            print(f"[EMBED] using embed service {args.embed_service} ({self.signature})")
+        else:
+            self.signature = embed_signature(MODEL_NAME, args.embed_backend)
+
+    def _load(self):
+        args = self.args
+        if args.embed_backend == "sbert":
+            from sentence_transformers import SentenceTransformer
+            set_torch_threads(args.embed_threads)
+            self.embed = SentenceTransformer(MODEL_NAME)  # , device="cuda"
+            if args.embed_procs > 1:
+                self.pool = self.embed.start_multi_process_pool(["cpu"] * args.embed_procs)
+        else:
+            # onnxruntime（encode/tokenizer は SentenceTransformer 互換）
+            from app.adapters.embeddings.onnx_embedder import OnnxEmbedder
+            self.embed = OnnxEmbedder(
+                MODEL_NAME, onnx_dir=ONNX_DIR, quantize=args.embed_backend == "onnx-int8",
+                threads=args.embed_threads, query_cache_size=0,
+            )
+        self.batcher = TokenBudgetBatcher(self.embed, token_budget=args.embed_tokens)
+
+    def __call__(self, texts: List[str]):
+        if self.remote is not None:
+            # 長さでの並べ替え・マイクロバッチはサービス側で行う
+            t0 = time.perf_counter()
+            vecs = self.remote.encode(texts)
+            dt = time.perf_counter() - t0
+            print(f"[EMBED] {len(texts)} passages in {dt:.2f}s ({len(texts) / dt if dt else 0:.1f}/s, service)")
+            return vecs
+        if self.embed is None:
+            self._load()
+        batcher = self.batcher
+        n0, t0 = batcher.passages, batcher.seconds
+        vecs = batcher.encode(texts, pool=self.pool)
+        dt = batcher.seconds - t0
+        print(f"[EMBED] {batcher.passages - n0} passages in {dt:.2f}s ({(batcher.passages - n0) / dt if dt else 0:.1f}/s)")
+        return vecs
+
+    def close(self):
+        if self.pool is not None:
+            self.embed.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+def main(argv=None, paths: Optional[Iterable[str]] = None, removed: Iterable[str] = (),
+         encoder: Optional[PassageEncoder] = None):
+    """
+    paths を渡すとそのファイルだけを処理し、removed のファイルのチャンクを削除する（--watch から呼ぶ）。
+    省略時は DOCS_DIRS 全体を走査する。
+    """
+    args = parse_args(argv)
+    if args.watch and encoder is None:
+        return watch(argv)
+    if args.profile:
+        if args.workers > 1 and paths is None:
+            print("[PROFILE] パース用ワーカー（別プロセス）の中は記録されません（含めるなら --workers 1）")
+        return profile_call(args.profile, run_ingest, args, paths, removed, encoder)
+    return run_ingest(args, paths, removed, encoder)
+
+def run_ingest(args: argparse.Namespace, paths: Optional[Iterable[str]], removed: Iterable[str],
+               encoder: Optional[PassageEncoder]):
     # 0) 前提チェック
+    metrics = IngestMetrics()
     ensure_dir(CHROMA_DIR)
     if not any(os.path.isdir(d) for d in DOCS_DIRS):
         print(f"[INFO] 対象ディレクトリがありません: {DOCS_DIRS}")
-    files = iter_target_files()
-    if not files:
+    removed = sorted(set(removed))
+    if paths is None:
+        files = iter_target_files()
+    else:
+        files = sorted(p for p in set(paths) if is_target(p) and os.path.isfile(p))
+    if not files and not removed:
         print("[INFO] 対象ファイルが見つかりません。")
         return
 
@@ -181,86 +520,311 @@ def main():
     for p in files:
         print(" -", p)
 
-    # 1) ベクトルDB & 埋め込みモデル
-    client = chromadb.PersistentClient(path=CHROMA_DIR)
-    col = client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        metadata={"hnsw:space": "cosine"},
-    )
-    embed = SentenceTransformer(MODEL_NAME)  # , device="cuda"
-
-    ids_buf, docs_buf, metas_buf, embs_buf = [], [], [], []
-
-    # 2) 各ファイルを処理
+    # 1) ベクトルDB & マニフェスト
+    col = open_collection(args)
+    doc_col = None if args.no_doc_index else open_collection(args, docs=True)
+    manifest = IngestManifest(MANIFEST_PATH)
+    if args.full:
+        manifest.clear()
+    elif len(manifest) and col.count() == 0:
+        # chroma_db を作り直した等：マニフェストだけ残っていると何も登録されない
+        print("[INFO] コレクションが空のため manifest を破棄して全件処理します")
+        manifest.clear()
+    chunking = chunking_signature()
+    own_encoder = encoder is None
+    encoder = encoder or PassageEncoder(args)
+    embed_sig = encoder.signature
+
+    # 2) size/mtime が同じファイルは開かずにスキップ → 残りをパース対象に
+    metrics.add("setup", time.perf_counter() - metrics.t0)
+    stats: Dict[str, os.stat_result] = {}
+    tasks: List[Tuple[str, str | None, bool]] = []
+    n_skip = 0
+    t_scan = time.perf_counter()
     for path in files:
         abs_path = os.path.abspath(path)  # ← 絶対パスで統一（重要）
-        text, kind = load_file(abs_path)
-        print(f"[READ] {abs_path} len={len(text)} kind={kind}")
-
-        if not text or not text.strip():
-            print(f"[SKIP-EMPTY] {abs_path}")
+        st = os.stat(abs_path)
+        if manifest.is_unchanged(abs_path, st, embed_sig, chunking):
+            n_skip += 1
             continue
-
-        file_hash = simple_hash(text)
-        date_str = extract_date_from_text(text)
-        tags_list = extract_tags_from_text(text) 
-        study_time_hours = extract_study_time_from_text(text)
-
-        # 既存分を削除（source=絶対パスで一致させる）
-        try:
-            col.delete(where={"source": abs_path})
-            print(f"[DEL] source={abs_path}")
-        except Exception as e:
-            print(f"[WARN] delete失敗 (source={abs_path}): {e}")
-
-        # 3) チャンク化
-        chunks = split_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
-        print(f"[CHUNK] {abs_path} -> {len(chunks)} chunks")
-
-        if not chunks:
-            print(f"[SKIP-NOCHUNK] {abs_path}")
-            continue
-
-        # 4) E5 prefix（passage: ...）
-        embs = embed.encode(
-            [f"passage: {c}" for c in chunks],
-            normalize_embeddings=True,
-            show_progress_bar=True,
-        ).tolist()
-
-        # 5) 追加キューに積む
-        start_idx = len(ids_buf)
-        for i, (c, e) in enumerate(zip(chunks, embs)):
-            ids_buf.append(f"{abs_path}:{i}")
-            docs_buf.append(c)
-            metas_buf.append({
-                "source": abs_path,
-                "type": kind,
-                "chunk_index": i,
-                "file_hash": file_hash,
-                "date": date_str,  # ← ✅ 日付を追加
-                "tags_csv": ",".join(tags_list) if tags_list else None, 
-                "study_time_hours": study_time_hours,  # ← ✅ 学習時間を追加
-            })
-            embs_buf.append(e)
-
-        added_for_file = len(ids_buf) - start_idx
-        print(f"[ADD-FILE] {os.path.basename(abs_path)} add={added_for_file}")
-
-        # 6) バッチフラッシュ
-        if len(ids_buf) >= BATCH_SIZE:
-            col.add(ids=ids_buf, documents=docs_buf, metadatas=metas_buf, embeddings=embs_buf)
-            print(f"[ADD] {len(ids_buf)} chunks (flush)")
-            ids_buf, docs_buf, metas_buf, embs_buf = [], [], [], []
-
-    # 残りをフラッシュ
-    if ids_buf:
-        col.add(ids=ids_buf, documents=docs_buf, metadatas=metas_buf, embeddings=embs_buf)
-        print(f"[ADD] {len(ids_buf)} chunks (final)")
-
+        stats[abs_path] = st
+        stream = args.stream or st.st_size >= STREAM_MIN_BYTES
+        tasks.append((abs_path, manifest.known_hash(abs_path, embed_sig, chunking), stream))
+    metrics.add("scan", time.perf_counter() - t_scan)
+    metrics.total_files = len(tasks)
+
+    # 3) 埋め込み（キャッシュミスが出たときだけモデルをロード）
+    cache = None
+    if EMBED_CACHE_DIR and not args.no_cache:
+        cache = EmbeddingCache(EMBED_CACHE_DIR, embed_sig, max_entries=EMBED_CACHE_MAX_ENTRIES)
+    encode_passages = encoder
+
+    # 4) パース（プロセスプール）→ 埋め込み（ファイル横断バッチ）→ 書き込み（別スレッド）
+    writer = ChromaWriter(col, batch_size=BATCH_SIZE, upsert=args.sync)
+    writer.start()
+    pending_ids, pending_docs, pending_metas = [], [], []
+    sync_counts = {"kept": 0, "orphan_sources": 0}
+    touched = set()  # チャンクが変わった出典（文書単位の索引を作り直す）
+
+    def flush_embed():
+        # 埋め込みは NumPy 配列のまま書き込みスレッドへ渡す（list 化しない）
+        with metrics.stage("embed"):
+            embs = encode_with_cache(cache, "passage: ", pending_docs, encode_passages)
+        writer.add(pending_ids, pending_docs, pending_metas, embs)
+        pending_ids.clear()
+        pending_docs.clear()
+        pending_metas.clear()
+
+    def push_chunks(abs_path: str, meta: Dict[str, Any], chunks: Iterable[TextChunk]) -> int:
+        """
+        チャンクを埋め込み待ちに積み、埋め込みバッチに達したら都度フラッシュ。
+        --sync では同じ id（= 同じ本文）が既にあれば埋め込まず、位置などのメタデータだけ直す。
+        最後に、新しいチャンクに無くなった既存 id を削除する。
+        """
+        existing = existing_chunks(col, abs_path) if args.sync else None
+        seen: Dict[str, int] = {}
+        upd_ids, upd_metas = [], []
+        n = 0
+        for i, c in enumerate(chunks):
+            cid = chunk_id(abs_path, c.text, seen)
+            m = chunk_metadata(meta, i, c)
+            n += 1
+            if existing is not None and cid in existing:
+                if clean_metadata(existing.pop(cid)) == clean_metadata(m):
+                    sync_counts["kept"] += 1
+                else:
+                    upd_ids.append(cid)
+                    upd_metas.append(m)
+                continue
+            pending_ids.append(cid)
+            pending_docs.append(c.text)
+            pending_metas.append(m)
+            if len(pending_ids) >= args.embed_batch:
+                flush_embed()
+        if existing is not None:
+            writer.update_metadata(upd_ids, upd_metas)
+            writer.delete_ids(list(existing))
+        return n
+
+    def drop_source(abs_path: str):
+        touched.add(abs_path)
+        if args.sync:
+            writer.delete_ids(list(existing_chunks(col, abs_path)))
+        else:
+            writer.delete_source(abs_path)
+
+    n_touch = n_changed = n_error = 0
+    try:
+        # --watch の少数ファイルはこのプロセスでパースする（毎回プールとトークナイザを立ち上げない）
+        workers = args.workers if paths is None else 1
+        for done, res in enumerate(iter_parallel(prepare_file, tasks, workers=workers), 1):
+            metrics.maybe_progress(done - 1)
+            abs_path, status = res["path"], res["status"]
+            st = stats[abs_path]
+            had_entry = manifest.get(abs_path) is not None
+
+            if status != "stream":
+                metrics.file_done(abs_path, st.st_size, len(res.get("chunks") or ()), res["timings"],
+                                  res.get("slow_page"))
+            if status == "same":
+                manifest.touch(abs_path, st)
+                n_touch += 1
+                print(f"[SKIP-SAME] {abs_path}")
+                continue
+            if status == "error":
+                # マニフェストは更新しない → 次回再試行
+                n_error += 1
+                print(f"[WARN] 処理失敗: {abs_path} ({res['error']})")
+                continue
+
+            n_changed += 1
+            touched.add(abs_path)
+            if status == "stream":
+                # 巨大ファイル：ページ/セグメント単位で読み → チャンク → 埋め込みを逐次に
+                if not args.sync:
+                    writer.delete_source(abs_path)
+                t0, embed0 = time.perf_counter(), metrics.stages.get("embed", 0.0)
+                kind, meta, chunks, counter = open_chunk_stream(abs_path)
+                meta["file_hash"] = res["content_hash"]
+                n = push_chunks(abs_path, meta, chunks)
+                # 逐次処理では途中で埋め込みも走るので、その分を除いてチャンク化の時間とする
+                total = time.perf_counter() - t0 - (metrics.stages.get("embed", 0.0) - embed0)
+                metrics.file_done(abs_path, st.st_size, n, {**res["timings"], **stage_timings(counter, total)},
+                                  counter["slow_page"])
+                print(f"[STREAM] {abs_path} len={counter['chars']} kind={kind} -> {n} chunks")
+                manifest.update(abs_path, st, res["content_hash"], n, embed_sig, chunking)
+                continue
+
+            print(f"[READ] {abs_path} len={res['text_len']} kind={res['kind']}")
+            if status == "empty":
+                if had_entry:
+                    # 以前は中身があった → 古いチャンクを消しておく
+                    drop_source(abs_path)
+                manifest.update(abs_path, st, res["content_hash"], 0, embed_sig, chunking)
+                print(f"[SKIP-EMPTY] {abs_path}")
+                continue
+
+            # 既存分を削除（source=絶対パスで一致させる）→ 書き込みスレッドで追加より先に実行される
+            # --sync では削除せず、push_chunks が id の差分だけを書き換える
+            if not args.sync:
+                writer.delete_source(abs_path)
+
+            chunks = res["chunks"]
+            print(f"[CHUNK] {abs_path} -> {len(chunks)} chunks")
+            meta = {**res["meta"], "file_hash": res["content_hash"]}
+            push_chunks(abs_path, meta, chunks)
+            manifest.update(abs_path, st, res["content_hash"], len(chunks), embed_sig, chunking)
+
+        if pending_ids:
+            flush_embed()
+
+        for p in removed:
+            print(f"[REMOVED] {p}")
+            drop_source(p)
+
+        if args.sync and paths is None:
+            # docs/ から消えたファイルのチャンクを id 指定でまとめて削除
+            orphans = find_orphans(col, (os.path.abspath(p) for p in files))
+            for source, ids in orphans.items():
+                print(f"[ORPHAN] {source} ({len(ids)} chunks)")
+                writer.delete_ids(ids)
+                touched.add(source)
+            sync_counts["orphan_sources"] = len(orphans)
+    finally:
+        # 書き込みエラーがあればここで送出 → マニフェストは保存しない
+        writer.close()
+        metrics.add("write", writer.seconds)
+        if own_encoder:
+            encoder.close()
+
+    # 文書単位の索引：チャンクが変わった出典の平均ベクトルを作り直す（初回は全出典）
+    doc_counts = {"upserted": 0, "deleted": 0}
+    if doc_col is not None:
+        if doc_col.count() == 0 and col.count() > 0:
+            touched.update(source for _, source in iter_collection_sources(col))
+        if paths is None:
+            # 消えたファイル・--sync なしの削除漏れも含めて、今の docs/ に無い出典を外す
+            touched.update(find_orphans(doc_col, (os.path.abspath(p) for p in files)))
+        if touched:
+            with metrics.stage("doc_index"):
+                doc_counts = update_doc_index(col, doc_col, touched)
+            print(f"[DOCS] upserted={doc_counts['upserted']} deleted={doc_counts['deleted']} total={doc_col.count()}")
+
+    # numpy ストア: 更新・削除で墓標が増えたら詰め直す（読み手は次の世代で開き直す）
+    for c in (col, doc_col):
+        if hasattr(c, "maybe_compact"):
+            with metrics.stage("compact"):
+                c.maybe_compact()
+
+    # 検索側の結果キャッシュを無効化（コレクションが変わったときだけ）
+    if (writer.added or writer.deleted_sources or writer.updated or writer.deleted_ids
+            or doc_counts["upserted"] or doc_counts["deleted"]):
+        print(f"[GENERATION] {bump_generation(CHROMA_DIR)}")
+
+    # 消えたファイルはマニフェストからも外す（再出現時に再登録させる）
+    if paths is None:
+        current = {os.path.abspath(p) for p in files}
+        for p in manifest.paths():
+            if p not in current:
+                manifest.remove(p)
+    for p in removed:
+        manifest.remove(p)
+    # Chroma への書き込みが全て終わってから保存（途中失敗時は次回やり直し）
+    manifest.save()
+
+    print(f"[MANIFEST] unchanged={n_skip} same-hash={n_touch} changed={n_changed} error={n_error}")
+    print(f"[WRITE] added={writer.added} deleted_sources={writer.deleted_sources}")
+    if args.sync:
+        print(f"[SYNC] added={writer.added} updated={writer.updated} kept={sync_counts['kept']} "
+              f"removed={writer.deleted_ids} orphan_sources={sync_counts['orphan_sources']}")
+    if encoder.batcher is not None:
+        print(f"[EMBED] {encoder.batcher.stats()}")
+    if cache is not None:
+        print(f"[CACHE] {cache.stats()}")
+        cache.close()
     print(f"[COUNT] total in collection = {col.count()}")
+    report = metrics.report()
+    metrics.print_summary(report)
+    if args.report:
+        report["args"] = vars(args)
+        ensure_dir(os.path.dirname(os.path.abspath(args.report)))
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[REPORT] saved {args.report}")
     print("[DONE] 登録完了")
-
+    return {
+        "files": len(files),
+        "unchanged": n_skip,
+        "same_hash": n_touch,
+        "changed": n_changed,
+        "errors": n_error,
+        "removed_files": len(removed),
+        "added": writer.added,
+        "deleted_sources": writer.deleted_sources,
+        "updated": writer.updated,
+        "removed": writer.deleted_ids,
+        "doc_upserted": doc_counts["upserted"],
+        "doc_deleted": doc_counts["deleted"],
+        **sync_counts,
+        "metrics": report,
+    }
+
+
+# -------- 監視モード（--watch） --------
+def collect_changes(changes: Iterable[Tuple[Any, str]]) -> Tuple[Set[str], Set[str]]:
+    """
+    watchfiles のイベント列 → (取り込むファイル, 削除するファイル)。
+    イベントの種類ではなく処理時点の存在で判定する（保存時の一時ファイル→リネームや、削除→再作成をまとめて扱える）。
+    ディレクトリの追加/リネームは配下のファイル、削除はマニフェスト上の配下のファイルに展開する。
+    """
+    touched: Set[str] = set()
+    removed: Set[str] = set()
+    known: Optional[List[str]] = None
+    for _, path in changes:
+        p = os.path.abspath(path)
+        if os.path.isdir(p):
+            touched.update(os.path.abspath(f) for f in iter_target_files([p]))
+        elif os.path.exists(p):
+            if is_target(p):
+                touched.add(p)
+        else:
+            if known is None:
+                known = list(IngestManifest(MANIFEST_PATH).paths())
+            removed.update(q for q in known if q == p or q.startswith(p + os.sep))
+            if is_target(p):
+                removed.add(p)
+    return touched, removed
+
+def watch(argv=None):
+    """DOCS_DIRS を監視し、まとまった変更ごとに main(paths=..., removed=...) を呼ぶ（Ctrl+C で終了）"""
+    from watchfiles import watch as watch_changes
+
+    args = parse_args(argv)
+    dirs = [d for d in DOCS_DIRS if os.path.isdir(d)]
+    if not dirs:
+        print(f"[INFO] 対象ディレクトリがありません: {DOCS_DIRS}")
+        return
+    encoder = PassageEncoder(args)
+    try:
+        main(argv, encoder=encoder)  # 停止中の変更を先に反映
+        print(f"[WATCH] {dirs} debounce={args.debounce_ms}ms")
+        for changes in watch_changes(
+            *dirs, step=args.debounce_ms, debounce=max(args.debounce_ms, WATCH_MAX_WAIT_MS),
+        ):
+            touched, removed = collect_changes(changes)
+            if not touched and not removed:
+                continue
+            print(f"[WATCH] {len(touched)} changed / {len(removed)} removed")
+            try:
+                main(argv, paths=touched, removed=removed, encoder=encoder)
+            except Exception as e:
+                # マニフェストは保存されていない → 次の変更時（または再起動時）にやり直される
+                print(f"[WARN] 取り込み失敗: {type(e).__name__}: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        encoder.close()
+    print("[WATCH] stopped")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,85 @@
+# tests/test_answer_cache.py
+# 回答キャッシュ：類似クエリでの命中と、出典の内容が変わったときの無効化
+import os
+
+import numpy as np
+
+from app.adapters.cache.answer_cache import AnswerCache
+from app.adapters.rag.generation import bump_generation
+from app.core.types import Message
+from app.ingest.manifest import IngestManifest, manifest_path
+
+EMBED = "intfloat/multilingual-e5-small"
+PREFIX = [Message(role="system", content="sys")]
+
+
+def ingest(db, tmp_path, name, text):
+    """ingest.py 相当：ファイルを書いてマニフェストに内容ハッシュを記録し、世代を進める"""
+    doc = str(tmp_path / name)
+    with open(doc, "w", encoding="utf-8") as f:
+        f.write(text)
+    m = IngestManifest(manifest_path(db))
+    m.update(doc, os.stat(doc), f"sha-{text}", 1, EMBED, "est")
+    m.save()
+    bump_generation(db)
+    return doc
+
+
+def make_cache(tmp_path, **kwargs):
+    db = str(tmp_path / "db")
+    a = ingest(db, tmp_path, "a.md", "v1")
+    b = ingest(db, tmp_path, "b.md", "v1")
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), chroma_path=db, **kwargs)
+    key = AnswerCache.make_key("m", {"temperature": 0.2}, "ctx", PREFIX)
+    cache.put(key, "q1", [1.0, 0.0], "answer-a", [a])
+    cache.put(key, "q2", [0.0, 1.0], "answer-b", [b])
+    return cache, db, key, a, b
+
+
+def test_key_ignores_num_ctx_but_not_context():
+    k = AnswerCache.make_key("m", {"temperature": 0.2, "num_ctx": 2048}, "ctx", PREFIX)
+    assert k == AnswerCache.make_key("m", {"temperature": 0.2, "num_ctx": 8192, "keep_alive": "5m"}, "ctx", PREFIX)
+    assert k != AnswerCache.make_key("m", {"temperature": 0.2}, "other ctx", PREFIX)
+    assert k != AnswerCache.make_key("m", {"temperature": 0.7}, "ctx", PREFIX)
+
+
+def test_similar_query_hits(tmp_path):
+    cache, _, key, a, _ = make_cache(tmp_path, threshold=0.95)
+    hit = cache.lookup(key, [0.99, 0.05])
+    assert hit.answer == "answer-a" and hit.sources == [a] and hit.similarity > 0.95
+    assert cache.lookup(key, [0.7, 0.7]) is None  # どちらとも似ていない
+    assert cache.lookup("other-key", [1.0, 0.0]) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_changed_source_invalidates_only_its_answers(tmp_path):
+    cache, db, key, a, _ = make_cache(tmp_path)
+    ingest(db, tmp_path, "a.md", "v2")  # a.md の中身が変わった
+    assert cache.lookup(key, [1.0, 0.0]) is None
+    assert cache.lookup(key, [0.0, 1.0]).answer == "answer-b"
+    assert cache.invalidated == 1 and len(cache) == 1
+
+
+def test_reingest_with_same_content_keeps_answers(tmp_path):
+    cache, db, key, _, _ = make_cache(tmp_path)
+    ingest(db, tmp_path, "a.md", "v1")
+    assert cache.lookup(key, [1.0, 0.0]).answer == "answer-a"
+    assert cache.invalidated == 0
+
+
+def test_changes_while_stopped_are_applied_on_open(tmp_path):
+    cache, db, key, _, _ = make_cache(tmp_path)
+    cache.close()
+    ingest(db, tmp_path, "b.md", "v2")
+    again = AnswerCache(str(tmp_path / "answers.sqlite3"), chroma_path=db)
+    assert again.invalidated == 1
+    assert again.lookup(key, [0.0, 1.0]) is None
+
+
+def test_max_entries_evicts_least_recently_used(tmp_path):
+    cache, _, key, a, _ = make_cache(tmp_path, max_entries=2)
+    cache.lookup(key, [1.0, 0.0])  # answer-a を最近使った
+    cache.put(key, "q3", np.array([0.6, 0.8]), "answer-c", [a])
+    assert cache.evictions == 1 and len(cache) == 2
+    assert cache.lookup(key, [0.0, 1.0]) is None
+    assert cache.lookup(key, [1.0, 0.0]).answer == "answer-a"
@@ -0,0 +1,45 @@
+# tests/test_chat_orchestrator.py
+# 1ターンの組み立て（検索・埋め込み・LLM は偽物。ストリームは消費しない）
+import pytest
+
+from app.core.tokens import estimate_messages_tokens
+from app.core.types import ChatChunk, Message
+from app.services.chat_orchestrator import ChatOrchestrator
+
+RESERVE = 1024
+
+
+class FakeRetriever:
+    def retrieve(self, query, top_k=4):
+        return "資料", ["a.md"]
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = []
+
+    def chat_stream(self, messages, model, options, cancel=None):
+        self.calls.append(options)
+        return iter([ChatChunk(content="ok", done=True)])
+
+
+def long_history(n=10, size=300):
+    history = []
+    for i in range(n):
+        history.append(Message(role="user", content="あ" * size, context="資料"))
+        history.append(Message(role="assistant", content="い" * size))
+    return history
+
+
+@pytest.mark.parametrize("num_predict,reserve", [(None, RESERVE), (-1, RESERVE), (-2, RESERVE), (0, RESERVE), (256, 256)])
+def test_answer_reserve_from_num_predict(num_predict, reserve):
+    llm = FakeLLM()
+    orch = ChatOrchestrator(llm, FakeRetriever(), "sys", num_ctx_buckets=(2048, 4096), answer_reserve=RESERVE)
+    options = {"num_ctx": 4096}
+    if num_predict is not None:
+        options["num_predict"] = num_predict
+    turn = orch.run_stream("質問", long_history(), "m", options)
+    assert turn.meta["history_dropped"] > 0
+    assert estimate_messages_tokens(turn.messages) + reserve <= 4096
+    assert llm.calls[0]["num_ctx"] == 4096
+    assert llm.calls[0].get("num_predict") == num_predict  # Ollama にはそのまま渡す
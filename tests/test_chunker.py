@@ -0,0 +1,92 @@
+# tests/test_chunker.py
+# 構造を考慮したチャンク分割（トークン数は estimate_tokens で数える）
+from app.core.tokens import estimate_tokens
+from app.ingest.chunker import StructuredChunker, iter_blocks, make_token_counter, split_sentences
+
+DOC = """# 概要
+はじめにの段落です。短い説明。
+
+## 手順
+手順の一つ目です。手順の二つ目です。
+
+```python
+def f():
+    return 1
+```
+
+# 付録
+付録の本文。
+"""
+
+
+def chunks(text, target=320, overlap=0, pages=None):
+    chunker = StructuredChunker(estimate_tokens, target_tokens=target, overlap_sentences=overlap)
+    segments = [(text, None)] if pages is None else list(zip(text, pages))
+    return list(chunker.chunk(segments))
+
+
+def test_split_sentences_round_trips():
+    text = "一文目。二文目！ Third one. 四文目？」\n最後"
+    parts = split_sentences(text)
+    assert "".join(parts) == text and len(parts) == 5
+
+
+def test_blocks_keep_heading_path_and_fences():
+    blocks = list(iter_blocks([(DOC, None)]))
+    kinds = [(k, p) for k, _, p, _ in blocks]
+    assert kinds == [
+        ("heading", ("概要",)), ("text", ("概要",)),
+        ("heading", ("概要", "手順")), ("text", ("概要", "手順")), ("code", ("概要", "手順")),
+        ("heading", ("付録",)), ("text", ("付録",)),
+    ]
+    code = [t for k, t, _, _ in blocks if k == "code"][0]
+    assert code.startswith("```python") and code.endswith("```")
+    # 見出し・フェンスを解釈しなければ空行区切りの段落だけ
+    assert [k for k, *_ in iter_blocks([(DOC, None)], markdown=False)] == ["text"] * 4
+
+
+def test_small_document_is_one_chunk():
+    out = chunks(DOC)
+    assert len(out) == 1
+    for part in ("# 概要", "はじめにの段落です。", "## 手順", "```python\ndef f():\n    return 1\n```", "付録の本文。"):
+        assert part in out[0].text
+    assert out[0].heading_path == ""  # 節をまたぐので共通の見出しは無い
+
+
+def test_chunks_stay_within_target():
+    text = "\n\n".join(f"# 節{i}\n" + "本文の文です。" * 12 for i in range(6))
+    out = chunks(text, target=64)
+    assert len(out) > 1
+    assert all(estimate_tokens(c.text) <= 64 + 8 for c in out)
+    assert out[0].heading_path == "節0"
+    assert all(c.heading_path in {"", *(f"節{i}" for i in range(6))} for c in out)  # 節をまたぐと空
+    body = "".join(c.text for c in out)
+    assert body.count("本文の文です。") == 6 * 12  # 重なり無しなら欠けも重複もしない
+    assert not any(c.text.rstrip().splitlines()[-1].startswith("#") for c in out)  # 見出しだけ末尾に残さない
+
+
+def test_long_sentence_is_hard_split():
+    out = chunks("あ" * 200, target=32)
+    assert "".join(c.text for c in out) == "あ" * 200
+    assert all(estimate_tokens(c.text) <= 32 for c in out)
+
+
+def test_overlap_carries_last_sentence():
+    text = "".join(f"文{i:02d}の内容です。" for i in range(20))
+    out = chunks(text, target=32, overlap=1)
+    assert len(out) > 1
+    for prev, nxt in zip(out, out[1:]):
+        assert nxt.text.startswith(split_sentences(prev.text)[-1])
+
+
+def test_page_range():
+    lines = ["一ページ目の文です。" * 3 + "\n\n", "二ページ目の文です。" * 3 + "\n\n", "三ページ目。"]
+    out = chunks("".join(lines), target=320, pages=None)
+    assert out[0].page_start is None
+    out = list(StructuredChunker(estimate_tokens, 320).chunk(zip(lines, [1, 2, 3])))
+    assert (out[0].page_start, out[0].page_end) == (1, 3)
+
+
+def test_token_counter_fallback():
+    count, sig = make_token_counter("")
+    assert count is estimate_tokens and sig == "est"
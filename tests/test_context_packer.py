@@ -0,0 +1,65 @@
+# tests/test_context_packer.py
+# 検索結果 → コンテキストの組み立て（連続チャンクの結合・重複除去・トークン予算）
+from app.core.context_packer import SEPARATOR, merge_adjacent, pack_context, strip_overlap
+from app.core.tokens import estimate_tokens
+from app.core.types import RetrievalHit
+
+
+def hit(source, idx, text, score):
+    return RetrievalHit(text=text, source=source, score=score, chunk_index=idx)
+
+
+def test_strip_overlap():
+    assert strip_overlap("前のチャンクの末尾にある重なった文です", "末尾にある重なった文です。続きの文") == "。続きの文"
+    assert strip_overlap("短い重なり", "重なり。続き") == "重なり。続き"  # min_overlap 未満は削らない
+    assert strip_overlap("abc", "xyz") == "xyz"
+
+
+def test_merge_adjacent_chunks():
+    hits = [
+        hit("a.md", 2, "二番目の段落の終わりの部分。三番目の段落の頭", 0.7),
+        hit("a.md", 1, "一番目の段落。二番目の段落の終わりの部分。", 0.9),
+        hit("a.md", 1, "一番目の段落。二番目の段落の終わりの部分。", 0.9),  # 同じチャンクの重複ヒット
+        hit("a.md", 5, "離れたチャンク", 0.5),
+        RetrievalHit(text="番号なし", source="b.pdf", score=0.4),
+    ]
+    merged = merge_adjacent(hits)
+    runs = {(p.source, p.chunk_start, p.chunk_end): p for p in merged}
+    assert set(runs) == {("a.md", 1, 2), ("a.md", 5, 5), ("b.pdf", None, None)}
+    assert runs[("a.md", 1, 2)].text == "一番目の段落。二番目の段落の終わりの部分。三番目の段落の頭"
+    assert runs[("a.md", 1, 2)].score == 0.9
+
+
+def test_near_duplicates_are_dropped():
+    text = "同じ内容の段落が別のファイルにもコピーされて入っている。検索では両方が上位に来るが、資料としては一つで足りる。"
+    hits = [hit("a.md", 0, text, 0.9), hit("copy.md", 0, text + "末尾だけ違う", 0.8), hit("c.md", 0, "別の話題", 0.5)]
+    context, chosen, stats = pack_context(hits, token_budget=10_000)
+    assert [p.source for p in chosen] == ["a.md", "c.md"]
+    assert stats["dropped_duplicate"] == 1
+    assert context.startswith("[1] 出典: a.md\n") and "[2] 出典: c.md\n別の話題" in context
+    assert context.count(SEPARATOR) == 1
+
+
+def test_budget_skips_large_and_keeps_smaller():
+    hits = [hit("a.md", 0, "あ" * 50, 0.9), hit("b.md", 0, "い" * 200, 0.8), hit("c.md", 0, "う" * 20, 0.7)]
+    context, chosen, stats = pack_context(hits, token_budget=120)
+    assert [p.source for p in chosen] == ["a.md", "c.md"]
+    assert stats["dropped_budget"] == 1
+    assert estimate_tokens(context) <= 120
+
+
+def test_top_passage_is_truncated_to_fit():
+    context, chosen, stats = pack_context([hit("a.md", 0, "あ" * 500, 0.9)], token_budget=100)
+    assert len(chosen) == 1 and 0 < len(chosen[0].text) < 500
+    assert estimate_tokens(context) <= 100
+
+
+def test_max_passages_and_heading():
+    hits = [
+        RetrievalHit(text=f"段落{i}", source=f"{i}.md", score=1 - i / 10, chunk_index=0,
+                     metadata={"heading_path": "概要 > 手順"})
+        for i in range(5)
+    ]
+    context, chosen, _ = pack_context(hits, token_budget=10_000, max_passages=2)
+    assert [p.source for p in chosen] == ["0.md", "1.md"]
+    assert context.startswith("[1] 出典: 0.md（概要 > 手順）\n段落0")
@@ -0,0 +1,102 @@
+# tests/test_embedding_cache.py
+# 埋め込みキャッシュ：命中・LRU の追い出し・容量変更・encode_with_cache がミス分だけ埋め込むこと
+import time
+
+import numpy as np
+import pytest
+
+from app.adapters.embeddings.embedding_cache import EmbeddingCache, embed_signature, encode_with_cache
+
+MODEL = "intfloat/multilingual-e5-small"
+
+
+def vec(i, dim=4):
+    return np.eye(dim, dtype=np.float32)[i]
+
+
+def test_hit_and_miss(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, max_entries=4)
+    assert cache.get_many("passage: ", ["a"]) == [None]  # まだファイルも無い
+    cache.put_many("passage: ", ["a", "b"], [vec(0), vec(1)])
+    a, b, c = cache.get_many("passage: ", ["a", "b", "c"])
+    assert np.array_equal(a, vec(0)) and np.array_equal(b, vec(1)) and c is None
+    assert cache.get_many("query: ", ["a"]) == [None]  # prefix が違えば別のキー
+    assert cache.stats()["hits"] == 2 and len(cache) == 2
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, max_entries=2)
+    cache.put_many("", ["a", "b"], [vec(0), vec(1)])
+    time.sleep(0.01)  # used はミリ秒
+    cache.get_many("", ["a"])  # a を最近使ったことにする
+    time.sleep(0.01)
+    cache.put_many("", ["c"], [vec(2)])
+
+    a, b, c = cache.get_many("", ["a", "b", "c"])
+    assert b is None
+    assert np.array_equal(a, vec(0)) and np.array_equal(c, vec(2))  # b のスロットを c が使う
+    assert cache.evictions == 1 and len(cache) == 2
+
+
+def test_oversized_batch_keeps_the_tail(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, max_entries=2)
+    cache.put_many("", ["a", "b", "c"], [vec(0), vec(1), vec(2)])
+    assert [v is not None for v in cache.get_many("", ["a", "b", "c"])] == [False, True, True]
+
+
+def test_reopen_and_capacity_change(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, max_entries=2)
+    cache.put_many("", ["a"], [vec(0)])
+    cache.close()
+
+    again = EmbeddingCache(str(tmp_path), MODEL, max_entries=2)
+    assert np.array_equal(again.get_many("", ["a"])[0], vec(0))
+    again.close()
+
+    resized = EmbeddingCache(str(tmp_path), MODEL, max_entries=3)  # スロット配置が変わるので空から
+    assert resized.get_many("", ["a"]) == [None] and len(resized) == 0
+
+
+def test_second_instance_does_not_truncate_shared_file(tmp_path):
+    # 両方とも空の状態で開いたあと、片方（別プロセス相当）が先にファイルを作って書く
+    first = EmbeddingCache(str(tmp_path), MODEL, max_entries=4)
+    second = EmbeddingCache(str(tmp_path), MODEL, max_entries=4)
+    second.put_many("", ["a"], [vec(0)])
+    first.put_many("", ["b"], [vec(1)])  # 作り直さずに既存ファイルへ書く
+    for cache in (first, second, EmbeddingCache(str(tmp_path), MODEL, max_entries=4)):
+        a, b = cache.get_many("", ["a", "b"])
+        assert np.array_equal(a, vec(0)) and np.array_equal(b, vec(1))
+
+
+def test_reader_picks_up_file_created_later(tmp_path):
+    reader = EmbeddingCache(str(tmp_path), MODEL, max_entries=4)
+    EmbeddingCache(str(tmp_path), MODEL, max_entries=4).put_many("", ["a"], [vec(0)])
+    assert np.array_equal(reader.get_many("", ["a"])[0], vec(0))
+
+
+def test_dim_mismatch(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, max_entries=2)
+    cache.put_many("", ["a"], [vec(0)])
+    with pytest.raises(ValueError):
+        cache.put_many("", ["b"], [np.zeros(8, dtype=np.float32)])
+
+
+def test_encode_with_cache_only_encodes_misses(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), MODEL, max_entries=8)
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return np.stack([vec(len(t) % 4) for t in texts])
+
+    out = encode_with_cache(cache, "p:", ["x", "yy", "x"], encode)
+    assert calls == [["p:x", "p:yy"]]  # 同じ本文は1回
+    out2 = encode_with_cache(cache, "p:", ["yy", "zzz"], encode)
+    assert calls[1:] == [["p:zzz"]]
+    assert np.array_equal(out[1], out2[0]) and out.shape == (3, 4)
+    assert encode_with_cache(None, "p:", ["x"], encode).shape == (1, 4)
+
+
+def test_embed_signature():
+    assert embed_signature(MODEL) == MODEL
+    assert embed_signature(MODEL, "onnx") == f"{MODEL}@onnx"
@@ -0,0 +1,92 @@
+# tests/test_ingest_stream.py
+# 巨大ファイルの逐次読み込み：固定長の窓（INGEST_CHUNKER=chars）が全文一括の分割と同じになること・ページ番号
+import random
+
+import pytest
+
+import ingest
+from ingest import chunk_metadata, iter_chunks, iter_pdf_pages, iter_txt_segments, peek_head
+
+
+def split_text(text, size, overlap):
+    """逐次化する前の全文一括の分割（比較用）"""
+    chunks, i, step = [], 0, max(1, size - overlap)
+    while i < len(text):
+        chunks.append(text[i:i + size])
+        i += step
+    return chunks
+
+
+def cut(text, rng, max_len):
+    """ランダムな長さ（空を含む）のセグメントに切る"""
+    out, i = [], 0
+    while i < len(text):
+        n = rng.randint(0, max_len)
+        out.append(text[i:i + n])
+        i += n
+    return out
+
+
+@pytest.mark.parametrize("size,overlap", [(500, 50), (100, 0), (10, 9), (7, 20)])
+def test_iter_chunks_matches_split_text(size, overlap):
+    rng = random.Random(size * 31 + overlap)
+    text = "".join(rng.choice("あいうえおabc \n。") for _ in range(3000))
+    for max_len in (1, 37, 499, 5000):
+        segs = [(s, None) for s in cut(text, rng, max_len)]
+        chunks = list(iter_chunks(segs, size, overlap))
+        assert [c.text for c in chunks] == split_text(text, size, overlap)
+        assert all(c.page_start is None and c.page_end is None for c in chunks)
+    assert list(iter_chunks([], size, overlap)) == []
+
+
+def test_page_numbers_across_page_boundaries():
+    pages = ["一" * 120, "\n" + "二" * 39, "\n" + "三" * 200]
+    text = "".join(pages)
+    starts = [sum(len(p) for p in pages[:k]) for k in range(len(pages))]
+
+    def page_of(off):
+        return max(k + 1 for k, s in enumerate(starts) if s <= off)
+
+    chunks = list(iter_chunks([(p, no) for no, p in enumerate(pages, 1)], 100, 30))
+    assert [c.text for c in chunks] == split_text(text, 100, 30)
+    for n, c in enumerate(chunks):
+        i = n * 70
+        assert (c.page_start, c.page_end) == (page_of(i), page_of(i + len(c.text) - 1))
+    spans = {(c.page_start, c.page_end) for c in chunks}
+    assert spans == {(1, 1), (1, 3), (2, 3), (3, 3)}  # 2ページ目は窓より短いので3ページにまたがる
+
+    meta = chunk_metadata({"source": "x.pdf"}, 1, chunks[1])
+    assert (meta["page"], meta["page_end"], meta["chunk_index"]) == (1, 3, 1)
+    assert "page" not in chunk_metadata({"source": "x.txt"}, 0, iter_chunks([("abc", None)], 10, 0).__next__())
+
+
+def test_txt_segments_and_peek_head(tmp_path):
+    path = tmp_path / "a.md"
+    text = "".join(f"{i}行目\n" for i in range(100))
+    path.write_text(text, encoding="utf-8")
+    segs = list(iter_txt_segments(str(path), seg_chars=64))
+    assert "".join(t for t, _ in segs) == text and max(len(t) for t, _ in segs) == 64
+
+    head, rest = peek_head(iter_txt_segments(str(path), seg_chars=64), lines=30)
+    assert head.count("\n") >= 30 and text.startswith(head) and len(head) < len(text)
+    assert "".join(t for t, _ in rest) == text  # 先読みした分も戻っている
+
+
+class FakePage:
+    def __init__(self, text):
+        self.text = text
+
+    def extract_text(self):
+        return self.text
+
+
+def test_pdf_pages_are_numbered_and_newline_separated(monkeypatch):
+    pages = [FakePage("p1"), FakePage(None), FakePage("p3")]
+    monkeypatch.setattr(ingest, "PdfReader", lambda path: type("R", (), {"pages": pages})())
+    assert list(iter_pdf_pages("x.pdf")) == [("p1", 1), ("\n", 2), ("\np3", 3)]
+
+    def broken(path):
+        raise ValueError("broken pdf")
+
+    monkeypatch.setattr(ingest, "PdfReader", broken)
+    assert list(iter_pdf_pages("x.pdf")) == []
@@ -0,0 +1,25 @@
+# tests/test_lazy_imports.py
+# 重い依存（torch / sentence_transformers / chromadb）はアダプタを import しただけでは読み込まない
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "app.adapters.embeddings.sbert_embedder",
+    "app.adapters.rag.chroma_retriever",
+    "app.adapters.rag.numpy_store",
+    "app.registry.providers",
+]
+HEAVY = ["torch", "sentence_transformers", "chromadb"]
+
+
+def test_adapters_import_without_heavy_deps():
+    code = (
+        "import sys\n"
+        + "".join(f"import {m}\n" for m in MODULES)
+        + f"print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT)
+    assert out.stdout.strip() == ""
@@ -0,0 +1,78 @@
+# tests/test_manifest.py
+# インジェスト・マニフェストの差分判定（変更なし / 中身は同じ / 変更あり / 削除）と保存
+import os
+import json
+
+from app.ingest.manifest import MANIFEST_VERSION, IngestManifest, file_sha1, manifest_path
+
+EMBED = "intfloat/multilingual-e5-small"
+CHUNKING = "structured:320:0:est"
+
+
+def write(path, text, mtime_ns=None):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return os.stat(path)
+
+
+def make_manifest(tmp_path):
+    doc = str(tmp_path / "a.md")
+    st = write(doc, "本文", mtime_ns=1_000_000_000)
+    m = IngestManifest(manifest_path(str(tmp_path / "db")))
+    m.update(doc, st, file_sha1(doc), 3, EMBED, CHUNKING)
+    return m, doc, st
+
+
+def test_unchanged_only_when_stat_and_settings_match(tmp_path):
+    m, doc, st = make_manifest(tmp_path)
+    assert m.is_unchanged(doc, st, EMBED, CHUNKING)
+    assert not m.is_unchanged(doc, st, "other-model", CHUNKING)
+    assert not m.is_unchanged(doc, st, EMBED, "structured:512:0:est")
+    assert not m.is_unchanged(str(tmp_path / "new.md"), st, EMBED, CHUNKING)
+
+    st2 = write(doc, "本文を追記", mtime_ns=2_000_000_000)
+    assert not m.is_unchanged(doc, st2, EMBED, CHUNKING)
+
+
+def test_known_hash_skips_parse_after_touch(tmp_path):
+    m, doc, st = make_manifest(tmp_path)
+    st2 = write(doc, "本文", mtime_ns=2_000_000_000)  # touch 相当（中身は同じ）
+    assert not m.is_unchanged(doc, st2, EMBED, CHUNKING)
+    assert m.known_hash(doc, EMBED, CHUNKING) == file_sha1(doc)
+    assert m.known_hash(doc, "other-model", CHUNKING) is None
+
+    m.touch(doc, st2)
+    assert m.is_unchanged(doc, st2, EMBED, CHUNKING)
+    assert m.get(doc)["chunks"] == 3
+
+
+def test_remove_and_paths(tmp_path):
+    m, doc, _ = make_manifest(tmp_path)
+    assert list(m.paths()) == [doc] and len(m) == 1
+    m.remove(doc)
+    m.remove(doc)  # 無いものを消しても落ちない
+    assert len(m) == 0 and m.get(doc) is None
+
+
+def test_save_and_reload(tmp_path):
+    m, doc, st = make_manifest(tmp_path)
+    m.save()
+    assert os.path.basename(m.path) == "ingest_manifest.json"
+    assert [n for n in os.listdir(os.path.dirname(m.path)) if n.startswith(".manifest-")] == []
+
+    again = IngestManifest(m.path)
+    assert again.entries == m.entries
+    assert again.is_unchanged(doc, st, EMBED, CHUNKING)
+
+
+def test_other_version_or_broken_file_means_full_ingest(tmp_path):
+    path = manifest_path(str(tmp_path))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION + 1, "files": {"x": {}}}, f)
+    assert len(IngestManifest(path)) == 0
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{broken")
+    assert len(IngestManifest(path)) == 0
@@ -0,0 +1,131 @@
+# tests/test_numpy_store.py
+# NumpyVectorStore の追加・削除・更新・詰め直し（chromadb / 埋め込みモデルは不要）
+import numpy as np
+import pytest
+
+from app.adapters.rag.numpy_store import NumpyVectorStore
+
+
+def make_store(tmp_path, n=5, dim=8, dtype="float16"):
+    rng = np.random.default_rng(0)
+    embs = rng.standard_normal((n, dim)).astype(np.float32)
+    store = NumpyVectorStore(str(tmp_path / "store"), dtype=dtype)
+    store.add(
+        ids=[f"id{i}" for i in range(n)],
+        documents=[f"doc {i}" for i in range(n)],
+        metadatas=[{"source": f"s{i % 2}", "chunk_index": i} for i in range(n)],
+        embeddings=embs,
+    )
+    return store, embs
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_query_returns_nearest(tmp_path, dtype):
+    store, embs = make_store(tmp_path, dtype=dtype)
+    res = store.query(query_embeddings=[embs[3]], n_results=2)
+    assert res["ids"][0][0] == "id3"
+    assert res["distances"][0][0] == pytest.approx(0.0, abs=1e-2)
+    assert res["metadatas"][0][0]["chunk_index"] == 3
+
+
+def test_delete_by_id_hides_rows_from_query(tmp_path):
+    store, embs = make_store(tmp_path)
+    store.query(query_embeddings=[embs[0]], n_results=5)  # 削除前に memmap と _alive を作らせる
+    store.delete(ids=["id0", "id2", "id4"])
+    assert store.count() == 2
+    res = store.query(query_embeddings=[embs[0]], n_results=5)
+    assert sorted(res["ids"][0]) == ["id1", "id3"]
+
+
+def test_delete_by_where_hides_rows_from_query(tmp_path):
+    store, embs = make_store(tmp_path)
+    store.query(query_embeddings=[embs[0]], n_results=5)
+    store.delete(where={"source": "s0"})
+    res = store.query(query_embeddings=[embs[0]], n_results=5)
+    assert sorted(res["ids"][0]) == ["id1", "id3"]
+
+
+def test_stale_mask_never_returns_tombstones(tmp_path):
+    store, embs = make_store(tmp_path)
+    store.query(query_embeddings=[embs[0]], n_results=5)
+    # 別の書き手が sqlite だけを書き換えた状態（_alive は古いまま）
+    store._db.execute("UPDATE chunks SET alive=0 WHERE id='id0'")
+    store._db.commit()
+    res = store.query(query_embeddings=[embs[0]], n_results=5)
+    assert "id0" not in res["ids"][0]
+
+
+def test_upsert_replaces_existing_id(tmp_path):
+    store, embs = make_store(tmp_path)
+    store.upsert(ids=["id1"], documents=["new"], metadatas=[{"source": "s1"}], embeddings=[embs[4]])
+    assert store.count() == 5
+    res = store.query(query_embeddings=[embs[4]], n_results=2)
+    assert set(res["ids"][0]) == {"id1", "id4"}
+    assert store.get(ids=["id1"])["documents"] == ["new"]
+
+
+def test_update_changes_metadata_and_where(tmp_path):
+    store, embs = make_store(tmp_path)
+    store.update(ids=["id0"], metadatas=[{"source": "moved", "chunk_index": 0}])
+    res = store.query(query_embeddings=[embs[0]], n_results=5, where={"source": "moved"})
+    assert res["ids"][0] == ["id0"]
+
+
+def test_where_in_and_subset_scoring(tmp_path):
+    store, embs = make_store(tmp_path, n=20)
+    res = store.query(query_embeddings=[embs[2]], n_results=3, where={"source": {"$in": ["s0"]}})
+    assert res["ids"][0][0] == "id2"
+    assert all(m["source"] == "s0" for m in res["metadatas"][0])
+
+
+def test_compact_keeps_live_rows(tmp_path):
+    store, embs = make_store(tmp_path)
+    store.delete(ids=["id0", "id1", "id2"])
+    assert store.dead_ratio() == pytest.approx(0.6)
+    assert store.maybe_compact() == 3
+    assert store.rows == 2 and store.count() == 2
+    res = store.query(query_embeddings=[embs[4]], n_results=5)
+    assert res["ids"][0][0] == "id4" and sorted(res["ids"][0]) == ["id3", "id4"]
+    got = store.get(ids=["id3"], include=["embeddings"])
+    assert np.allclose(got["embeddings"][0], embs[3] / np.linalg.norm(embs[3]), atol=1e-2)
+
+
+def test_reopen_persists(tmp_path):
+    store, embs = make_store(tmp_path)
+    store.delete(ids=["id1"])
+    store.close()
+    again = NumpyVectorStore(str(tmp_path / "store"))
+    assert again.count() == 4
+    assert again.query(query_embeddings=[embs[1]], n_results=5)["ids"][0].count("id1") == 0
+
+
+def test_dimension_mismatch(tmp_path):
+    store, _ = make_store(tmp_path)
+    with pytest.raises(ValueError):
+        store.query(query_embeddings=[np.ones(4, dtype=np.float32)], n_results=1)
+
+
+def test_rows_appended_by_another_writer(tmp_path):
+    store, embs = make_store(tmp_path)
+    store.query(query_embeddings=[embs[0]], n_results=5)
+    other = NumpyVectorStore(str(tmp_path / "store"))
+    other.add(ids=["new"], documents=["new"], metadatas=[{"source": "s0"}], embeddings=[embs[0]])
+    # 別インスタンス（別プロセスの ingest.py 相当）の追記も、次の検索で読み直して見える
+    res = store.query(query_embeddings=[embs[0]], n_results=2, where={"source": "s0"})
+    assert set(res["ids"][0]) == {"id0", "new"}
+
+
+def test_compaction_by_another_writer_to_same_row_count(tmp_path):
+    store, embs = make_store(tmp_path, n=10)
+    assert store.query(query_embeddings=[embs[9]], n_results=1)["ids"][0] == ["id9"]
+    other = NumpyVectorStore(str(tmp_path / "store"))
+    rng = np.random.default_rng(1)
+    new = rng.standard_normal((3, 8)).astype(np.float32)
+    other.add(ids=["b0", "b1", "b2"], documents=["b0", "b1", "b2"],
+              metadatas=[{"source": "b"}] * 3, embeddings=new)
+    other.delete(ids=["id0", "id1", "id2"])
+    other.compact()  # 行数は 10 のまま、pos だけが振り直される
+    assert other.rows == store.rows == 10
+    for q, want in [(embs[9], "id9"), (embs[3], "id3"), (new[0], "b0"), (new[2], "b2")]:
+        assert store.query(query_embeddings=[q], n_results=1)["ids"][0] == [want]
+    assert store.query(query_embeddings=[embs[0]], n_results=10)["ids"][0].count("id0") == 0
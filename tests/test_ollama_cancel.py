@@ -0,0 +1,70 @@
+# tests/test_ollama_cancel.py
+# 生成の中断（スタブ Ollama 相手。トークン間隔が長くても cancel() ですぐ止まる。プールの空き待ちも同様）
+import asyncio
+import threading
+import time
+
+from bench.fake_ollama import FakeOllama
+from app.adapters.providers.ollama_client import CANCELLED_MSG, OllamaClient
+from app.adapters.providers.ollama_pool import OllamaPool
+from app.core.types import CancelToken, Message
+
+GAP_S = 2.0  # トークン間隔（これより早く終われば、次のトークンを待たずに止まっている）
+
+
+def run_cancelled(stream_fn):
+    fake = FakeOllama(gen_tps=1 / GAP_S).start()
+    client = OllamaClient(fake.url)
+    token = CancelToken()
+    try:
+        return stream_fn(client, fake.models[0], token)
+    finally:
+        client.close()
+        fake.stop()
+
+
+def test_async_cancel_between_tokens():
+    async def consume(client, model, token):
+        chunks, t_cancel = [], None
+        async for ch in client.chat_stream_async([Message(role="user", content="hi")], model,
+                                                 {"num_predict": 20}, cancel=token):
+            chunks.append(ch)
+            if t_cancel is None:
+                t_cancel = time.perf_counter()
+                threading.Timer(0.2, token.cancel).start()  # 別スレッド（UI）からの中断
+        await client.aclose()
+        return chunks, time.perf_counter() - t_cancel
+
+    chunks, dt = run_cancelled(lambda c, m, t: asyncio.run(consume(c, m, t)))
+    assert chunks[-1].error == "cancelled" and chunks[-1].content == CANCELLED_MSG
+    assert not any(ch.error not in (None, "cancelled") for ch in chunks)
+    assert dt < GAP_S / 2
+
+
+
+def full_pool():
+    """枠が1つだけで、その枠が使用中のプール（待ち行列に入る）"""
+    pool = OllamaPool(["http://127.0.0.1:9"], max_inflight_per_backend=1, wait_timeout=GAP_S * 5,
+                      health_interval=0)
+    assert pool._acquire() is not None
+    return pool
+
+
+def test_cancel_while_waiting_for_a_slot():
+    pool = full_pool()
+    token = CancelToken()
+    threading.Timer(0.2, token.cancel).start()
+    t0 = time.perf_counter()
+    chunks = list(pool.chat_stream([Message(role="user", content="hi")], "m", {}, cancel=token))
+    assert time.perf_counter() - t0 < GAP_S / 2
+    assert [(c.error, c.content) for c in chunks] == [("cancelled", CANCELLED_MSG)]
+    assert pool.stats()["waiting"] == 0 and pool.cancelled == 1 and pool.timed_out == 0
+
+    # 既にキャンセル済みなら待たない（async 版も同じ）
+    async def consume():
+        return [c async for c in pool.chat_stream_async([Message(role="user", content="hi")], "m", {},
+                                                        cancel=token)]
+    t0 = time.perf_counter()
+    assert [c.error for c in asyncio.run(consume())] == ["cancelled"]
+    assert time.perf_counter() - t0 < GAP_S / 2
+    pool.close()
@@ -0,0 +1,51 @@
+# tests/test_prompts.py
+# メッセージ列の組み立てと num_ctx の選択（ChatOrchestrator と app.py で共通の関数）
+from app.core.prompts import build_messages, build_user_turn, fit_messages
+from app.core.tokens import estimate_messages_tokens
+from app.core.types import Message
+
+BUCKETS = (2048, 4096, 8192)
+
+
+def turns(n, size=300):
+    history = []
+    for i in range(n):
+        history.append(Message(role="user", content=f"質問{i}" + "あ" * size, context=f"資料{i}"))
+        history.append(Message(role="assistant", content=f"回答{i}" + "い" * size))
+    return history
+
+
+def test_stable_layout_keeps_prefix_across_turns():
+    history = turns(2)
+    first = build_messages("sys", "次の質問", history[:2], "資料X")
+    second = build_messages("sys", "さらに次", history + [Message(role="system", content="無視される")], "資料Y")
+    assert [m.to_api() for m in first[:-1]] == [m.to_api() for m in second[:3]]
+    assert second[1].content == build_user_turn(history[0].content, "資料0")
+    assert second[-1].content.endswith("# 質問\nさらに次") and "資料Y" in second[-1].content
+    assert all(m.role != "system" for m in second[1:])
+
+
+def test_legacy_layout_puts_context_in_system():
+    msgs = build_messages("sys", "質問", [], "資料", layout="legacy")
+    assert [m.role for m in msgs] == ["system", "user"]
+    assert "資料" in msgs[0].content and msgs[1].content == "質問"
+
+
+def test_fit_picks_smallest_bucket():
+    msgs, num_ctx, stats = fit_messages("sys", "質問", turns(1), "資料", BUCKETS, reserve=1024)
+    assert num_ctx == 2048 and stats["history_dropped"] == 0
+    assert stats["prompt_tokens"] == estimate_messages_tokens(msgs)
+
+
+def test_fit_drops_oldest_round_trips_under_cap():
+    history = turns(10)
+    msgs, num_ctx, stats = fit_messages("sys", "質問", history, "資料", BUCKETS, reserve=1024, max_num_ctx=4096)
+    assert num_ctx == 4096 and stats["history_dropped"] % 2 == 0 and stats["history_dropped"] > 0
+    assert stats["prompt_tokens"] + 1024 <= 4096
+    kept = history[stats["history_dropped"]:]
+    assert msgs[1].content == build_user_turn(kept[0].content, kept[0].context)  # 往復の途中から始めない
+
+
+def test_fit_with_cap_below_every_bucket():
+    _, num_ctx, _ = fit_messages("sys", "質問", [], "", BUCKETS, reserve=256, max_num_ctx=1024)
+    assert num_ctx == 1024
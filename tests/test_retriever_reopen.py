@@ -0,0 +1,165 @@
+# tests/test_retriever_reopen.py
+# 世代が進んだときの開き直し（NumpyRetriever と、偽の chromadb を使った ChromaRetriever。埋め込みは固定のベクトルを返す偽物）
+import sys
+import time
+import types
+import threading
+
+import numpy as np
+
+from app.adapters.rag.chroma_retriever import ChromaRetriever
+from app.adapters.rag.generation import bump_generation
+from app.adapters.rag.numpy_store import NumpyRetriever, NumpyVectorStore, numpy_store_path
+
+DIM = 8
+
+
+class FakeEmbedder:
+    def embed_query(self, text):
+        v = np.zeros(DIM, dtype=np.float32)
+        v[int(text) % DIM] = 1.0
+        return v.tolist()
+
+
+def write(path, ids, axes):
+    store = NumpyVectorStore(numpy_store_path(path))
+    embs = np.eye(DIM, dtype=np.float32)[axes]
+    store.add(ids=ids, documents=ids, metadatas=[{"source": i} for i in ids], embeddings=embs)
+    store.close()
+
+
+def make_retriever(tmp_path):
+    path = str(tmp_path / "db")
+    write(path, ["a"], [0])
+    return path, NumpyRetriever(path=path, embedder=FakeEmbedder(), result_cache_size=16)
+
+
+def test_reopen_after_generation_bump(tmp_path):
+    path, r = make_retriever(tmp_path)
+    assert r.retrieve_many(["1"], top_k=2)[0][0].id == "a"
+    write(path, ["b"], [1])  # 別プロセスの ingest.py 相当
+    bump_generation(path)
+    assert [h.id for h in r.retrieve_many(["1"], top_k=1)[0]] == ["b"]
+
+
+def test_borrowed_store_outlives_reopen(tmp_path):
+    path, r = make_retriever(tmp_path)
+    with r._borrow() as old:
+        write(path, ["b"], [1])
+        bump_generation(path)
+        r.retrieve_many(["1"], top_k=1)  # 別のセッションが開き直す
+        assert r.stores is not old and old.retired
+        assert old.col.query(query_embeddings=[np.eye(DIM)[0]], n_results=1)["ids"][0] == ["a"]
+    assert old.users == 0  # 返したあとで閉じられる
+    assert r.stores.col.count() == 2
+
+
+def test_concurrent_queries_during_reopen(tmp_path):
+    path, r = make_retriever(tmp_path)
+    errors = []
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                r.retrieve_many(["0"], top_k=1)
+            except Exception as e:  # 閉じたストアを使うと sqlite3.ProgrammingError
+                errors.append(e)
+                return
+            time.sleep(0.001)  # 読み手が共有ロックを握り続けると書き手（sqlite）が待たされる
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for n in range(20):
+        write(path, [f"x{n}"], [2])
+        bump_generation(path)
+        r.retrieve_many(["2"], top_k=1)
+    stop.set()
+    for t in threads:
+        t.join()
+    assert not errors
+
+
+def test_result_cache_cleared_on_generation_bump(tmp_path):
+    path, r = make_retriever(tmp_path)
+    assert r.retrieve("1", top_k=1)[1] == ["a"]
+    assert r.retrieve("1", top_k=1)[1] == ["a"]
+    assert r.result_cache.stats()["hits"] == 1
+
+    write(path, ["b"], [1])
+    assert r.retrieve("1", top_k=1)[1] == ["a"]  # 世代が同じ間はキャッシュを返す
+    bump_generation(path)
+    assert r.retrieve("1", top_k=1)[1] == ["b"]
+    assert r.result_cache.stats()["size"] == 1
+
+
+class FakeSystem:
+    """chromadb.config.System の代わり（開始・停止だけ記録する）"""
+    started = []
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.running = False
+        FakeSystem.started.append(self)
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+
+class FakeCollection:
+    def __init__(self, system):
+        self.system = system
+
+    def query(self, query_embeddings, n_results, where=None, include=None):
+        assert self.system.running  # 止めたシステムでは検索しない
+        n = FakeSystem.started.index(self.system)
+        return {"ids": [[f"c{n}"]], "documents": [[f"gen{n}"]], "metadatas": [[{"source": f"s{n}"}]],
+                "distances": [[0.0]]}
+
+
+class FakeClient:
+    def __init__(self, system):
+        self.system = system
+
+    @classmethod
+    def from_system(cls, system):
+        return cls(system)
+
+    def get_or_create_collection(self, name, metadata=None):
+        return FakeCollection(self.system)
+
+
+def fake_chromadb(monkeypatch):
+    FakeSystem.started = []
+    config = types.ModuleType("chromadb.config")
+    config.Settings = lambda **kw: kw
+    config.System = FakeSystem
+    client = types.ModuleType("chromadb.api.client")  # SharedSystemClient は置かない（使わないこと）
+    client.Client = FakeClient
+    for name, mod in {"chromadb": types.ModuleType("chromadb"), "chromadb.api": types.ModuleType("chromadb.api"),
+                      "chromadb.api.client": client, "chromadb.config": config}.items():
+        monkeypatch.setitem(sys.modules, name, mod)
+
+
+def test_chroma_stops_old_system_after_last_borrower(tmp_path, monkeypatch):
+    fake_chromadb(monkeypatch)
+    path = str(tmp_path / "db")
+    r = ChromaRetriever(path=path, embedder=FakeEmbedder(), result_cache_size=0)
+    first = r.stores.system
+    assert first.running and first.settings == {"is_persistent": True, "persist_directory": path}
+
+    with r._borrow() as old:
+        bump_generation(path)
+        assert r.retrieve("1", top_k=1) == ("[1] 出典: s1\ngen1", ["s1"])  # 新しいシステムで検索
+        assert old.system is first and first.running  # 借りている間は止めない
+        assert old.col.query([[1.0]], 1)["documents"] == [["gen0"]]
+    assert not first.running and r.stores.system.running
+
+    for _ in range(3):  # --watch で世代が何度進んでも、動いているシステムは1つだけ
+        bump_generation(path)
+        r.retrieve("1", top_k=1)
+    assert [s.running for s in FakeSystem.started] == [False] * 4 + [True]
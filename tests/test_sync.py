@@ -0,0 +1,49 @@
+# tests/test_sync.py
+# --sync の突き合わせ：内容から決まるチャンク id と、ディスクに無い出典（孤児）の回収
+import numpy as np
+
+from app.adapters.rag.numpy_store import NumpyVectorStore
+from app.ingest.sync import chunk_id, clean_metadata, existing_chunks, find_orphans
+
+
+def test_chunk_id_depends_on_content_only():
+    seen = {}
+    a = chunk_id("/d/a.md", "同じ本文", seen)
+    b = chunk_id("/d/a.md", "同じ本文", seen)
+    c = chunk_id("/d/a.md", "別の本文", seen)
+    assert a.startswith("/d/a.md#") and b == a + "-1" and c not in (a, b)
+    assert chunk_id("/d/a.md", "同じ本文", {}) == a  # 次のインジェストでも同じ id
+    assert chunk_id("/d/b.md", "同じ本文", {}) != a
+
+
+def test_clean_metadata_drops_none():
+    assert clean_metadata({"source": "x", "page": None, "chunk_index": 0}) == {"source": "x", "chunk_index": 0}
+
+
+def make_store(tmp_path, sources):
+    store = NumpyVectorStore(str(tmp_path / "store"))
+    ids = [f"{s}#{i}" for i, s in enumerate(sources)]
+    store.add(
+        ids=ids,
+        documents=ids,
+        metadatas=[{"source": s} for s in sources],
+        embeddings=np.eye(len(sources), dtype=np.float32),
+    )
+    return store, ids
+
+
+def test_find_orphans_pages_through_collection(tmp_path):
+    sources = ["/d/a.md", "/d/gone.md", "/d/a.md", "/d/gone.md", "/d/old.md"]
+    store, ids = make_store(tmp_path, sources)
+    orphans = find_orphans(store, ["/d/a.md", "/d/new.md"], page_size=2)
+    assert orphans == {"/d/gone.md": [ids[1], ids[3]], "/d/old.md": [ids[4]]}
+
+    store.delete(ids=[i for chunk_ids in orphans.values() for i in chunk_ids])
+    assert find_orphans(store, ["/d/a.md"], page_size=2) == {}
+    assert sorted(existing_chunks(store, "/d/a.md")) == [ids[0], ids[2]]
+    assert store.count() == 2
+
+
+def test_find_orphans_with_nothing_on_disk(tmp_path):
+    store, ids = make_store(tmp_path, ["/d/a.md", "/d/b.md"])
+    assert find_orphans(store, []) == {"/d/a.md": [ids[0]], "/d/b.md": [ids[1]]}
@@ -0,0 +1,32 @@
+# tests/test_ttl_cache.py
+# LRU + TTL キャッシュ（ヒット率つき）
+import time
+
+from app.adapters.cache.ttl_cache import StatsTTLCache
+
+
+def test_get_or_compute_counts_hits():
+    cache = StatsTTLCache(maxsize=4, ttl=60)
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_compute("k", lambda: calls.append(1) or "v") == "v"
+    assert len(calls) == 1
+    assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 0.6667, "size": 1, "maxsize": 4}
+
+
+def test_lru_and_ttl_expiry():
+    cache = StatsTTLCache(maxsize=2, ttl=0.05)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)  # 最近使っていない b が落ちる
+    assert cache.get("b") is None and cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.get("a") is None and cache.get("c", "gone") == "gone"
+
+
+def test_clear():
+    cache = StatsTTLCache(maxsize=0, ttl=60)  # 0 は 1 件として扱う
+    cache.put("a", 1)
+    cache.clear()
+    assert cache.get("a") is None and cache.stats()["size"] == 0
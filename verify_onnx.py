@@ -0,0 +1,85 @@
+# verify_onnx.py
+# ONNX 埋め込みの一致度（torch 版とのコサイン）と速度を比較する
+#   python verify_onnx.py            # sbert / onnx / onnx-int8 を比較
+#   python verify_onnx.py --n 512    # スループット計測のパッセージ数
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+from app.adapters.embeddings.sbert_embedder import SbertEmbedder
+from app.adapters.embeddings.onnx_embedder import OnnxEmbedder
+
+MODEL_NAME = "intfloat/multilingual-e5-small"
+
+SAMPLES = [
+    "AWS の S3 とは何ですか？",
+    "Pythonのリスト内包表記の使い方を教えてください。",
+    "Streamlit でチャット UI を作るには st.chat_message を使います。",
+    "Chroma は埋め込みベクトルを永続化できるベクトルデータベースです。",
+    "How do I configure the Ollama base URL from Docker?",
+    "EC2 インスタンスのオートスケーリングは、需要に応じて台数を自動で増減させる仕組みです。" * 3,
+    "短い",
+    "RAG (Retrieval-Augmented Generation) combines search results with an LLM prompt.",
+]
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def bench(name: str, emb, passages, queries):
+    # ウォームアップ
+    emb.embed_texts(passages[:8])
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        emb._encode_query(q)  # クエリキャッシュを通さずに計測
+        lat.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    emb.embed_texts(passages)
+    dt = time.perf_counter() - t0
+    lat.sort()
+    print(
+        f"[BENCH] {name:10s} query p50={statistics.median(lat):6.1f}ms "
+        f"p95={lat[int(len(lat) * 0.95) - 1]:6.1f}ms  passages/s={len(passages) / dt:7.1f}"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=256, help="スループット計測のパッセージ数")
+    ap.add_argument("--threads", type=int, default=0, help="onnxruntime のスレッド数")
+    ap.add_argument("--onnx-dir", default="onnx_models")
+    args = ap.parse_args()
+
+    ref = SbertEmbedder(MODEL_NAME, query_cache_size=0)
+    backends = {
+        "onnx": OnnxEmbedder(MODEL_NAME, onnx_dir=args.onnx_dir, threads=args.threads, query_cache_size=0),
+        "onnx-int8": OnnxEmbedder(
+            MODEL_NAME, onnx_dir=args.onnx_dir, quantize=True, threads=args.threads, query_cache_size=0
+        ),
+    }
+
+    # 1) 一致度（パッセージ/クエリ両方）
+    ref_p = np.asarray(ref.embed_texts(SAMPLES))
+    ref_q = np.asarray([ref.embed_query(s) for s in SAMPLES])
+    for name, emb in backends.items():
+        cp = cosine_rows(ref_p, np.asarray(emb.embed_texts(SAMPLES)))
+        cq = cosine_rows(ref_q, np.asarray([emb.embed_query(s) for s in SAMPLES]))
+        print(f"[PARITY] {name:10s} passage cos mean={cp.mean():.5f} min={cp.min():.5f} | "
+              f"query cos mean={cq.mean():.5f} min={cq.min():.5f}")
+
+    # 2) 速度
+    passages = [SAMPLES[i % len(SAMPLES)] + f" ({i})" for i in range(args.n)]
+    queries = [s + "？" for s in SAMPLES] * 4
+    bench("sbert", ref, passages, queries)
+    for name, emb in backends.items():
+        bench(name, emb, passages, queries)
+
+
+if __name__ == "__main__":
+    main()
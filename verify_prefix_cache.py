@@ -0,0 +1,113 @@
+# verify_prefix_cache.py
+# プロンプトの並べ方（legacy / stable）ごとに、長い会話での TTFT と prompt_eval を比較する
+#   python verify_prefix_cache.py --model llama3:8b            # 両レイアウトを比較
+#   python verify_prefix_cache.py --turns 12 --layout stable
+# stable では system+履歴が毎ターン同一なので、Ollama は前ターンの KV キャッシュを再利用し
+# prompt_eval_count（実際に評価したトークン数）が新しい発話分だけに縮む。
+import time
+import argparse
+import statistics
+
+import orjson
+import requests
+
+from app.config.settings import settings
+from app.core.types import Message
+from app.services.chat_orchestrator import ChatOrchestrator
+
+BASE_SYSTEM = (
+    "あなたは日本語で丁寧かつわかりやすく回答するアシスタントです。\n"
+    "必ず日本語で答えてください。英語で出力してはいけません。"
+)
+
+QUESTIONS = [
+    "S3 のストレージクラスの違いを教えてください。",
+    "ライフサイクルルールで何ができますか？",
+    "バージョニングを有効にすると料金はどうなりますか？",
+    "EC2 のオートスケーリングの仕組みは？",
+    "スケールインの保護はどう設定しますか？",
+    "CloudWatch アラームとの連携を説明してください。",
+    "IAM ロールとポリシーの関係は？",
+    "最小権限の原則を守るコツは？",
+]
+
+
+def fake_context(turn: int) -> str:
+    # 実検索の代わりにターンごとに異なる固定長の資料を作る（毎ターン変わる部分）
+    body = f"これは第{turn}ターン用の参考資料です。" * 40
+    return "\n\n---\n\n".join(f"[{i}] 出典: doc{turn}_{i}.md\n{body}" for i in range(1, 5))
+
+
+def chat_once(session, url, model, messages, options, keep_alive):
+    payload = {
+        "model": model,
+        "messages": [m.to_api() for m in messages],
+        "stream": True,
+        "keep_alive": keep_alive,
+        "options": options,
+    }
+    t0 = time.perf_counter()
+    ttft = None
+    parts, last = [], {}
+    with session.post(url, json=payload, stream=True, timeout=(5, 600)) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            data = orjson.loads(line)
+            token = data.get("message", {}).get("content", "")
+            if token and ttft is None:
+                ttft = time.perf_counter() - t0
+            parts.append(token)
+            if data.get("done"):
+                last = data  # 最終レコードに prompt_eval_count などが入る
+    return "".join(parts), (ttft or time.perf_counter() - t0) * 1000, last
+
+
+def run_layout(layout, args, session):
+    orch = ChatOrchestrator(llm=None, retriever=None, base_system_prompt=BASE_SYSTEM, prompt_layout=layout)
+    url = args.url.split(",")[0].rstrip("/") + "/api/chat"
+    options = {"temperature": 0.0, "num_ctx": args.num_ctx, "num_predict": args.num_predict}
+    history = []
+    ttfts = []
+    for turn in range(1, args.turns + 1):
+        q = QUESTIONS[(turn - 1) % len(QUESTIONS)]
+        ctx = fake_context(turn)
+        messages = orch.build_messages(q, history, ctx)
+        reply, ttft, last = chat_once(session, url, args.model, messages, options, args.keep_alive)
+        evaluated = last.get("prompt_eval_count", 0)
+        eval_ms = last.get("prompt_eval_duration", 0) / 1e6
+        print(
+            f"[TTFT] {layout:6s} turn={turn:2d} msgs={len(messages):2d} "
+            f"ttft={ttft:7.1f}ms prompt_eval={evaluated:5d}tok/{eval_ms:7.1f}ms"
+        )
+        if turn > 1:
+            ttfts.append(ttft)  # 1ターン目はコールド
+        history.append(Message(role="user", content=q, context=ctx))
+        history.append(Message(role="assistant", content=reply))
+    return ttfts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default=settings.ollama_url)
+    ap.add_argument("--model", default=settings.default_model)
+    ap.add_argument("--turns", type=int, default=8)
+    ap.add_argument("--layout", choices=["legacy", "stable", "both"], default="both")
+    ap.add_argument("--num-ctx", type=int, default=settings.num_ctx)
+    ap.add_argument("--num-predict", type=int, default=32, help="応答トークン数の上限（計測を短くする）")
+    ap.add_argument("--keep-alive", default=settings.keep_alive)
+    args = ap.parse_args()
+
+    session = requests.Session()
+    layouts = ["legacy", "stable"] if args.layout == "both" else [args.layout]
+    summary = {}
+    for layout in layouts:
+        summary[layout] = run_layout(layout, args, session)
+    for layout, ttfts in summary.items():
+        if ttfts:
+            print(f"[SUMMARY] {layout:6s} ttft p50={statistics.median(ttfts):7.1f}ms (turn>=2)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# verify_startup.py
+# 起動時間の計測（毎回まっさらなプロセスで測る）
+#   python verify_startup.py                 # import / 埋め込み+ベクトルストアの準備 / 重いモジュールの import
+#   python verify_startup.py --preload       # Ollama へのモデル先読みも測る（OLLAMA_URL / DEFAULT_MODEL）
+# UI が最初の画面を出すまでに必要なのは "app_imports" だけで、残りは裏スレッドで進む。
+import sys
+import json
+import argparse
+import subprocess
+
+HEAVY = ("torch", "sentence_transformers", "chromadb", "onnxruntime")
+
+APP_IMPORTS = """
+import sys, time, json
+t0 = time.perf_counter()
+import app.registry.providers, app.registry.warmup, app.services.chat_orchestrator, app.config.settings
+dt = time.perf_counter() - t0
+print(json.dumps({"seconds": dt, "heavy_loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+RETRIEVER = """
+import time, json
+t0 = time.perf_counter()
+from app.config.settings import settings
+from app.core import telemetry
+from app.registry.warmup import start_retriever_warmup
+task = start_retriever_warmup(
+    embed_model=settings.embed_model, chroma_path=settings.chroma_path, embed_backend=settings.embed_backend,
+    vector_store=settings.vector_store, vector_dtype=settings.vector_dtype,
+    onnx_dir=settings.onnx_dir, embed_threads=settings.embed_threads, embed_cache_dir="",
+)
+task.result()
+first = time.perf_counter()
+task.result().retrieve("起動時間の確認", top_k=4)
+print(json.dumps({
+    "seconds": first - t0,
+    "first_query_ms": (time.perf_counter() - first) * 1000,
+    "stages_ms": {r["stage"]: r["p50_ms"] for r in telemetry.STAGES.summary()},
+}))
+"""
+
+EAGER = """
+import time, json
+t0 = time.perf_counter()
+import chromadb, sentence_transformers
+print(json.dumps({"seconds": time.perf_counter() - t0}))
+"""
+
+PRELOAD = """
+import time, json
+from app.config.settings import settings
+from app.registry.providers import build_llm
+llm = build_llm(base_url=settings.ollama_url, health_interval=0)
+t0 = time.perf_counter()
+ok = llm.preload(settings.default_model, settings.keep_alive)
+print(json.dumps({"seconds": time.perf_counter() - t0, "model": settings.default_model, "backends": ok}))
+"""
+
+
+def run(name: str, code: str):
+    p = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    lines = [ln for ln in p.stdout.splitlines() if ln.startswith("{")]
+    if p.returncode != 0 or not lines:
+        print(f"[STARTUP] {name:12s} failed: {p.stderr.strip().splitlines()[-1] if p.stderr.strip() else p.returncode}")
+        return None
+    res = json.loads(lines[-1])
+    print(f"[STARTUP] {name:12s} {json.dumps(res, ensure_ascii=False)}")
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--preload", action="store_true", help="Ollama へのモデル先読みも計測")
+    args = ap.parse_args()
+
+    res = run("app_imports", APP_IMPORTS % (HEAVY,))
+    if res and res["heavy_loaded"]:
+        print(f"[WARN] UI の import で重いモジュールが読み込まれています: {res['heavy_loaded']}")
+    run("eager_import", EAGER)
+    run("retriever", RETRIEVER)
+    if args.preload:
+        run("preload", PRELOAD)
+
+
+if __name__ == "__main__":
+    main()
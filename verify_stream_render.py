@@ -0,0 +1,127 @@
+# verify_stream_render.py
+# 回答1件あたりの Streamlit サーバ側の送信メッセージ数・送信量・CPU 時間を、トークンをまとめる前後で比べる
+#   python verify_stream_render.py                                   # スタブ Ollama（bench.fake_ollama）相手
+#   python verify_stream_render.py --answers 16 --concurrency 8 --num-predict 800 --gen-tps 80
+#   python verify_stream_render.py --url http://localhost:11434 --model llama3:8b   # 実機
+# st.write_stream は yield ごとに「それまでの全文」を markdown 要素の ForwardMsg として送り直すので、
+# 同じ送信をここで再現して数える（streamlit があれば実際の ForwardMsg を protobuf で直列化、無ければ JSON）。
+# CPU はスクリプトスレッド（HTTP 受信 + フレーム化 + 直列化）の thread_time。websocket の送信・ブラウザの
+# 再描画はメッセージ数と送信量に比例するので、その2つを合わせて見る。
+import time
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import orjson
+
+from app.config.settings import settings
+from app.core.streaming import coalesce_chunks
+from app.services.chat_orchestrator import ChatOrchestrator
+from app.adapters.providers.ollama_pool import OllamaPool
+
+
+class StaticRetriever:
+    """検索は計測の対象外（固定の資料を返す）"""
+
+    def retrieve(self, query: str, top_k: int = 6, where=None):
+        return "[1] 出典: doc.md\n計測用の参考資料です。", ["doc.md"]
+
+
+def make_renderer():
+    try:
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        def render(text: str) -> bytes:
+            msg = ForwardMsg()
+            msg.delta.new_element.markdown.body = text
+            return msg.SerializeToString()
+
+        return render, "ForwardMsg"
+    except ImportError:
+        return (lambda text: orjson.dumps({"delta": {"new_element": {"markdown": {"body": text}}}})), "json"
+
+
+def one_answer(orch, model: str, options: dict, flush_ms: float, flush_chars: int, render) -> Dict[str, float]:
+    cpu0 = time.thread_time()
+    t0 = time.perf_counter()
+    turn = orch.run_stream("設定の変更方法を詳しく教えてください。", [], model, options, top_k=4)
+    stats: Dict[str, int] = {}
+    text, n_bytes, render_cpu = "", 0, 0.0
+    t_first = None
+    for chunk in coalesce_chunks(turn.stream, flush_ms, flush_chars, stats=stats):
+        if not chunk.content:
+            continue
+        t_first = t_first or time.perf_counter()
+        text += chunk.content
+        r0 = time.thread_time()
+        n_bytes += len(render(text))  # write_stream と同じく毎回全文
+        render_cpu += time.thread_time() - r0
+    return {
+        "tokens": stats["tokens"],
+        "messages": stats["frames"],
+        "bytes": n_bytes,
+        "cpu_ms": (time.thread_time() - cpu0) * 1000,
+        "render_cpu_ms": render_cpu * 1000,
+        "ttft_ms": ((t_first or time.perf_counter()) - t0) * 1000,
+        "total_ms": (time.perf_counter() - t0) * 1000,
+    }
+
+
+def run_mode(orch, model, options, args, flush_ms: float, render) -> Dict[str, Any]:
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        rows = list(ex.map(
+            lambda _: one_answer(orch, model, options, flush_ms, args.flush_chars, render), range(args.answers)
+        ))
+    n = len(rows)
+    avg = {k: round(sum(r[k] for r in rows) / n, 2) for k in rows[0]}
+    return {"flush_ms": flush_ms, "per_answer": avg}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="トークンのまとめ有無で回答1件あたりのメッセージ数・送信量・CPU を比較")
+    ap.add_argument("--url", default="", help="Ollama の URL（省略時はスタブを起動）")
+    ap.add_argument("--model", default="")
+    ap.add_argument("--answers", type=int, default=8)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--num-predict", type=int, default=600)
+    ap.add_argument("--gen-tps", type=float, default=100.0, help="スタブの生成速度")
+    ap.add_argument("--flush-ms", type=float, default=settings.stream_flush_ms or 50.0)
+    ap.add_argument("--flush-chars", type=int, default=settings.stream_flush_chars)
+    args = ap.parse_args(argv)
+
+    fake = None
+    url, model = args.url, args.model
+    if not url:
+        from bench.fake_ollama import FakeOllama
+        fake = FakeOllama(gen_tps=args.gen_tps).start()
+        url, model = fake.url, model or fake.models[0]
+    llm = OllamaPool([url], max_inflight_per_backend=args.concurrency, health_interval=0)
+    orch = ChatOrchestrator(llm=llm, retriever=StaticRetriever(), base_system_prompt="計測用のアシスタントです。")
+    options = {"temperature": 0.2, "num_ctx": 4096, "num_predict": args.num_predict}
+    render, render_kind = make_renderer()
+
+    results: List[Dict[str, Any]] = []
+    try:
+        run_mode(orch, model, options, args, 0, render)  # ウォームアップ（接続・モデルのロード）
+        for label, ms in (("per_token", 0.0), ("coalesced", args.flush_ms)):
+            res = run_mode(orch, model, options, args, ms, render)
+            res["mode"] = label
+            results.append(res)
+            a = res["per_answer"]
+            print(f"[STREAM] {label:<10} flush={ms:g}ms tokens={a['tokens']:.0f} messages={a['messages']:.0f} "
+                  f"bytes={a['bytes'] / 1024:.1f}KiB cpu={a['cpu_ms']:.1f}ms (render {a['render_cpu_ms']:.1f}ms) "
+                  f"ttft={a['ttft_ms']:.0f}ms total={a['total_ms']:.0f}ms")
+    finally:
+        llm.close()
+        if fake is not None:
+            fake.stop()
+
+    before, after = results[0]["per_answer"], results[1]["per_answer"]
+    ratio = {k: round(after[k] / before[k], 3) if before[k] else None for k in ("messages", "bytes", "cpu_ms")}
+    print(f"[STREAM] after/before {ratio}  (renderer: {render_kind}, answers={args.answers} x{args.concurrency})")
+    print(json.dumps({"renderer": render_kind, "results": results, "ratio": ratio}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()